@@ -0,0 +1,62 @@
+"""ASGI middleware that cancels request handling when the client goes away."""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, MutableMapping
+
+logger = logging.getLogger(__name__)
+
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+
+class CancelOnDisconnectMiddleware:
+    """Cancels an HTTP request's handler as soon as the client disconnects.
+
+    Streaming responses already stop when the client leaves, but a plain
+    request/response endpoint (e.g. chat_poll) keeps running the agent, the
+    LLM calls and the SQL until it has a response nobody will read. This
+    middleware reads the ASGI receive channel itself and cancels the handler
+    on ``http.disconnect``; the cancellation reaches PostgresRunner, which
+    cancels the running query on the server.
+    """
+
+    def __init__(self, app: Callable[..., Awaitable[None]]):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        messages: "asyncio.Queue[Message]" = asyncio.Queue()
+        response_done = False
+
+        async def app_send(message: Message) -> None:
+            nonlocal response_done
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_done = True
+            await send(message)
+
+        async def pump() -> None:
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    if not response_done:
+                        logger.info(f"Client disconnected from {scope.get('path')}, cancelling request")
+                        handler.cancel()
+                    return
+
+        handler = asyncio.ensure_future(self.app(scope, messages.get, app_send))
+        listener = asyncio.ensure_future(pump())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            # Swallowed only when the handler was cancelled because the client left
+            if not handler.cancelled() or asyncio.current_task().cancelling():
+                raise
+        finally:
+            listener.cancel()
+            if not handler.done():
+                handler.cancel()
@@ -0,0 +1,244 @@
+"""Question-to-SQL fast path that answers known questions without the main agent LLM."""
+import logging
+import time
+import uuid
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from vanna.components import (
+    RichTextComponent,
+    SimpleTextComponent,
+    StatusBarUpdateComponent,
+    UiComponent,
+)
+from vanna.core.llm import LlmMessage, LlmRequest, LlmService
+from vanna.core.storage import Conversation, Message
+from vanna.core.tool import ToolCall, ToolContext
+from vanna.core.user import User
+from vanna.core.workflow import DefaultWorkflowHandler, WorkflowResult
+from vanna.capabilities.agent_memory import AgentMemory, ToolMemorySearchResult
+
+from persistent_memory import HashingEmbedder
+from single_flight import normalize_question
+
+if TYPE_CHECKING:
+    from vanna import Agent
+
+logger = logging.getLogger(__name__)
+
+
+ANSWER_PROMPT = """Bạn là trợ lý phân tích dữ liệu cho hệ thống Bất Động Sản.
+Dựa vào câu hỏi và kết quả SQL, trả lời ngắn gọn bằng tiếng Việt.
+- Dữ liệu tiền theo VNĐ (ví dụ: 1500000000 = 1.5 tỷ VNĐ)
+- Bảng kết quả đã được hiển thị cho người dùng, không cần lặp lại toàn bộ
+- Chỉ nêu nhận xét chính, không bịa thêm số liệu"""
+
+
+class FastPathWorkflowHandler(DefaultWorkflowHandler):
+    """Answers questions that closely match a saved correct SQL tool use.
+
+    Before the agent loop starts, the user message is searched in agent
+    memory. A confident match is executed directly through the registered
+    SQL tool and a cheap model phrases the answer, so the main model is
+    skipped entirely. Anything else (no match, SQL error, follow-up turns)
+    falls through to the normal agent.
+
+    A match is confident when it scores at least ``similarity_threshold``
+    and beats the best hit with different SQL by ``min_margin``. With the
+    default HashingEmbedder only exact matches (after normalize_question)
+    count: n-gram vectors barely move when one word changes, so "đã thanh
+    toán" and "chưa thanh toán" score above any usable threshold and the
+    fast path would run the opposite query.
+    """
+
+    def __init__(
+        self,
+        agent_memory: AgentMemory,
+        answer_llm: LlmService,
+        similarity_threshold: float = 0.97,
+        min_margin: float = 0.03,
+        exact_match_only: Optional[bool] = None,
+        tool_name: str = "run_sql",
+        first_turn_only: bool = True,
+        welcome_message: Optional[str] = None,
+    ):
+        """Initialize the fast path.
+
+        Args:
+            agent_memory: Memory holding saved question/SQL pairs
+            answer_llm: Cheap LLM used only to phrase the final answer
+            similarity_threshold: Minimum memory similarity for a fast-path hit
+            min_margin: Minimum lead of the hit over the best hit with other SQL
+            exact_match_only: Only take saved questions equal to the message
+                after normalize_question; None decides from the memory's
+                embedder (True for HashingEmbedder)
+            tool_name: Name of the SQL tool in the registry
+            first_turn_only: Only short-circuit the first message of a
+                conversation, since follow-ups usually depend on context
+            welcome_message: Passed through to DefaultWorkflowHandler
+        """
+        super().__init__(welcome_message=welcome_message)
+        self.agent_memory = agent_memory
+        self.answer_llm = answer_llm
+        self.similarity_threshold = similarity_threshold
+        self.min_margin = min_margin
+        if exact_match_only is None:
+            exact_match_only = isinstance(getattr(agent_memory, "embed_fn", None), HashingEmbedder)
+        self.exact_match_only = exact_match_only
+        self.tool_name = tool_name
+        self.first_turn_only = first_turn_only
+
+        self.stats: Dict[str, float] = {
+            "hits": 0,
+            "misses": 0,
+            "errors": 0,
+            "hit_latency_ms_total": 0.0,
+        }
+
+    async def try_handle(
+        self, agent: "Agent", user: User, conversation: Conversation, message: str
+    ) -> WorkflowResult:
+        """Run the stored SQL for a high-confidence memory match."""
+        result = await super().try_handle(agent, user, conversation, message)
+        if result.should_skip_llm:
+            return result
+
+        if self.first_turn_only and conversation.messages:
+            return WorkflowResult(should_skip_llm=False)
+
+        started = time.perf_counter()
+        context = ToolContext(
+            user=user,
+            conversation_id=conversation.id,
+            request_id=str(uuid.uuid4()),
+            agent_memory=self.agent_memory,
+            observability_provider=agent.observability_provider,
+        )
+
+        match = await self._find_match(message, context)
+        if match is None:
+            await self._count(agent, "misses")
+            return WorkflowResult(should_skip_llm=False)
+
+        tool_call = ToolCall(
+            id=f"fast_path_{uuid.uuid4().hex[:8]}",
+            name=self.tool_name,
+            arguments=match.memory.args,
+        )
+        tool_result = await agent.tool_registry.execute(tool_call, context)
+        if not tool_result.success:
+            # Stored SQL no longer runs (schema drift?) - let the agent fix it
+            logger.warning(f"Fast path SQL failed, falling back to agent: {tool_result.error}")
+            await self._count(agent, "errors")
+            return WorkflowResult(should_skip_llm=False)
+
+        try:
+            response = await self.answer_llm.send_request(
+                LlmRequest(
+                    messages=[
+                        LlmMessage(
+                            role="user",
+                            content=f"Câu hỏi: {message}\n\nKết quả SQL:\n{tool_result.result_for_llm}",
+                        )
+                    ],
+                    user=user,
+                    system_prompt=ANSWER_PROMPT,
+                    temperature=0.1,
+                )
+            )
+        except Exception as e:
+            # Answer LLM timed out or errored - the agent can still answer the question
+            logger.warning(f"Fast path answer failed, falling back to agent: {e}")
+            await self._count(agent, "errors")
+            return WorkflowResult(should_skip_llm=False)
+        answer = response.content or ""
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats["hit_latency_ms_total"] += elapsed_ms
+        await self._count(agent, "hits")
+        if agent.observability_provider:
+            await agent.observability_provider.record_metric(
+                "fast_path.duration", elapsed_ms, "ms",
+                tags={"similarity": f"{match.similarity_score:.2f}"},
+            )
+
+        async def record_turn(conv: Conversation) -> None:
+            # Same shape the agent loop would have stored, so follow-ups have context
+            conv.add_message(Message(role="user", content=message))
+            conv.add_message(Message(role="assistant", content="", tool_calls=[tool_call]))
+            conv.add_message(
+                Message(role="tool", content=tool_result.result_for_llm, tool_call_id=tool_call.id)
+            )
+            if answer:
+                conv.add_message(Message(role="assistant", content=answer))
+
+        components = [
+            UiComponent(  # type: ignore
+                rich_component=StatusBarUpdateComponent(
+                    status="working",
+                    message="Answered from saved query",
+                    detail=f"Matched: {match.memory.question}",
+                )
+            )
+        ]
+        if tool_result.ui_component:
+            components.append(tool_result.ui_component)
+        if answer:
+            components.append(
+                UiComponent(
+                    rich_component=RichTextComponent(content=answer, markdown=True),
+                    simple_component=SimpleTextComponent(text=answer),
+                )
+            )
+
+        return WorkflowResult(
+            should_skip_llm=True,
+            components=components,
+            conversation_mutation=record_turn,
+        )
+
+    async def _find_match(
+        self, message: str, context: ToolContext
+    ) -> Optional[ToolMemorySearchResult]:
+        """Return the saved tool use to run for ``message``, or None if none is confident."""
+        if self.exact_match_only:
+            # Identical normalized text embeds identically, so exact matches score ~1.0
+            matches = await self.agent_memory.search_similar_usage(
+                question=message,
+                context=context,
+                limit=5,
+                similarity_threshold=0.99,
+                tool_name_filter=self.tool_name,
+            )
+            question = normalize_question(message)
+            exact = [m for m in matches if normalize_question(m.memory.question) == question]
+            if not exact or any(m.memory.args != exact[0].memory.args for m in exact):
+                return None
+            return exact[0]
+
+        matches: List[ToolMemorySearchResult] = await self.agent_memory.search_similar_usage(
+            question=message,
+            context=context,
+            limit=5,
+            similarity_threshold=self.similarity_threshold - self.min_margin,
+            tool_name_filter=self.tool_name,
+        )
+        if not matches or matches[0].similarity_score < self.similarity_threshold:
+            return None
+        best = matches[0]
+        # Saved paraphrases of the same SQL do not count against the margin
+        rival = next((m for m in matches[1:] if m.memory.args != best.memory.args), None)
+        if rival is not None and best.similarity_score - rival.similarity_score < self.min_margin:
+            logger.info(
+                f"Fast path skipped: '{best.memory.question}' ({best.similarity_score:.3f}) vs "
+                f"'{rival.memory.question}' ({rival.similarity_score:.3f})"
+            )
+            return None
+        return best
+
+    async def _count(self, agent: "Agent", outcome: str) -> None:
+        """Bump a hit/miss/error counter locally and in observability."""
+        self.stats[outcome] += 1
+        if agent.observability_provider:
+            await agent.observability_provider.record_metric(
+                f"fast_path.{outcome}", 1.0, "count"
+            )
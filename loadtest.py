@@ -0,0 +1,406 @@
+"""Concurrent streaming chat load against the FastAPI server with a mock LLM.
+
+server.py is started in a subprocess with LLM_MOCK=true (ScriptedLlmService
+answering the training questions with their SQL, after a simulated o3
+latency) against a local Postgres, or an already running server is
+targeted with --url. For each concurrency level, that many virtual users
+open chat_sse streams back to back for --duration seconds. Every level
+reports throughput, end-to-end and first-event latency, server event-loop
+lag, pool saturation and pool acquire wait (read from /metrics), giving
+one point per level of the capacity curves.
+
+Usage:
+    python loadtest.py --scale 10 --concurrency 1,4,16,64 --duration 30
+    python loadtest.py --set LLM_MOCK_FIRST_TOKEN_MS=3000 --set POSTGRES_POOL_MAX_SIZE=10
+    python loadtest.py --url http://localhost:8000      # server started with LLM_MOCK=true
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmark import (
+    create_database,
+    fill_database,
+    percentiles_ms,
+    postgres_env,
+    schema_statements,
+    start_local_postgres,
+    training_questions,
+    with_database,
+)
+
+logger = logging.getLogger("loadtest")
+
+
+CHAT_PATH = "/api/vanna/v2/chat_sse"
+
+# Run by the server subprocess; uvicorn directly so host/port can be chosen
+SERVE = (
+    "import sys, uvicorn, server; "
+    "uvicorn.run(server.server.create_app(), host='127.0.0.1', port=int(sys.argv[1]), log_level='warning')"
+)
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)$")
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+Samples = List[Tuple[str, Dict[str, str], float]]
+
+
+def parse_metrics(text: str) -> Samples:
+    """Parse Prometheus text exposition into (name, labels, value) samples."""
+    samples: Samples = []
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match and not line.startswith("#"):
+            labels = dict(_LABEL.findall(match.group(2) or ""))
+            samples.append((match.group(1), labels, float(match.group(3))))
+    return samples
+
+
+def histogram_delta(before: Samples, after: Samples, name: str, **labels: str) -> Dict[str, Any]:
+    """Summarize what a histogram recorded between two scrapes.
+
+    Quantiles are bucket upper bounds, like histogram_quantile() in
+    PromQL: "p99_ms: 25" means 99% of observations were at most 25 ms.
+    """
+
+    def buckets(samples: Samples) -> Dict[float, float]:
+        found: Dict[float, float] = {}
+        for sample, sample_labels, value in samples:
+            if sample == f"{name}_bucket" and all(sample_labels.get(k) == v for k, v in labels.items()):
+                le = float(sample_labels["le"])
+                found[le] = found.get(le, 0.0) + value
+        return found
+
+    def total(samples: Samples) -> float:
+        return sum(
+            value
+            for sample, sample_labels, value in samples
+            if sample == f"{name}_sum" and all(sample_labels.get(k) == v for k, v in labels.items())
+        )
+
+    start, end = buckets(before), buckets(after)
+    cumulative = sorted((le, end[le] - start.get(le, 0.0)) for le in end)
+    count = cumulative[-1][1] if cumulative else 0.0
+    if not count:
+        return {"count": 0}
+
+    def quantile(q: float) -> Optional[float]:
+        for le, seen in cumulative:
+            if seen >= q * count:
+                return None if le == float("inf") else round(le * 1000, 3)
+        return None
+
+    return {
+        "count": int(count),
+        "mean_ms": round((total(after) - total(before)) / count * 1000, 3),
+        "p50_ms": quantile(0.5),
+        "p99_ms": quantile(0.99),
+        "max_ms": quantile(1.0),
+    }
+
+
+class PoolSampler:
+    """Polls /metrics during a level and tracks connections in use per pool."""
+
+    def __init__(self, client: httpx.AsyncClient, interval: float):
+        self.client = client
+        self.interval = interval
+        self.in_use: Dict[str, List[float]] = {}
+        self.size: Dict[str, float] = {}
+        self.max: Dict[str, float] = {}
+        self.http_in_flight = 0.0
+
+    async def run(self) -> None:
+        while True:
+            try:
+                self.record(parse_metrics((await self.client.get("/metrics")).text))
+            except httpx.HTTPError as e:
+                logger.debug(f"Metrics scrape failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def record(self, samples: Samples) -> None:
+        stats: Dict[str, Dict[str, float]] = {}
+        for name, labels, value in samples:
+            if name == "vanna_db_pool_connections":
+                stats.setdefault(labels["pool"], {})[labels["state"]] = value
+            elif name == "vanna_http_requests_in_flight":
+                self.http_in_flight = max(self.http_in_flight, value)
+        for pool, pool_stats in stats.items():
+            size, idle = pool_stats.get("size", 0.0), pool_stats.get("idle", 0.0)
+            self.in_use.setdefault(pool, []).append(size - idle)
+            self.size[pool] = max(self.size.get(pool, 0.0), size)
+            self.max[pool] = pool_stats.get("max", 0.0)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            pool: {
+                "in_use_mean": round(sum(values) / len(values), 2),
+                "in_use_max": max(values),
+                "size_max": self.size[pool],
+                "max": self.max[pool],
+                "saturation_peak": round(max(values) / self.max[pool], 3) if self.max[pool] else None,
+            }
+            for pool, values in self.in_use.items()
+            if values
+        }
+
+
+async def chat(client: httpx.AsyncClient, message: str, conversation_id: Optional[str]) -> Tuple[float, float, Optional[str], bool]:
+    """Send one message over SSE and read the stream to the end.
+
+    Returns:
+        (seconds to first event, seconds to end of stream, conversation ID, ok)
+    """
+    start = time.perf_counter()
+    first = None
+    ok = False
+    payload = {"message": message, "conversation_id": conversation_id}
+    async with client.stream("POST", CHAT_PATH, json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return time.perf_counter() - start, time.perf_counter() - start, conversation_id, False
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            if first is None:
+                first = time.perf_counter() - start
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                ok = True
+                break
+            event = json.loads(data)
+            if event.get("type") == "error":
+                break
+            conversation_id = event.get("conversation_id") or conversation_id
+    end = time.perf_counter() - start
+    return (first if first is not None else end), end, conversation_id, ok
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    questions: List[str],
+    concurrency: int,
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    """Run ``concurrency`` virtual users for ``args.duration`` seconds."""
+    loop = asyncio.get_running_loop()
+    latencies: List[float] = []
+    first_events: List[float] = []
+    errors = 0
+
+    async def user(number: int) -> None:
+        nonlocal errors
+        rng = random.Random(f"{args.seed}:{concurrency}:{number}")
+        while loop.time() < deadline:
+            conversation_id = None
+            for _ in range(args.turns):
+                try:
+                    first, total, conversation_id, ok = await chat(client, rng.choice(questions), conversation_id)
+                except (httpx.HTTPError, json.JSONDecodeError) as e:
+                    logger.debug(f"Chat failed: {e}")
+                    ok, first, total = False, None, None
+                if ok:
+                    latencies.append(total)
+                    first_events.append(first)
+                else:
+                    errors += 1
+                if args.think_ms:
+                    await asyncio.sleep(args.think_ms / 1000)
+
+    before = parse_metrics((await client.get("/metrics")).text)
+    sampler = PoolSampler(client, args.sample_interval)
+    sampling = asyncio.create_task(sampler.run())
+    start = time.perf_counter()
+    deadline = loop.time() + args.duration
+    try:
+        await asyncio.gather(*(user(i) for i in range(concurrency)))
+    finally:
+        elapsed = time.perf_counter() - start
+        sampling.cancel()
+    after = parse_metrics((await client.get("/metrics")).text)
+
+    return {
+        "concurrency": concurrency,
+        "duration_seconds": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 3),
+        "latency": percentiles_ms(latencies) if latencies else None,
+        "first_event": percentiles_ms(first_events) if first_events else None,
+        "event_loop_lag": histogram_delta(before, after, "vanna_event_loop_lag_seconds"),
+        "db_acquire_wait": histogram_delta(before, after, "vanna_stage_duration_seconds", stage="db.acquire"),
+        "pool": sampler.summary(),
+        "http_in_flight_max": sampler.http_in_flight,
+    }
+
+
+async def run(url: str, questions: List[str], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        levels = []
+        for concurrency in args.concurrency:
+            logger.info(f"Running {concurrency} concurrent session(s) for {args.duration}s")
+            level = await run_level(client, questions, concurrency, args)
+            logger.info(
+                f"{concurrency} session(s): {level['throughput_rps']} req/s, "
+                f"p99 {level['latency']['p99_ms'] if level['latency'] else '-'} ms, {level['errors']} error(s)"
+            )
+            levels.append(level)
+        return levels
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(env: Dict[str, str], workdir: str, port: int, timeout: float) -> subprocess.Popen:
+    """Start server.py under uvicorn and wait until its lifespan has finished."""
+    env = {**env, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))}
+    # Server logs go to stderr; stdout is kept for the report
+    process = subprocess.Popen([sys.executable, "-c", SERVE, str(port)], env=env, cwd=workdir, stdout=sys.stderr)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited during start-up with code {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    process.kill()
+    raise SystemExit(f"Server did not come up within {timeout:.0f}s")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    """Stop the server gracefully (lifespan shutdown), killing it if it hangs."""
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="Running server to target (must use LLM_MOCK=true)")
+    parser.add_argument("--dsn", help="Postgres server to use (default: start one with pgserver)")
+    parser.add_argument("--pgdata", help="pgserver data directory to reuse (default: temporary)")
+    parser.add_argument("--database", default="vanna_loadtest", help="Database created for the run")
+    parser.add_argument("--scale", type=float, default=1.0, help="Synthetic data scale (0: schema only)")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(v) for v in value.split(",")],
+        default=[1, 2, 4, 8, 16, 32],
+        help="Comma-separated concurrent sessions per level",
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per level")
+    parser.add_argument("--turns", type=int, default=1, help="Messages per conversation")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pause between a user's messages")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    parser.add_argument("--sample-interval", type=float, default=0.25, help="Seconds between pool samples")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for question choice and LLM latency")
+    parser.add_argument(
+        "--no-fast-path",
+        action="store_true",
+        help="Disable the memory fast path so every question goes through the LLM loop",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Server environment override, e.g. LLM_MOCK_FIRST_TOKEN_MS=3000 (repeatable)",
+    )
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logger.setLevel(logging.INFO)
+    questions = training_questions()
+
+    process = None
+    workdir = None
+    url = args.url
+    if not url:
+        admin_dsn = args.dsn or start_local_postgres(args.pgdata)
+        dsn = with_database(admin_dsn, args.database)
+        asyncio.run(create_database(admin_dsn, args.database, schema_statements()))
+        if args.scale:
+            loaded = asyncio.run(fill_database(dsn, args.scale))
+            logger.info(f"Loaded {sum(loaded.values())} synthetic rows (scale {args.scale})")
+
+        workdir = tempfile.TemporaryDirectory(prefix="vanna-loadtest-")
+        env = dict(os.environ)
+        env.update(postgres_env(dsn))
+        env.update({
+            "LLM_MOCK": "true",
+            "LLM_MOCK_SEED": str(args.seed),
+            "AGENT_MEMORY_PATH": os.path.join(workdir.name, "agent_memory"),
+        })
+        env.pop("AGENT_MEMORY_SNAPSHOT", None)
+        env.setdefault("OPENAI_API_KEY", "loadtest")
+        env.setdefault("LOG_LEVEL", "WARNING")
+        if args.no_fast_path:
+            # Similarity never exceeds 1, so nothing takes the fast path
+            env["FAST_PATH_THRESHOLD"] = "2"
+            env["FAST_PATH_EXACT_MATCH"] = "false"
+        for item in args.set:
+            key, sep, value = item.partition("=")
+            if not sep:
+                parser.error(f"--set expects KEY=VALUE, got {item!r}")
+            env[key] = value
+
+        port = free_port()
+        process = start_server(env, workdir.name, port, timeout=600)
+        url = f"http://127.0.0.1:{port}"
+
+    try:
+        levels = asyncio.run(run(url, questions, args))
+    finally:
+        if process is not None:
+            stop_server(process)
+        if workdir is not None:
+            workdir.cleanup()
+
+    report = {
+        "config": {
+            "url": args.url,
+            "scale": None if args.url else args.scale,
+            "duration": args.duration,
+            "turns": args.turns,
+            "think_ms": args.think_ms,
+            "fast_path": not args.no_fast_path,
+            "questions": len(questions),
+            "overrides": dict(item.split("=", 1) for item in args.set),
+        },
+        "levels": levels,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
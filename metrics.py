@@ -0,0 +1,493 @@
+"""In-process Prometheus metrics, hot-path stage timers, event-loop lag and per-conversation trace IDs."""
+import asyncio
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+from vanna.core.observability import ObservabilityProvider, Span
+from vanna.core.registry import ToolRegistry
+from vanna.core.tool import ToolContext, ToolResult
+
+logger = logging.getLogger(__name__)
+
+
+# Trace ID of the conversation being handled by the current task ("-" outside one)
+trace_id_var: ContextVar[str] = ContextVar("trace_id", default="-")
+
+# Seconds; from a cache hit up to a long o3 turn
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Shared label handling; one series per combination of label values."""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Labels:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. errors per stage."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. operations in flight."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> (per-bucket counts, sum)
+        self._series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self._listeners: List[Callable[[float, Dict[str, str]], None]] = []
+
+    def add_listener(self, listener: Callable[[float, Dict[str, str]], None]) -> None:
+        """Also pass every raw observation (value, labels) to ``listener``.
+
+        Buckets only bound quantiles; the benchmark uses this to keep exact
+        samples. Listeners run on the observing thread and must be cheap.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[float, Dict[str, str]], None]) -> None:
+        self._listeners.remove(listener)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * len(self.buckets), [0.0])
+            counts, total = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+        for listener in self._listeners:
+            listener(value, dict(zip(self.label_names, key)))
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(c), t[0]) for k, (c, t) in self._series.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _CallbackMetric(_Metric):
+    """Gauge or counter whose series are read from a callback at scrape time."""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str],
+        read: Callable[[], Dict[Labels, float]],
+        kind: str,
+    ):
+        super().__init__(name, help, label_names)
+        self.read = read
+        self.kind = kind
+
+    def _samples(self) -> List[str]:
+        try:
+            values = self.read()
+        except Exception as e:
+            logger.debug(f"Metric callback {self.name} failed: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class MetricsRegistry:
+    """Holds metrics and renders them in the Prometheus text format (0.0.4)."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, help, label_names, buckets))
+
+    def callback(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], Dict[Labels, float]],
+        label_names: Sequence[str] = (),
+        kind: str = "gauge",
+    ) -> None:
+        """Register a metric computed on scrape, e.g. pool sizes or cache hit counts.
+
+        Args:
+            name: Metric name
+            help: Help text
+            read: Returns label values (in ``label_names`` order) -> value
+            label_names: Label names of the series
+            kind: "gauge", or "counter" for running totals kept elsewhere
+        """
+        self._add(_CallbackMetric(name, help, label_names, read, kind))
+
+    def render(self) -> str:
+        return "\n".join(line for m in self._metrics.values() for line in m.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "vanna_stage_duration_seconds",
+    "Time spent in each hot-path stage (db.acquire, db.execute, db.convert, memory.search, llm.request, ...)",
+    ["stage"],
+)
+STAGE_IN_FLIGHT = REGISTRY.gauge(
+    "vanna_stage_in_flight", "Operations currently inside each instrumented stage", ["stage"]
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "vanna_stage_errors_total", "Stages that ended with an exception", ["stage"]
+)
+TOOL_SECONDS = REGISTRY.histogram(
+    "vanna_tool_duration_seconds", "Tool call duration by tool and outcome", ["tool", "success"]
+)
+TOOL_IN_FLIGHT = REGISTRY.gauge("vanna_tool_in_flight", "Tool calls currently running", ["tool"])
+AGENT_EVENTS = REGISTRY.counter(
+    "vanna_agent_events_total", "Non-duration agent metrics (errors, counts) by name", ["name"]
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "vanna_http_request_duration_seconds", "HTTP request duration by route", ["method", "route", "status"]
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge("vanna_http_requests_in_flight", "HTTP requests being handled")
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "vanna_event_loop_lag_seconds",
+    "How late a periodic timer ran on the serving event loop",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+def _log_blocking_stack(
+    loop_thread: int,
+    heartbeat: List[float],
+    threshold: float,
+    stop: threading.Event,
+) -> None:
+    """Watchdog thread: log the loop thread's stack while it is stalled.
+
+    ``heartbeat[0]`` is the monotonic time the loop last checked in. Once it
+    is more than ``threshold`` seconds old the loop is stuck in synchronous
+    code right now, so the loop thread's current frame shows the culprit.
+    Each stall is logged once. A loop found inside select() is not
+    blocked by its own code but starved by other threads holding the GIL.
+    """
+    reported = None
+    while not stop.wait(max(threshold / 4, 0.005)):
+        beat = heartbeat[0]
+        stalled = time.monotonic() - beat
+        if stalled < threshold or beat == reported:
+            continue
+        frame = sys._current_frames().get(loop_thread)
+        if frame is None:
+            return
+        reported = beat
+        if frame.f_code.co_name in ("select", "poll") and "selectors" in frame.f_code.co_filename:
+            # Not running anything: the loop is back from select() and waiting for the GIL
+            logger.warning(
+                f"Event loop stalled for {stalled:.3f}s waiting for the GIL; "
+                "another thread is running Python code"
+            )
+            continue
+        stack = "".join(traceback.format_stack(frame))
+        logger.warning(f"Event loop blocked for {stalled:.3f}s so far, in:\n{stack}")
+
+
+async def watch_event_loop_lag(interval: float = 0.1, block_threshold: Optional[float] = None) -> None:
+    """Record how late the loop wakes up from a ``interval`` sleep, until cancelled.
+
+    Anything that blocks the loop (CPU-heavy conversion, sync I/O) delays
+    every other request by the same amount and shows up here. With
+    ``block_threshold`` set, a watchdog thread also logs the stack of any
+    step that holds the loop longer than that many seconds, while it is
+    still running.
+
+    Args:
+        interval: Seconds between lag samples
+        block_threshold: Stall length that gets its stack logged (None = off)
+    """
+    loop = asyncio.get_running_loop()
+    heartbeat = [time.monotonic()]
+    stop = threading.Event()
+    if block_threshold:
+        threading.Thread(
+            target=_log_blocking_stack,
+            args=(threading.get_ident(), heartbeat, interval + block_threshold, stop),
+            name="event-loop-watchdog",
+            daemon=True,
+        ).start()
+    try:
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            heartbeat[0] = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+    finally:
+        stop.set()
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time a block as one hot-path stage and count it as in flight meanwhile.
+
+    Example:
+        with timed("db.execute"):
+            rows = await stmt.fetch()
+    """
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds ``trace_id`` to every log record so log lines can be grouped by conversation."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+class MetricsObservabilityProvider(ObservabilityProvider):
+    """Feeds the Agent's built-in timings into the Prometheus registry.
+
+    The Agent already measures its loop (message handling, LLM requests,
+    prompt building, hooks, conversation load/save) and reports each as an
+    ``agent.*.duration`` / ``llm.*.duration`` metric in milliseconds; those
+    become ``vanna_stage_duration_seconds`` series. Tool timings are
+    recorded by InstrumentedToolRegistry instead, which also tracks them in
+    flight. The ``agent.send_message`` span sets the trace ID for the rest
+    of the turn to the conversation ID.
+    """
+
+    async def record_metric(
+        self,
+        name: str,
+        value: float,
+        unit: str = "",
+        tags: Optional[Dict[str, str]] = None,
+    ) -> None:
+        if name == "agent.tool.duration":
+            return
+        if name.endswith(".duration"):
+            seconds = value / 1000 if unit == "ms" else value
+            STAGE_SECONDS.observe(seconds, stage=name[: -len(".duration")])
+        else:
+            AGENT_EVENTS.inc(value, name=name)
+
+    async def create_span(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> Span:
+        attributes = dict(attributes or {})
+        if name == "agent.send_message":
+            conversation_id = attributes.get("conversation_id")
+            if not conversation_id or conversation_id == "new":
+                conversation_id = uuid.uuid4().hex
+            trace_id_var.set(str(conversation_id))
+        attributes.setdefault("trace_id", trace_id_var.get())
+        return Span(name=name, attributes=attributes)
+
+    async def end_span(self, span: Span) -> None:
+        span.end()
+        logger.debug(f"{span.name} took {span.duration_ms() or 0:.1f} ms")
+
+
+class InstrumentedToolRegistry(ToolRegistry):
+    """ToolRegistry that times every tool call and tracks calls in flight.
+
+    Timing here (rather than from the Agent's spans) still balances the
+    in-flight gauge when a call is cancelled halfway.
+    """
+
+    async def execute(self, tool_call: Any, context: ToolContext) -> ToolResult:
+        tool = tool_call.name
+        TOOL_IN_FLIGHT.inc(tool=tool)
+        start = time.perf_counter()
+        success = False
+        try:
+            result = await super().execute(tool_call, context)
+            success = result.success
+            return result
+        finally:
+            TOOL_SECONDS.observe(time.perf_counter() - start, tool=tool, success=str(success).lower())
+            TOOL_IN_FLIGHT.dec(tool=tool)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording HTTP request duration and requests in flight.
+
+    Requests are labelled with their route template (e.g.
+    ``/api/vanna/v2/chat_sse``), not the raw path, to keep label
+    cardinality bounded.
+    """
+
+    def __init__(self, app: Callable[..., Any]):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        HTTP_IN_FLIGHT.inc()
+        status = "500"
+        start = time.perf_counter()
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "other"
+            HTTP_SECONDS.observe(
+                time.perf_counter() - start, method=scope.get("method", ""), route=template, status=status
+            )
+            HTTP_IN_FLIGHT.dec()
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Starlette endpoint serving the registry in the Prometheus text format."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,192 @@
+"""Deterministic LLM stand-in that answers known questions with scripted tool calls."""
+import asyncio
+import json
+import logging
+import math
+import random
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence, Tuple, Union
+
+from vanna.core.llm import LlmRequest, LlmResponse, LlmService, LlmStreamChunk
+from vanna.core.tool import ToolCall
+
+from single_flight import normalize_question
+
+logger = logging.getLogger(__name__)
+
+
+# A script is the SQL for run_sql, or a list of {"name": ..., "arguments": {...}} tool calls
+Script = Union[str, Sequence[Dict[str, Any]]]
+
+
+@dataclass
+class LatencyModel:
+    """Simulated model timing: lognormal time to first token, then a steady token rate.
+
+    Attributes:
+        first_token_ms: Median time to first token
+        sigma: Lognormal shape of the time to first token; 0 makes it constant
+        tokens_per_second: Output rate after the first token
+        max_first_token_ms: Cap on the lognormal tail
+        chunk_tokens: Tokens per streamed chunk
+    """
+
+    first_token_ms: float = 800.0
+    sigma: float = 0.5
+    tokens_per_second: float = 60.0
+    max_first_token_ms: float = 30000.0
+    chunk_tokens: int = 8
+
+    def first_token_delay(self, rng: random.Random) -> float:
+        """Seconds until the first token."""
+        ms = self.first_token_ms * math.exp(rng.gauss(0.0, self.sigma)) if self.sigma else self.first_token_ms
+        return min(ms, self.max_first_token_ms) / 1000
+
+    def token_delay(self, tokens: int) -> float:
+        """Seconds to emit ``tokens`` output tokens."""
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+
+def _tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class ScriptedLlmService(LlmService):
+    """LlmService that replays scripted tool calls instead of calling a model.
+
+    A user turn whose text matches a scripted question is answered with the
+    script's tool calls, one per LLM turn (a plain SQL script is a single
+    run_sql call); once they have all run, a short answer quoting the last
+    tool result ends the turn. Unknown questions, and requests made without
+    tools (e.g. the fast path phrasing a result), get a plain text reply.
+
+    Without a latency model responses are immediate. With one, each
+    request sleeps (without blocking the loop) for a time to first token
+    and a token-rate-dependent generation time, and streaming responses
+    arrive in chunks. Delays are drawn from a generator seeded by the
+    conversation state, so the same conversation always takes the same time
+    regardless of what else is running.
+    """
+
+    def __init__(
+        self,
+        scripts: Optional[Dict[str, Script]] = None,
+        latency: Optional[LatencyModel] = None,
+        seed: int = 0,
+        tool_name: str = "run_sql",
+        model: str = "scripted",
+    ):
+        """Initialize the service.
+
+        Args:
+            scripts: Question -> SQL (or list of tool calls) to emit for it
+            latency: Simulated timing; None answers immediately
+            seed: Seed for the simulated timing
+            tool_name: Tool a plain SQL script is sent to
+            model: Model name reported in spans
+        """
+        self.scripts: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        self.latency = latency
+        self.seed = seed
+        self.tool_name = tool_name
+        self.model = model
+
+        self.requests = 0
+        self.tool_calls = 0
+        self.unknown_questions = 0
+
+        self.add_scripts(scripts or {})
+
+    def add_scripts(self, scripts: Dict[str, Script]) -> None:
+        """Add or replace scripted questions."""
+        for question, script in scripts.items():
+            if isinstance(script, str):
+                steps = [(self.tool_name, {"sql": script})]
+            else:
+                steps = [(step["name"], dict(step.get("arguments", {}))) for step in script]
+            self.scripts[normalize_question(question)] = steps
+
+    async def send_request(self, request: LlmRequest) -> LlmResponse:
+        """Return the scripted response for the conversation so far."""
+        self.requests += 1
+        content, tool_calls, rng = self._respond(request)
+        if self.latency:
+            tokens = self._output_tokens(content, tool_calls)
+            await asyncio.sleep(self.latency.first_token_delay(rng) + self.latency.token_delay(tokens))
+        return LlmResponse(
+            content=content,
+            tool_calls=tool_calls,
+            finish_reason="tool_calls" if tool_calls else "stop",
+            usage={"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        )
+
+    async def stream_request(
+        self, request: LlmRequest
+    ) -> AsyncGenerator[LlmStreamChunk, None]:
+        """Stream the scripted response, text first and tool calls at the end."""
+        self.requests += 1
+        content, tool_calls, rng = self._respond(request)
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        if not self.latency:
+            yield LlmStreamChunk(content=content, tool_calls=tool_calls, finish_reason=finish_reason)
+            return
+
+        await asyncio.sleep(self.latency.first_token_delay(rng))
+        if content:
+            step = self.latency.chunk_tokens * 4
+            for i in range(0, len(content), step):
+                piece = content[i:i + step]
+                await asyncio.sleep(self.latency.token_delay(_tokens(piece)))
+                yield LlmStreamChunk(content=piece)
+        if tool_calls:
+            await asyncio.sleep(self.latency.token_delay(self._output_tokens(None, tool_calls)))
+        yield LlmStreamChunk(tool_calls=tool_calls, finish_reason=finish_reason)
+
+    async def validate_tools(self, tools: List[Any]) -> List[str]:
+        """Accept any tool set."""
+        return []
+
+    def _respond(
+        self, request: LlmRequest
+    ) -> Tuple[Optional[str], Optional[List[ToolCall]], random.Random]:
+        """Pick the next content/tool calls from the conversation so far."""
+        messages = request.messages
+        user_at = max((i for i, m in enumerate(messages) if m.role == "user"), default=-1)
+        question = (messages[user_at].content or "") if user_at >= 0 else ""
+        # Tool-calling turns since the question = script steps already taken
+        done = sum(1 for m in messages[user_at + 1:] if m.role == "assistant" and m.tool_calls)
+        rng = random.Random(f"{self.seed}:{question}:{done}")
+
+        if user_at < 0:
+            return "Xin chào!", None, rng
+        tool_names = {getattr(tool, "name", None) for tool in request.tools or []}
+        if not tool_names:
+            # Not an agent turn (e.g. the fast path asking for a phrased answer)
+            return "Đây là kết quả cho câu hỏi của bạn.", None, rng
+
+        steps = self.scripts.get(normalize_question(question))
+        if steps is None:
+            if done == 0:
+                self.unknown_questions += 1
+                logger.debug(f"No script for question: {question[:80]!r}")
+            return "Tôi chưa có câu trả lời cho câu hỏi này.", None, rng
+
+        if done < len(steps) and steps[done][0] in tool_names:
+            name, arguments = steps[done]
+            self.tool_calls += 1
+            call = ToolCall(id=f"call_{uuid.uuid4().hex[:12]}", name=name, arguments=arguments)
+            return None, [call], rng
+
+        last = messages[-1]
+        first_line = (last.content or "").strip().splitlines()[:1] if last.role == "tool" else []
+        summary = first_line[0] if first_line else "không có dữ liệu"
+        return f"Kết quả: {summary}", None, rng
+
+    @staticmethod
+    def _output_tokens(content: Optional[str], tool_calls: Optional[List[ToolCall]]) -> int:
+        tokens = _tokens(content) if content else 0
+        for call in tool_calls or []:
+            tokens += _tokens(call.name + json.dumps(call.arguments, ensure_ascii=False))
+        return tokens
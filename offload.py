@@ -0,0 +1,122 @@
+"""Bounded worker pool that keeps CPU-heavy result processing off the event loop."""
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from vanna.core.tool import ToolContext, ToolResult
+from vanna.tools import VisualizeDataTool
+from vanna.tools.visualize_data import VisualizeDataArgs
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ResultOffloader:
+    """Runs result conversion and serialization on worker threads when it is big.
+
+    Turning records into a DataFrame, a DataFrame into CSV and row dicts,
+    or a CSV into chart data is pure CPU. On the event loop a large result
+    stalls every other stream on the process for as long as it takes. Work
+    on at least ``min_cells`` cells (rows x columns) goes to a pool of
+    ``max_workers`` threads instead; smaller work runs inline, where a
+    thread hop would cost more than it saves. Threads rather than
+    processes: asyncpg records and large frames are expensive to pickle,
+    and pandas/numpy release the GIL for much of this work, while the
+    interpreter's switch interval keeps the loop responsive for the rest.
+    """
+
+    def __init__(self, max_workers: int = 2, min_cells: int = 50_000):
+        """Initialize the pool.
+
+        Args:
+            max_workers: Threads doing offloaded work; further work queues
+            min_cells: Smallest input (rows x columns) worth offloading
+        """
+        self.max_workers = max_workers
+        self.min_cells = min_cells
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.offloaded = 0
+        self.inline = 0
+
+    def offloads(self, cells: Optional[int]) -> bool:
+        """Whether work on ``cells`` cells (None = unknown size) goes to the pool."""
+        return cells is None or cells >= self.min_cells
+
+    async def run(self, cells: Optional[int], fn: Callable[..., T], *args: Any) -> T:
+        """Call ``fn(*args)``, on a worker thread if the input is large.
+
+        Args:
+            cells: Size of the input in cells; None always offloads
+            fn: Function to call
+            *args: Its arguments
+
+        Returns:
+            What ``fn`` returned
+        """
+        if not self.offloads(cells):
+            self.inline += 1
+            return fn(*args)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="result-offload")
+        self.offloaded += 1
+        # Copy the context so log lines from the worker keep the trace ID
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def run_coroutine(
+        self, cells: Optional[int], fn: Callable[..., Awaitable[T]], *args: Any
+    ) -> T:
+        """Await ``fn(*args)``, on a private loop in a worker thread if the input is large.
+
+        For async APIs that never actually wait (e.g. RunSqlTool rendering a
+        DataFrame that was already fetched); the coroutine must not touch
+        objects bound to the serving loop.
+
+        Args:
+            cells: Size of the input in cells; None always offloads
+            fn: Coroutine function to run
+            *args: Its arguments
+
+        Returns:
+            What the coroutine returned
+        """
+        if not self.offloads(cells):
+            self.inline += 1
+            return await fn(*args)
+        return await self.run(cells, lambda: asyncio.run(fn(*args)))
+
+    def close(self) -> None:
+        """Stop the worker threads; queued work is dropped."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class OffloadedVisualizeDataTool(VisualizeDataTool):
+    """VisualizeDataTool that parses the CSV and builds the chart on a worker thread.
+
+    Chart preparation (read_csv, plotly figure building, its JSON-ready
+    dict) is CPU-bound even for modest files, and the row count is not
+    known before the file is parsed, so it is always offloaded.
+    """
+
+    def __init__(self, *args: Any, offloader: Optional[ResultOffloader] = None, **kwargs: Any):
+        """Initialize the tool.
+
+        Args:
+            *args: Passed to VisualizeDataTool
+            offloader: Worker pool the chart is built on (defaults to ResultOffloader())
+            **kwargs: Passed to VisualizeDataTool
+        """
+        super().__init__(*args, **kwargs)
+        self.offloader = offloader or ResultOffloader()
+
+    async def execute(self, context: ToolContext, args: VisualizeDataArgs) -> ToolResult:
+        return await self.offloader.run_coroutine(None, super().execute, context, args)
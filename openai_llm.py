@@ -0,0 +1,149 @@
+"""OpenAI LLM service that reports cached vs fresh prompt tokens per call."""
+import logging
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict, Iterator, Optional
+
+from vanna.core.llm import LlmRequest, LlmResponse, LlmStreamChunk
+from vanna.core.observability import ObservabilityProvider
+from vanna.integrations.openai import OpenAILlmService
+
+logger = logging.getLogger(__name__)
+
+
+# Usage of the LLM call running in the current task; filled by _UsageTap
+_call_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("_call_usage", default=None)
+
+
+def _read_usage(usage: Any, into: Dict[str, int]) -> None:
+    """Copy token counts from an OpenAI usage object into a dict."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    into["prompt_tokens"] = int(getattr(usage, "prompt_tokens", 0) or 0)
+    into["completion_tokens"] = int(getattr(usage, "completion_tokens", 0) or 0)
+    into["total_tokens"] = int(getattr(usage, "total_tokens", 0) or 0)
+    into["cached_prompt_tokens"] = int(getattr(details, "cached_tokens", 0) or 0)
+
+
+class _UsageTap:
+    """Stands in for ``client.chat.completions`` and records token usage.
+
+    Streaming calls are made with ``include_usage`` so the final event
+    carries the usage block; prompt_cache_key is added when configured.
+    """
+
+    def __init__(self, completions: Any, prompt_cache_key: Optional[str] = None):
+        self._completions = completions
+        self._prompt_cache_key = prompt_cache_key
+
+    def create(self, **kwargs: Any) -> Any:
+        usage = _call_usage.get()
+        if self._prompt_cache_key:
+            kwargs.setdefault("prompt_cache_key", self._prompt_cache_key)
+
+        if kwargs.get("stream"):
+            kwargs.setdefault("stream_options", {"include_usage": True})
+            return self._tap(self._completions.create(**kwargs), usage)
+
+        resp = self._completions.create(**kwargs)
+        if usage is not None and getattr(resp, "usage", None):
+            _read_usage(resp.usage, usage)
+        return resp
+
+    @staticmethod
+    def _tap(stream: Any, usage: Optional[Dict[str, int]]) -> Iterator[Any]:
+        for event in stream:
+            if usage is not None and getattr(event, "usage", None):
+                _read_usage(event.usage, usage)
+            yield event
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._completions, name)
+
+
+class CachingOpenAILlmService(OpenAILlmService):
+    """OpenAILlmService that accounts for provider-side prompt caching.
+
+    Every call records how many prompt tokens were served from OpenAI's
+    prompt cache and how many were processed fresh, both in ``stats`` and,
+    when an observability provider is given, as metrics. Caching itself is
+    automatic on OpenAI once a request shares a 1024+ token prefix with a
+    recent one; ``prompt_cache_key`` improves the hit rate by routing
+    requests with the same key to the same cache.
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        api_key: Optional[str] = None,
+        prompt_cache_key: Optional[str] = None,
+        observability_provider: Optional[ObservabilityProvider] = None,
+        **kwargs: Any,
+    ):
+        """Initialize the service.
+
+        Args:
+            model: OpenAI model name
+            api_key: API key; falls back to env OPENAI_API_KEY
+            prompt_cache_key: Sent with every request to group cache hits
+            observability_provider: Receives per-call token metrics
+            **kwargs: Passed through to OpenAILlmService
+        """
+        super().__init__(model=model, api_key=api_key, **kwargs)
+        self._client.chat.completions = _UsageTap(self._client.chat.completions, prompt_cache_key)
+        self.observability_provider = observability_provider
+
+        self.stats: Dict[str, int] = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "cached_prompt_tokens": 0,
+            "fresh_prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+
+    async def send_request(self, request: LlmRequest) -> LlmResponse:
+        """Send a non-streaming request and record its token usage."""
+        usage: Dict[str, int] = {}
+        _call_usage.set(usage)
+        response = await super().send_request(request)
+        if usage:
+            response.usage = {**(response.usage or {}), **usage}
+        await self._record(usage)
+        return response
+
+    async def stream_request(
+        self, request: LlmRequest
+    ) -> AsyncGenerator[LlmStreamChunk, None]:
+        """Stream a request and record its token usage once it completes."""
+        usage: Dict[str, int] = {}
+        _call_usage.set(usage)
+        async for chunk in super().stream_request(request):
+            yield chunk
+        await self._record(usage)
+
+    async def _record(self, usage: Dict[str, int]) -> None:
+        """Add one call's usage to the totals and emit metrics."""
+        if not usage:
+            return
+        cached = usage["cached_prompt_tokens"]
+        fresh = usage["prompt_tokens"] - cached
+
+        self.stats["calls"] += 1
+        self.stats["prompt_tokens"] += usage["prompt_tokens"]
+        self.stats["cached_prompt_tokens"] += cached
+        self.stats["fresh_prompt_tokens"] += fresh
+        self.stats["completion_tokens"] += usage["completion_tokens"]
+
+        logger.info(
+            f"LLM call {self.model}: prompt={usage['prompt_tokens']} "
+            f"(cached={cached}, fresh={fresh}) completion={usage['completion_tokens']}"
+        )
+        if self.observability_provider:
+            tags = {"model": self.model}
+            await self.observability_provider.record_metric(
+                "llm.prompt_tokens.cached", cached, "tokens", tags=tags
+            )
+            await self.observability_provider.record_metric(
+                "llm.prompt_tokens.fresh", fresh, "tokens", tags=tags
+            )
+            await self.observability_provider.record_metric(
+                "llm.completion_tokens", usage["completion_tokens"], "tokens", tags=tags
+            )
@@ -0,0 +1,906 @@
+"""Disk-backed AgentMemory with memory-mapped embeddings and an IVF index."""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import unicodedata
+import uuid
+import zlib
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from vanna.capabilities.agent_memory import (
+    AgentMemory,
+    TextMemory,
+    TextMemorySearchResult,
+    ToolMemory,
+    ToolMemorySearchResult,
+)
+from vanna.core.tool import ToolContext
+
+from metrics import timed
+
+
+EmbedFn = Callable[[Sequence[str]], np.ndarray]
+
+# Snapshot file layout: magic, version (u32), header length (u64), JSON header,
+# zero padding to SNAPSHOT_ALIGN, then raw float32 blocks described by the header
+SNAPSHOT_MAGIC = b"VANNAMEM"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGN = 64
+
+
+def seed_hash(question: str, tool_name: str, args: Dict[str, Any]) -> str:
+    """Stable hash identifying one curated training pair."""
+    payload = json.dumps([question, tool_name, args], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class HashingEmbedder:
+    """Dependency-free text embedder based on hashed character n-grams.
+
+    Text is lowercased and stripped of Vietnamese diacritics, then word
+    unigrams and character 3-grams are hashed into a fixed number of signed
+    buckets. Vectors are L2-normalized, so a dot product is the cosine
+    similarity. Good enough to match paraphrases of saved questions; swap in
+    a model-based EmbedFn for real semantic search.
+    """
+
+    def __init__(self, dim: int = 256, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+        text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+        return " ".join(re.findall(r"\w+", text))
+
+    def _features(self, text: str) -> List[str]:
+        norm = self._normalize(text)
+        padded = f" {norm} "
+        grams = [padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1)]
+        return norm.split() + grams
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+class _VectorIndex:
+    """Append-only float32 matrix on disk with an optional IVF coarse index.
+
+    Rows are stored in a memory-mapped file that doubles in capacity when
+    full. Below ``ivf_threshold`` rows, search is an exact scan; above it a
+    spherical k-means quantizer is trained and only the ``nprobe`` closest
+    lists are scanned. The quantizer is retrained when the row count has
+    doubled since the last training.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dim: int,
+        size: int,
+        ivf_threshold: int = 20_000,
+        nprobe: int = 12,
+    ):
+        self.path = path
+        self.dim = dim
+        self.size = size
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+
+        self._vectors: Optional[np.memmap] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: List[np.ndarray] = []
+        self._trained_size = 0
+
+        self._open(max(1024, size))
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._vectors is None else self._vectors.shape[0]
+
+    def _open(self, min_capacity: int) -> None:
+        """Map the vector file, growing it to at least min_capacity rows."""
+        row_bytes = self.dim * 4
+        existing = os.path.getsize(self.path) // row_bytes if os.path.exists(self.path) else 0
+        capacity = max(existing, min_capacity)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.path, "ab") as f:
+            f.truncate(capacity * row_bytes)
+        self._vectors = np.memmap(
+            self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dim)
+        )
+
+    def add(self, vectors: np.ndarray) -> int:
+        """Append vectors and return the row number of the first one."""
+        start = self.size
+        end = start + len(vectors)
+        if end > self.capacity:
+            new_capacity = self.capacity
+            while new_capacity < end:
+                new_capacity *= 2
+            self._open(new_capacity)
+
+        self._vectors[start:end] = vectors
+        self._vectors.flush()
+        self.size = end
+
+        if self._centroids is not None:
+            if self.size >= 2 * self._trained_size:
+                self.train()
+            else:
+                self._assign(np.arange(start, end))
+        elif self.size >= self.ivf_threshold:
+            self.train()
+        return start
+
+    def train(self, iterations: int = 8, seed: int = 0) -> None:
+        """(Re)build the IVF quantizer over all stored rows."""
+        n = self.size
+        if n < self.ivf_threshold:
+            self._centroids = None
+            self._lists = []
+            return
+
+        data = np.asarray(self._vectors[:n])
+        nlist = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample = data[rng.choice(n, size=min(n, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+
+        self.set_centroids(centroids.astype(np.float32), n)
+
+    def load_or_train(self) -> None:
+        """Reuse the quantizer saved by the last train(), retraining if stale."""
+        ivf_path = self.path + ".ivf.npz"
+        if os.path.exists(ivf_path):
+            saved = np.load(ivf_path)
+            trained_size = int(saved["trained_size"])
+            if (
+                saved["centroids"].shape[1] == self.dim
+                and trained_size <= self.size < 2 * trained_size
+            ):
+                self.set_centroids(saved["centroids"], trained_size, persist=False)
+                return
+        self.train()
+
+    def set_centroids(
+        self, centroids: np.ndarray, trained_size: int, persist: bool = True
+    ) -> None:
+        """Install a trained quantizer and assign every stored row to it."""
+        self._centroids = np.asarray(centroids, dtype=np.float32)
+        if persist:
+            np.savez(self.path + ".ivf.npz", centroids=self._centroids, trained_size=trained_size)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists = [np.zeros(0, dtype=np.int64) for _ in range(len(centroids))]
+        self._trained_size = trained_size
+        if self.size:
+            self._assign(np.arange(self.size))
+
+    @property
+    def centroids(self) -> Optional[np.ndarray]:
+        return self._centroids
+
+    @property
+    def trained_size(self) -> int:
+        return self._trained_size
+
+    def vectors(self) -> np.ndarray:
+        """Read-only view of the stored rows."""
+        return self._vectors[: self.size]
+
+    def _assign(self, rows: np.ndarray) -> None:
+        """Put rows into their nearest inverted list."""
+        labels = np.argmax(np.asarray(self._vectors[rows]) @ self._centroids.T, axis=1)
+        self._assignments = np.concatenate([self._assignments, labels.astype(np.int32)])
+        for c in np.unique(labels):
+            self._lists[c] = np.concatenate([self._lists[c], rows[labels == c]])
+
+    def search(
+        self, query: np.ndarray, mask: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (rows, scores) of the k best rows where mask is True."""
+        if self.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if self._centroids is None:
+            candidates = np.flatnonzero(mask[: self.size])
+        else:
+            probe = np.argsort(self._centroids @ query)[::-1][: self.nprobe]
+            candidates = np.concatenate([self._lists[c] for c in probe])
+            candidates = candidates[mask[candidates]]
+
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = np.asarray(self._vectors[candidates]) @ query
+        if len(scores) > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        return candidates[top], scores[top]
+
+    def close(self) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+
+
+class PersistentAgentMemory(AgentMemory):
+    """AgentMemory that survives restarts and stays fast at 100k+ entries.
+
+    - Metadata (question, tool, args, flags) lives in SQLite
+    - Embeddings live in memory-mapped float32 files, one row per memory
+    - Similarity search uses an IVF index once the store is large enough
+    - Deleted memories are tombstoned and skipped by search
+    """
+
+    def __init__(
+        self,
+        path: str = "./agent_memory",
+        embed_fn: Optional[EmbedFn] = None,
+        dim: int = 256,
+        ivf_threshold: int = 20_000,
+        nprobe: int = 12,
+    ):
+        """Open (or create) the memory store.
+
+        Args:
+            path: Directory holding the SQLite database and vector files
+            embed_fn: Batch text embedder returning L2-normalized rows
+                (defaults to HashingEmbedder(dim))
+            dim: Embedding dimension; must match embed_fn
+            ivf_threshold: Row count above which the IVF index is used
+            nprobe: Inverted lists scanned per IVF search
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dim = dim
+        self.embed_fn = embed_fn or HashingEmbedder(dim)
+        self._lock = asyncio.Lock()
+
+        self._db = sqlite3.connect(os.path.join(path, "memory.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tool_memories (
+                row INTEGER PRIMARY KEY,
+                memory_id TEXT UNIQUE NOT NULL,
+                question TEXT NOT NULL,
+                tool_name TEXT NOT NULL,
+                args TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                success INTEGER NOT NULL,
+                metadata TEXT,
+                seed_hash TEXT,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS text_memories (
+                row INTEGER PRIMARY KEY,
+                memory_id TEXT UNIQUE NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            """
+        )
+
+        columns = {c[1] for c in self._db.execute("PRAGMA table_info(tool_memories)")}
+        if "seed_hash" not in columns:
+            self._db.execute("ALTER TABLE tool_memories ADD COLUMN seed_hash TEXT")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS tool_memories_seed_hash ON tool_memories (seed_hash)"
+        )
+        self._db.commit()
+
+        # Per-row filters kept in RAM so search never touches SQLite
+        tool_rows = self._db.execute(
+            "SELECT row, tool_name, success, deleted FROM tool_memories ORDER BY row"
+        ).fetchall()
+        self._tool_names: Dict[str, int] = {}
+        n_tool = tool_rows[-1][0] + 1 if tool_rows else 0
+        self._tool_alive = np.zeros(max(1024, n_tool), dtype=bool)
+        self._tool_ids = np.full(max(1024, n_tool), -1, dtype=np.int32)
+        for row, tool_name, success, deleted in tool_rows:
+            self._tool_alive[row] = bool(success) and not deleted
+            self._tool_ids[row] = self._tool_id(tool_name)
+
+        text_rows = self._db.execute(
+            "SELECT row, deleted FROM text_memories ORDER BY row"
+        ).fetchall()
+        n_text = text_rows[-1][0] + 1 if text_rows else 0
+        self._text_alive = np.zeros(max(1024, n_text), dtype=bool)
+        for row, deleted in text_rows:
+            self._text_alive[row] = not deleted
+
+        self._tool_index = _VectorIndex(
+            os.path.join(path, "tool_vectors.f32"), dim, n_tool, ivf_threshold, nprobe
+        )
+        self._text_index = _VectorIndex(
+            os.path.join(path, "text_vectors.f32"), dim, n_text, ivf_threshold, nprobe
+        )
+        self._tool_index.load_or_train()
+        self._text_index.load_or_train()
+
+    @staticmethod
+    def _now_iso() -> str:
+        return datetime.now().isoformat()
+
+    def _tool_id(self, tool_name: str) -> int:
+        return self._tool_names.setdefault(tool_name, len(self._tool_names))
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int, fill: Any) -> np.ndarray:
+        if size <= len(array):
+            return array
+        grown = np.full(max(size, 2 * len(array)), fill, dtype=array.dtype)
+        grown[: len(array)] = array
+        return grown
+
+    def _embed(self, texts: Sequence[str]) -> np.ndarray:
+        return np.asarray(self.embed_fn(texts), dtype=np.float32)
+
+    @staticmethod
+    def _row_to_tool_memory(row: Tuple[Any, ...]) -> ToolMemory:
+        memory_id, question, tool_name, args, timestamp, success, metadata = row
+        return ToolMemory(
+            memory_id=memory_id,
+            question=question,
+            tool_name=tool_name,
+            args=json.loads(args),
+            timestamp=timestamp,
+            success=bool(success),
+            metadata=json.loads(metadata) if metadata else {},
+        )
+
+    async def save_tool_usage(
+        self,
+        question: str,
+        tool_name: str,
+        args: Dict[str, Any],
+        context: ToolContext,
+        success: bool = True,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Save a tool usage pattern for future reference."""
+        vector = self._embed([question])
+        async with self._lock:
+            self._insert_tool_rows(
+                [(question, tool_name, args, success, metadata, None)], vector
+            )
+
+    async def save_tool_usages(
+        self,
+        items: Sequence[Dict[str, Any]],
+        context: ToolContext,
+        tool_name: str = "run_sql",
+        batch_size: int = 256,
+        max_concurrency: int = 4,
+    ) -> int:
+        """Save many tool usages with batched embedding and a single write.
+
+        Questions are embedded in batches of ``batch_size`` on worker threads,
+        at most ``max_concurrency`` batches at a time, then every row is
+        appended to the vector file and committed to SQLite in one
+        transaction.
+
+        Args:
+            items: Dicts with "question" and "args", and optionally
+                "tool_name", "success", "metadata" and "seed_hash"
+            context: Tool execution context
+            tool_name: Default tool name for items that don't set one
+            batch_size: Questions per embed_fn call
+            max_concurrency: Embedding batches in flight at once
+
+        Returns:
+            Number of memories saved
+        """
+        if not items:
+            return 0
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def embed_batch(start: int) -> np.ndarray:
+            questions = [item["question"] for item in items[start:start + batch_size]]
+            async with semaphore:
+                return await asyncio.to_thread(self._embed, questions)
+
+        batches = await asyncio.gather(
+            *(embed_batch(start) for start in range(0, len(items), batch_size))
+        )
+        vectors = np.concatenate(batches)
+
+        rows = [
+            (
+                item["question"],
+                item.get("tool_name", tool_name),
+                item["args"],
+                item.get("success", True),
+                item.get("metadata"),
+                item.get("seed_hash"),
+            )
+            for item in items
+        ]
+        async with self._lock:
+            self._insert_tool_rows(rows, vectors)
+        return len(rows)
+
+    def _insert_tool_rows(
+        self,
+        items: Sequence[
+            Tuple[str, str, Dict[str, Any], bool, Optional[Dict[str, Any]], Optional[str]]
+        ],
+        vectors: np.ndarray,
+        timestamps: Optional[Sequence[str]] = None,
+        memory_ids: Optional[Sequence[str]] = None,
+    ) -> None:
+        """Append tool memories in one SQLite transaction. Caller holds the lock.
+
+        Each item is (question, tool_name, args, success, metadata, seed_hash).
+        Vectors are written before the rows are committed, so a crash never
+        leaves a row pointing at a missing embedding.
+        """
+        start = self._tool_index.add(vectors)
+        now = self._now_iso()
+        self._db.executemany(
+            "INSERT INTO tool_memories "
+            "(row, memory_id, question, tool_name, args, timestamp, success, metadata, seed_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    start + i,
+                    memory_ids[i] if memory_ids else str(uuid.uuid4()),
+                    question,
+                    tool_name,
+                    json.dumps(args, ensure_ascii=False),
+                    timestamps[i] if timestamps else now,
+                    int(success),
+                    json.dumps(metadata or {}, ensure_ascii=False),
+                    seed_hash,
+                )
+                for i, (question, tool_name, args, success, metadata, seed_hash) in enumerate(items)
+            ],
+        )
+        self._db.commit()
+
+        end = start + len(items)
+        self._tool_alive = self._grow(self._tool_alive, end, False)
+        self._tool_ids = self._grow(self._tool_ids, end, -1)
+        for i, (_, tool_name, _, success, _, _) in enumerate(items):
+            self._tool_alive[start + i] = success
+            self._tool_ids[start + i] = self._tool_id(tool_name)
+
+    def _insert_text_rows(
+        self, memories: Sequence[TextMemory], vectors: np.ndarray
+    ) -> None:
+        """Append text memories in one SQLite transaction. Caller holds the lock."""
+        start = self._text_index.add(vectors)
+        self._db.executemany(
+            "INSERT INTO text_memories (row, memory_id, content, timestamp) VALUES (?, ?, ?, ?)",
+            [
+                (start + i, m.memory_id, m.content, m.timestamp)
+                for i, m in enumerate(memories)
+            ],
+        )
+        self._db.commit()
+
+        end = start + len(memories)
+        self._text_alive = self._grow(self._text_alive, end, False)
+        self._text_alive[start:end] = True
+
+    async def save_text_memory(self, content: str, context: ToolContext) -> TextMemory:
+        """Store a free-form text memory."""
+        memory = TextMemory(
+            memory_id=str(uuid.uuid4()), content=content, timestamp=self._now_iso()
+        )
+        vector = self._embed([content])
+        async with self._lock:
+            self._insert_text_rows([memory], vector)
+        return memory
+
+    async def search_similar_usage(
+        self,
+        question: str,
+        context: ToolContext,
+        *,
+        limit: int = 10,
+        similarity_threshold: float = 0.7,
+        tool_name_filter: Optional[str] = None,
+    ) -> List[ToolMemorySearchResult]:
+        """Search for similar tool usage patterns based on a question."""
+        with timed("memory.search"):
+            query = self._embed([question])[0]
+
+            mask = self._tool_alive
+            if tool_name_filter is not None:
+                tool_id = self._tool_names.get(tool_name_filter)
+                if tool_id is None:
+                    return []
+                mask = mask & (self._tool_ids == tool_id)
+
+            rows, scores = self._tool_index.search(query, mask, limit)
+            keep = scores >= similarity_threshold
+            rows, scores = rows[keep], scores[keep]
+            if len(rows) == 0:
+                return []
+
+            placeholders = ",".join("?" * len(rows))
+            by_row = {
+                r[0]: r[1:]
+                for r in self._db.execute(
+                    "SELECT row, memory_id, question, tool_name, args, timestamp, success, metadata "
+                    f"FROM tool_memories WHERE row IN ({placeholders})",
+                    [int(r) for r in rows],
+                )
+            }
+            return [
+                ToolMemorySearchResult(
+                    memory=self._row_to_tool_memory(by_row[int(row)]),
+                    similarity_score=float(min(score, 1.0)),
+                    rank=rank,
+                )
+                for rank, (row, score) in enumerate(zip(rows, scores), start=1)
+            ]
+
+    async def search_text_memories(
+        self,
+        query: str,
+        context: ToolContext,
+        *,
+        limit: int = 10,
+        similarity_threshold: float = 0.7,
+    ) -> List[TextMemorySearchResult]:
+        """Search stored text memories based on a query."""
+        with timed("memory.search_text"):
+            vector = self._embed([query])[0]
+            rows, scores = self._text_index.search(vector, self._text_alive, limit)
+            keep = scores >= similarity_threshold
+            rows, scores = rows[keep], scores[keep]
+            if len(rows) == 0:
+                return []
+
+            placeholders = ",".join("?" * len(rows))
+            by_row = {
+                r[0]: TextMemory(memory_id=r[1], content=r[2], timestamp=r[3])
+                for r in self._db.execute(
+                    f"SELECT row, memory_id, content, timestamp FROM text_memories WHERE row IN ({placeholders})",
+                    [int(r) for r in rows],
+                )
+            }
+            return [
+                TextMemorySearchResult(
+                    memory=by_row[int(row)], similarity_score=float(min(score, 1.0)), rank=rank
+                )
+                for rank, (row, score) in enumerate(zip(rows, scores), start=1)
+            ]
+
+    async def get_recent_memories(
+        self, context: ToolContext, limit: int = 10
+    ) -> List[ToolMemory]:
+        """Get recently added memories. Returns most recent memories first."""
+        rows = self._db.execute(
+            "SELECT memory_id, question, tool_name, args, timestamp, success, metadata "
+            "FROM tool_memories WHERE deleted = 0 ORDER BY row DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [self._row_to_tool_memory(r) for r in rows]
+
+    async def get_recent_text_memories(
+        self, context: ToolContext, limit: int = 10
+    ) -> List[TextMemory]:
+        """Fetch recently stored text memories."""
+        rows = self._db.execute(
+            "SELECT memory_id, content, timestamp FROM text_memories "
+            "WHERE deleted = 0 ORDER BY row DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [TextMemory(memory_id=r[0], content=r[1], timestamp=r[2]) for r in rows]
+
+    async def delete_by_id(self, context: ToolContext, memory_id: str) -> bool:
+        """Delete a memory by its ID. Returns True if deleted, False if not found."""
+        async with self._lock:
+            found = self._db.execute(
+                "SELECT row FROM tool_memories WHERE memory_id = ? AND deleted = 0",
+                (memory_id,),
+            ).fetchone()
+            if not found:
+                return False
+            self._db.execute("UPDATE tool_memories SET deleted = 1 WHERE row = ?", found)
+            self._db.commit()
+            self._tool_alive[found[0]] = False
+            return True
+
+    async def delete_text_memory(self, context: ToolContext, memory_id: str) -> bool:
+        """Delete a text memory by its ID. Returns True if deleted, False if not found."""
+        async with self._lock:
+            found = self._db.execute(
+                "SELECT row FROM text_memories WHERE memory_id = ? AND deleted = 0",
+                (memory_id,),
+            ).fetchone()
+            if not found:
+                return False
+            self._db.execute("UPDATE text_memories SET deleted = 1 WHERE row = ?", found)
+            self._db.commit()
+            self._text_alive[found[0]] = False
+            return True
+
+    async def clear_memories(
+        self,
+        context: ToolContext,
+        tool_name: Optional[str] = None,
+        before_date: Optional[str] = None,
+    ) -> int:
+        """Clear stored memories (tool or text). Returns number of memories deleted."""
+        async with self._lock:
+            where = ["deleted = 0"]
+            params: List[Any] = []
+            if tool_name:
+                where.append("tool_name = ?")
+                params.append(tool_name)
+            if before_date:
+                where.append("timestamp < ?")
+                params.append(before_date)
+
+            tool_rows = [
+                r[0]
+                for r in self._db.execute(
+                    f"SELECT row FROM tool_memories WHERE {' AND '.join(where)}", params
+                )
+            ]
+            self._db.execute(
+                f"UPDATE tool_memories SET deleted = 1 WHERE {' AND '.join(where)}", params
+            )
+            self._tool_alive[tool_rows] = False
+            deleted = len(tool_rows)
+
+            # Text memories have no tool name; only clear them when not filtering by tool
+            if not tool_name:
+                text_where = ["deleted = 0"] + (["timestamp < ?"] if before_date else [])
+                text_params = [before_date] if before_date else []
+                text_rows = [
+                    r[0]
+                    for r in self._db.execute(
+                        f"SELECT row FROM text_memories WHERE {' AND '.join(text_where)}",
+                        text_params,
+                    )
+                ]
+                self._db.execute(
+                    f"UPDATE text_memories SET deleted = 1 WHERE {' AND '.join(text_where)}",
+                    text_params,
+                )
+                self._text_alive[text_rows] = False
+                deleted += len(text_rows)
+
+            self._db.commit()
+            return deleted
+
+    async def sync_seed_data(
+        self,
+        items: Sequence[Dict[str, Any]],
+        context: ToolContext,
+        tool_name: str = "run_sql",
+        source: str = "pre_training",
+    ) -> Tuple[int, int]:
+        """Make the stored seed pairs match a curated training set.
+
+        Pairs are identified by seed_hash(), so only new or edited pairs are
+        embedded and written. Previously seeded pairs that are no longer in
+        ``items`` are tombstoned. Memories learned at runtime are untouched.
+
+        Args:
+            items: Dicts with "question" and "args" keys
+            context: Tool execution context
+            tool_name: Tool the pairs belong to
+            source: Value stored under metadata["source"]
+
+        Returns:
+            (added, removed) counts
+        """
+        wanted = {
+            seed_hash(item["question"], tool_name, item["args"]): item for item in items
+        }
+        existing = {
+            h: row
+            for row, h in self._db.execute(
+                "SELECT row, seed_hash FROM tool_memories "
+                "WHERE seed_hash IS NOT NULL AND deleted = 0"
+            )
+        }
+
+        new_hashes = [h for h in wanted if h not in existing]
+        stale_rows = [row for h, row in existing.items() if h not in wanted]
+        # Seed rows written before hashes were tracked get replaced once
+        stale_rows += [
+            row
+            for (row,) in self._db.execute(
+                "SELECT row FROM tool_memories WHERE seed_hash IS NULL AND deleted = 0 "
+                "AND json_extract(metadata, '$.source') = ?",
+                (source,),
+            )
+        ]
+
+        await self.save_tool_usages(
+            [
+                {
+                    "question": wanted[h]["question"],
+                    "args": wanted[h]["args"],
+                    "metadata": {"source": source},
+                    "seed_hash": h,
+                }
+                for h in new_hashes
+            ],
+            context,
+            tool_name=tool_name,
+        )
+
+        if stale_rows:
+            async with self._lock:
+                self._db.executemany(
+                    "UPDATE tool_memories SET deleted = 1 WHERE row = ?",
+                    [(row,) for row in stale_rows],
+                )
+                self._db.commit()
+                self._tool_alive[stale_rows] = False
+
+        return len(new_hashes), len(stale_rows)
+
+    def is_empty(self) -> bool:
+        """True when the store holds no live tool or text memories."""
+        return not (self._tool_alive.any() or self._text_alive.any())
+
+    async def save_snapshot(self, file: str) -> None:
+        """Write every live memory and its embedding to a versioned snapshot file.
+
+        Tombstoned rows are dropped, so a snapshot also compacts the store.
+        The file is written to a temporary name and renamed into place.
+        """
+        async with self._lock:
+            tool_rows = self._db.execute(
+                "SELECT row, memory_id, question, tool_name, args, timestamp, success, metadata, seed_hash "
+                "FROM tool_memories WHERE deleted = 0 ORDER BY row"
+            ).fetchall()
+            text_rows = self._db.execute(
+                "SELECT row, memory_id, content, timestamp "
+                "FROM text_memories WHERE deleted = 0 ORDER BY row"
+            ).fetchall()
+
+            blocks: List[np.ndarray] = [
+                self._tool_index.vectors()[[r[0] for r in tool_rows]],
+                self._text_index.vectors()[[r[0] for r in text_rows]],
+            ]
+            header: Dict[str, Any] = {
+                "version": SNAPSHOT_VERSION,
+                "dim": self.dim,
+                "created_at": self._now_iso(),
+                "tool_memories": [list(r[1:]) for r in tool_rows],
+                "text_memories": [list(r[1:]) for r in text_rows],
+                "blocks": ["tool_vectors", "text_vectors"],
+            }
+            for name, index in (("tool", self._tool_index), ("text", self._text_index)):
+                if index.centroids is not None:
+                    blocks.append(index.centroids)
+                    header["blocks"].append(f"{name}_centroids")
+                    header[f"{name}_trained_size"] = index.trained_size
+            header["shapes"] = [list(b.shape) for b in blocks]
+
+        encoded = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        prefix = len(SNAPSHOT_MAGIC) + 12 + len(encoded)
+        padding = -prefix % SNAPSHOT_ALIGN
+
+        tmp = f"{file}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack("<IQ", SNAPSHOT_VERSION, len(encoded)))
+            f.write(encoded)
+            f.write(b"\0" * padding)
+            for block in blocks:
+                f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, file)
+
+    async def restore_snapshot(self, file: str) -> int:
+        """Load a snapshot written by save_snapshot() into this empty store.
+
+        Embedding blocks are memory-mapped straight from the snapshot and
+        copied into the store's vector files; nothing is re-embedded and the
+        saved IVF quantizer is reused.
+
+        Returns:
+            Number of memories restored
+
+        Raises:
+            ValueError: If the store is not empty or the snapshot is
+                unreadable, from another version or another dimension
+        """
+        if not self.is_empty():
+            raise ValueError("Snapshots can only be restored into an empty memory store")
+
+        with open(file, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"{file} is not an agent memory snapshot")
+            version, header_len = struct.unpack("<IQ", f.read(12))
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version {version}")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        if header["dim"] != self.dim:
+            raise ValueError(f"Snapshot dimension {header['dim']} != store dimension {self.dim}")
+
+        offset = len(SNAPSHOT_MAGIC) + 12 + header_len
+        offset += -offset % SNAPSHOT_ALIGN
+        blocks: Dict[str, np.ndarray] = {}
+        for name, shape in zip(header["blocks"], header["shapes"]):
+            count = int(np.prod(shape))
+            blocks[name] = (
+                np.memmap(file, dtype=np.float32, mode="r", offset=offset, shape=tuple(shape))
+                if count
+                else np.zeros(shape, dtype=np.float32)
+            )
+            offset += count * 4
+
+        async with self._lock:
+            for name, index in (("tool", self._tool_index), ("text", self._text_index)):
+                if f"{name}_centroids" in blocks:
+                    index.set_centroids(
+                        np.array(blocks[f"{name}_centroids"]), header[f"{name}_trained_size"]
+                    )
+
+            tool_memories = header["tool_memories"]
+            if tool_memories:
+                self._insert_tool_rows(
+                    [
+                        (question, tool_name, json.loads(args), bool(success),
+                         json.loads(metadata) if metadata else {}, seed)
+                        for _, question, tool_name, args, _, success, metadata, seed in tool_memories
+                    ],
+                    blocks["tool_vectors"],
+                    timestamps=[r[4] for r in tool_memories],
+                    memory_ids=[r[0] for r in tool_memories],
+                )
+
+            text_memories = header["text_memories"]
+            if text_memories:
+                self._insert_text_rows(
+                    [
+                        TextMemory(memory_id=memory_id, content=content, timestamp=timestamp)
+                        for memory_id, content, timestamp in text_memories
+                    ],
+                    blocks["text_vectors"],
+                )
+
+        return len(tool_memories) + len(text_memories)
+
+    def close(self) -> None:
+        """Flush vector files and close the database."""
+        self._tool_index.close()
+        self._text_index.close()
+        self._db.close()
@@ -1,14 +1,168 @@
 """PostgreSQL database runner for Vanna AI."""
 import pandas as pd
-from typing import Optional
+from pandas.api.types import union_categoricals
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
 from vanna.capabilities.sql_runner import SqlRunner, RunSqlToolArgs
 from vanna.core.tool import ToolContext
 import asyncpg
 import asyncio
+import logging
+
+from metrics import timed
+from offload import ResultOffloader
+from pg_types import DtypeMapper
+from single_flight import SingleFlight
+from sql_classifier import parse_statements, sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class ResultLimitExceeded(Exception):
+    """Raised when a streamed result grows past the configured row/byte cap."""
+
+
+class WriteNotAllowed(Exception):
+    """Raised for statements that modify data when the runner is read-only."""
+
+
+class ReplicaUnavailable(Exception):
+    """Raised when no replica is healthy enough for a read and the primary is off limits."""
+
+
+# Seconds a replica is behind the primary; 0 when it has replayed everything it received
+REPLICA_LAG_SQL = """SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END"""
+
+
+def records_to_dataframe(
+    records: List[asyncpg.Record],
+    attributes: Sequence[asyncpg.Attribute],
+    dtype_mapper: Optional[DtypeMapper] = None,
+) -> pd.DataFrame:
+    """Build a DataFrame column by column from asyncpg records.
+    
+    Records are transposed in a single pass and each column is materialized
+    with a dtype chosen from the statement's attribute types, so pandas does
+    not have to re-infer fixed-width columns.
+    
+    Args:
+        records: Rows returned by a prepared statement or cursor
+        attributes: Result attributes from PreparedStatement.get_attributes()
+        dtype_mapper: Type mapping to apply (defaults to DtypeMapper())
+        
+    Returns:
+        pandas DataFrame with one column per attribute
+    """
+    names = [attr.name for attr in attributes]
+    if not records:
+        return pd.DataFrame(columns=names)
+    
+    dtype_mapper = dtype_mapper or DtypeMapper()
+    data = {
+        i: dtype_mapper.convert(dtype_mapper.kind_for(attr), values)
+        for i, (attr, values) in enumerate(zip(attributes, zip(*records)))
+    }
+    
+    df = pd.DataFrame(data, copy=False)
+    # Positional keys keep duplicate column names (e.g. a.id, b.id) intact
+    df.columns = names
+    return df
+
+
+def _sized_dataframe(
+    records: List[asyncpg.Record],
+    attributes: Sequence[asyncpg.Attribute],
+    dtype_mapper: DtypeMapper,
+) -> Tuple[pd.DataFrame, int]:
+    """records_to_dataframe plus the frame's in-memory size, for the byte cap."""
+    df = records_to_dataframe(records, attributes, dtype_mapper)
+    return df, int(df.memory_usage(deep=True).sum())
+
+
+def concat_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate streamed chunks, keeping categorical columns categorical.
+    
+    Each chunk builds its categoricals from its own values, and pd.concat
+    turns a column whose chunks have different categories back into
+    object dtype. The categories are unified first, so only the small
+    codes arrays are concatenated.
+    
+    Args:
+        chunks: DataFrames with the same columns, as yielded by stream_sql
+        
+    Returns:
+        One DataFrame with a fresh index
+    """
+    for i, dtype in enumerate(chunks[0].dtypes):
+        if not isinstance(dtype, pd.CategoricalDtype):
+            continue
+        columns = [chunk.iloc[:, i] for chunk in chunks]
+        if all(column.dtype == dtype for column in columns):
+            continue
+        categories = union_categoricals(columns, ignore_order=True).categories
+        for chunk, column in zip(chunks, columns):
+            # Positional, so duplicate column names (a.id, b.id) are fine
+            chunk.isetitem(i, column.cat.set_categories(categories))
+    return pd.concat(chunks, ignore_index=True)
+
+
+class PreparingConnection(asyncpg.Connection):
+    """asyncpg connection whose prepared statements outlive a pool checkout.
+    
+    ``Connection.prepare()`` bypasses asyncpg's statement cache and its
+    result is invalidated when the connection goes back to the pool, so
+    every query would be parsed and planned again. Statements prepared
+    here go through the per-connection cache instead: pools created by
+    PostgresRunner use this class and fill the cache from their ``init``
+    callback, so each new pooled connection is warm before its first query.
+    """
+    
+    async def keep_prepared(self, statements: Sequence[str]) -> int:
+        """Prepare statements into the connection's statement cache.
+        
+        Statements that no longer plan (e.g. a table was dropped) are
+        skipped with a debug log.
+        
+        Args:
+            statements: SQL statements to prepare
+            
+        Returns:
+            Number of statements prepared
+        """
+        prepared = 0
+        for sql in statements:
+            try:
+                await self.prepare_cached(sql)
+                prepared += 1
+            except asyncpg.PostgresError as e:
+                logger.debug(f"Skipping warm statement: {e}")
+        return prepared
+    
+    async def prepare_cached(self, sql: str) -> asyncpg.prepared_stmt.PreparedStatement:
+        """Prepare ``sql`` through the statement cache; a cache hit costs no round trip."""
+        return await self._prepare(sql, use_cache=True)
+    
+    def forget_prepared(self) -> None:
+        """Drop cached statements after a schema change made their plans stale."""
+        self._drop_local_statement_cache()
 
 
 class PostgresRunner(SqlRunner):
-    """PostgreSQL implementation of SqlRunner using asyncpg."""
+    """PostgreSQL implementation of SqlRunner using asyncpg.
+    
+    With ``replicas`` configured, reads run in READ ONLY transactions on a
+    replica picked round-robin or by fewest in-flight queries, skipping any
+    replica more than ``max_replica_lag`` seconds behind. Writes and
+    get_pool() callers (e.g. rollup refreshes) always use the primary; reads
+    fall back to it only when ``allow_primary_reads`` is set.
+    
+    Concurrent run_sql calls for the same read (same normalized SQL and
+    timeouts) share one execution unless ``coalesce_reads`` is off.
+    """
     
     def __init__(
         self,
@@ -17,6 +171,22 @@ class PostgresRunner(SqlRunner):
         database: str = "vanna",
         user: str = "postgres",
         password: str = "secret",
+        streaming: bool = False,
+        chunk_size: int = 10_000,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        dtype_mapper: Optional[DtypeMapper] = None,
+        statement_timeout: Optional[float] = None,
+        lock_timeout: Optional[float] = None,
+        replicas: Optional[Sequence[str]] = None,
+        replica_selection: str = "least_loaded",
+        max_replica_lag: Optional[float] = 30.0,
+        allow_primary_reads: bool = False,
+        lag_check_interval: float = 5.0,
+        allow_writes: bool = True,
+        session_settings: Optional[Dict[str, str]] = None,
+        coalesce_reads: bool = True,
+        offloader: Optional[ResultOffloader] = None,
         **kwargs
     ):
         """Initialize PostgreSQL connection parameters.
@@ -27,17 +197,83 @@ class PostgresRunner(SqlRunner):
             database: Database name
             user: Database user
             password: Database password
-            **kwargs: Additional connection parameters
+            streaming: Read SELECT results through a server-side cursor
+            chunk_size: Rows fetched per cursor round trip
+            max_rows: Row cap for streamed results (None = unlimited)
+            max_bytes: In-memory size cap for streamed results (None = unlimited)
+            dtype_mapper: Postgres-to-pandas type mapping for result columns
+            statement_timeout: Seconds a single query may run (None = server default)
+            lock_timeout: Seconds a query may wait for a lock (None = server default)
+            replicas: DSNs of read replicas, credentials included
+            replica_selection: "least_loaded" or "round_robin"
+            max_replica_lag: Seconds of replication lag above which a replica
+                is skipped (None = no ceiling)
+            allow_primary_reads: Send reads to the primary when no replica is
+                usable; always true when no replicas are configured
+            lag_check_interval: Seconds a replica's measured lag is reused
+            allow_writes: Run statements that modify data or schema; when
+                False they are rejected before reaching the database
+            session_settings: Session parameters set on every pooled connection
+                (e.g. application_name, work_mem); sent at connect time, so the
+                pool's RESET ALL keeps them
+            coalesce_reads: Let identical concurrent reads share one
+                execution and its result
+            offloader: Worker pool for converting large results off the
+                event loop (defaults to ResultOffloader())
+            **kwargs: Additional connection parameters (min_size, max_size, ...)
         """
+        if replica_selection not in ("least_loaded", "round_robin"):
+            raise ValueError(f"Unknown replica_selection: {replica_selection}")
+        
         self.host = host
         self.port = port
         self.database = database
         self.user = user
         self.password = password
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.dtype_mapper = dtype_mapper or DtypeMapper()
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        self.replicas = list(replicas or [])
+        self.replica_selection = replica_selection
+        self.max_replica_lag = max_replica_lag
+        self.allow_primary_reads = allow_primary_reads or not self.replicas
+        self.lag_check_interval = lag_check_interval
+        self.allow_writes = allow_writes
+        self.session_settings = dict(session_settings or {})
+        self.coalesce_reads = coalesce_reads
+        self.read_flights = SingleFlight("sql")
+        self.offloader = offloader or ResultOffloader()
         self.kwargs = kwargs
+        # Read statements every pooled connection prepares when it opens
+        self.warm_statements: List[str] = []
         self._pool: Optional[asyncpg.Pool] = None
+        self._replica_pools: Dict[str, asyncpg.Pool] = {}
+        # dsn -> (lag in seconds or None if unreachable, checked_at)
+        self._replica_lag: Dict[str, Tuple[Optional[float], float]] = {}
+        # dsn -> queries currently holding a connection
+        self._in_flight: Dict[str, int] = {dsn: 0 for dsn in self.replicas}
+        self._next_replica = 0
     
-    async def _get_pool(self) -> asyncpg.Pool:
+    def _pool_options(self) -> Dict:
+        """Keyword arguments shared by the primary and replica pools."""
+        options = dict(self.kwargs)
+        options["server_settings"] = {**self.session_settings, **options.get("server_settings", {})}
+        options.setdefault("connection_class", PreparingConnection)
+        # Room for the warm statements plus asyncpg's default 100 ad-hoc ones
+        options.setdefault("statement_cache_size", len(self.warm_statements) + 100)
+        options.setdefault("init", self._init_connection)
+        return options
+    
+    async def _init_connection(self, conn: asyncpg.Connection) -> None:
+        """Prepare the warm statements on a newly opened pooled connection."""
+        if self.warm_statements and isinstance(conn, PreparingConnection):
+            await conn.keep_prepared(self.warm_statements)
+    
+    async def get_pool(self) -> asyncpg.Pool:
         """Get or create connection pool."""
         if self._pool is None:
             self._pool = await asyncpg.create_pool(
@@ -46,60 +282,478 @@ class PostgresRunner(SqlRunner):
                 database=self.database,
                 user=self.user,
                 password=self.password,
-                **self.kwargs
+                **self._pool_options()
             )
         return self._pool
     
+    async def _get_replica_pool(self, dsn: str) -> asyncpg.Pool:
+        """Get or create the connection pool for one replica."""
+        pool = self._replica_pools.get(dsn)
+        if pool is None:
+            pool = await asyncpg.create_pool(dsn=dsn, **self._pool_options())
+            self._replica_pools[dsn] = pool
+        return pool
+    
+    async def start(self, warm_statements: Sequence[str] = ()) -> None:
+        """Open the pools up front so the first query pays no connection setup.
+        
+        asyncpg opens ``min_size`` connections when a pool is created; each
+        one gets the session settings and prepares the read-only statements
+        in ``warm_statements``. Call this from the serving event loop (e.g.
+        a FastAPI lifespan) and pair it with close().
+        
+        Args:
+            warm_statements: Frequent queries to keep prepared per connection;
+                anything that is not a single read query is ignored
+                
+        Raises:
+            OSError, asyncpg.PostgresError: If the primary is unreachable
+        """
+        seen = set()
+        self.warm_statements = []
+        for sql in warm_statements:
+            statements = parse_statements(sql)
+            if len(statements) == 1 and statements[0].read_only and statements[0].returns_rows:
+                if sql not in seen:
+                    seen.add(sql)
+                    self.warm_statements.append(sql)
+        
+        started = asyncio.get_running_loop().time()
+        pool = await self.get_pool()
+        for dsn in self.replicas:
+            try:
+                await self._get_replica_pool(dsn)
+            except Exception as e:
+                # The lag check keeps an unreachable replica out of rotation
+                logger.warning(f"Replica {self._redact(dsn)} not warmed: {e}")
+        
+        logger.info(
+            f"Database pool ready: {pool.get_size()} connection(s), "
+            f"{len(self._replica_pools)} replica pool(s), "
+            f"{len(self.warm_statements)} warm statement(s) "
+            f"in {asyncio.get_running_loop().time() - started:.2f}s"
+        )
+    
+    async def _measure_lag(self, dsn: str) -> Optional[float]:
+        """Return a replica's replication lag in seconds, or None if unreachable."""
+        try:
+            pool = await self._get_replica_pool(dsn)
+            async with pool.acquire() as conn:
+                lag = float(await conn.fetchval(REPLICA_LAG_SQL, timeout=self.lag_check_interval))
+        except Exception as e:
+            logger.warning(f"Replica {self._redact(dsn)} unavailable: {e}")
+            lag = None
+        self._replica_lag[dsn] = (lag, asyncio.get_running_loop().time())
+        return lag
+    
+    async def _usable_replicas(self) -> List[str]:
+        """Replicas that are reachable and within the lag ceiling."""
+        now = asyncio.get_running_loop().time()
+        stale = [
+            dsn for dsn in self.replicas
+            if dsn not in self._replica_lag
+            or now - self._replica_lag[dsn][1] > self.lag_check_interval
+        ]
+        if stale:
+            await asyncio.gather(*(self._measure_lag(dsn) for dsn in stale))
+        
+        usable = []
+        for dsn in self.replicas:
+            lag = self._replica_lag[dsn][0]
+            if lag is None:
+                continue
+            if self.max_replica_lag is not None and lag > self.max_replica_lag:
+                logger.info(f"Replica {self._redact(dsn)} is {lag:.1f}s behind, skipping")
+                continue
+            usable.append(dsn)
+        return usable
+    
+    async def _read_replica(self) -> Optional[str]:
+        """Pick the replica for a read, or None to read from the primary.
+        
+        Raises:
+            ReplicaUnavailable: If no replica is usable and primary reads are off
+        """
+        if not self.replicas:
+            return None
+        usable = await self._usable_replicas()
+        if not usable:
+            if self.allow_primary_reads:
+                return None
+            raise ReplicaUnavailable(
+                "No read replica is reachable within the replication lag limit; try again shortly."
+            )
+        if self.replica_selection == "round_robin":
+            self._next_replica += 1
+            return usable[self._next_replica % len(usable)]
+        return min(usable, key=lambda dsn: self._in_flight[dsn])
+    
+    @staticmethod
+    def _redact(dsn: str) -> str:
+        """Drop credentials from a DSN before logging it."""
+        return dsn.rsplit("@", 1)[-1]
+    
+    def _timeouts(
+        self,
+        statement_timeout: Optional[float] = None,
+        lock_timeout: Optional[float] = None,
+    ) -> Dict[str, str]:
+        """Return the timeout settings for one call, in milliseconds."""
+        settings = {}
+        statement_timeout = statement_timeout if statement_timeout is not None else self.statement_timeout
+        lock_timeout = lock_timeout if lock_timeout is not None else self.lock_timeout
+        if statement_timeout is not None:
+            settings["statement_timeout"] = str(int(statement_timeout * 1000))
+        if lock_timeout is not None:
+            settings["lock_timeout"] = str(int(lock_timeout * 1000))
+        return settings
+    
+    @asynccontextmanager
+    async def connection(
+        self,
+        statement_timeout: Optional[float] = None,
+        lock_timeout: Optional[float] = None,
+        readonly: bool = False,
+    ) -> AsyncIterator[asyncpg.Connection]:
+        """Acquire a pooled connection scoped to one call.
+        
+        Timeouts are set for the session and undone by the pool's RESET ALL
+        on release. If the calling task is cancelled (client disconnect,
+        agent abort) while a query runs, the backend is cancelled with
+        pg_cancel_backend before the connection goes back to the pool.
+        
+        Args:
+            statement_timeout: Overrides the runner's statement_timeout
+            lock_timeout: Overrides the runner's lock_timeout
+            readonly: The caller only reads, so a replica may serve it;
+                the caller is responsible for opening a READ ONLY transaction
+            
+        Yields:
+            asyncpg connection
+            
+        Raises:
+            ReplicaUnavailable: If readonly, no replica is usable and primary
+                reads are not allowed
+        """
+        dsn = await self._read_replica() if readonly else None
+        pool = await self._get_replica_pool(dsn) if dsn else await self.get_pool()
+        
+        if dsn:
+            self._in_flight[dsn] += 1
+        try:
+            # Time spent waiting for a free connection shows pool saturation
+            with timed("db.acquire"):
+                conn = await pool.acquire()
+            try:
+                settings = self._timeouts(statement_timeout, lock_timeout)
+                if settings:
+                    await conn.execute(
+                        "SELECT " + ", ".join(
+                            f"set_config('{name}', ${i}, false)"
+                            for i, name in enumerate(settings, 1)
+                        ),
+                        *settings.values(),
+                    )
+                try:
+                    yield conn
+                except asyncio.CancelledError:
+                    await asyncio.shield(self._cancel_backend(conn.get_server_pid(), dsn))
+                    raise
+            finally:
+                await pool.release(conn)
+        finally:
+            if dsn:
+                self._in_flight[dsn] -= 1
+    
+    async def _cancel_backend(self, pid: int, dsn: Optional[str] = None) -> None:
+        """Cancel whatever backend ``pid`` is running, over a side connection.
+        
+        A fresh connection is used because the pool may be exhausted by the
+        very queries being cancelled.
+        
+        Args:
+            pid: Backend process id
+            dsn: Replica the backend lives on (None = primary)
+        """
+        try:
+            if dsn:
+                conn = await asyncpg.connect(dsn=dsn, timeout=5)
+            else:
+                conn = await asyncpg.connect(
+                    host=self.host,
+                    port=self.port,
+                    database=self.database,
+                    user=self.user,
+                    password=self.password,
+                    timeout=5,
+                )
+            try:
+                await conn.fetchval("SELECT pg_cancel_backend($1)", pid)
+            finally:
+                await conn.close()
+            logger.info(f"Cancelled backend {pid} after the request was aborted")
+        except Exception as e:
+            logger.warning(f"Could not cancel backend {pid}: {e}")
+    
     async def run_sql(self, args: RunSqlToolArgs, context: ToolContext) -> pd.DataFrame:
         """Execute SQL query and return results as DataFrame.
         
         Args:
             args: Tool arguments containing the SQL query
-            context: Tool execution context
+            context: Tool execution context; ``metadata["statement_timeout"]``
+                and ``metadata["lock_timeout"]`` (seconds) override the
+                runner's timeouts for this call
             
         Returns:
             pandas DataFrame with query results
+            
+        Raises:
+            WriteNotAllowed: If writes are disabled and a statement modifies data
+            ValueError: If the SQL is empty, or has several statements of
+                which some return rows
         """
-        pool = await self._get_pool()
+        statements = parse_statements(args.sql)
+        if not statements:
+            raise ValueError("No SQL statement to run.")
+        if not self.allow_writes:
+            for statement in statements:
+                if not statement.read_only:
+                    raise WriteNotAllowed(
+                        f"Only read-only queries are allowed; {statement.keyword or 'this'} "
+                        "statements can modify data. Rewrite it as a SELECT."
+                    )
+        if len(statements) > 1 and any(s.returns_rows for s in statements):
+            raise ValueError("Send one query per call; only the last result would be kept.")
+        
+        statement = statements[0]
+        statement_timeout = context.metadata.get("statement_timeout")
+        lock_timeout = context.metadata.get("lock_timeout")
+        
+        if statement.returns_rows and statement.read_only:
+            if not self.coalesce_reads:
+                return await self._read(args.sql, statement_timeout, lock_timeout)
+            # Identical reads already running share one execution; each caller
+            # gets its own shallow copy of the result
+            key = (sql_fingerprint(args.sql), statement_timeout, lock_timeout)
+            df = await self.read_flights.do(
+                key, lambda: self._read(args.sql, statement_timeout, lock_timeout)
+            )
+            return df.copy(deep=False)
         
-        async with pool.acquire() as conn:
-            # Determine query type
-            query_type = args.sql.strip().upper().split()[0]
+        if statement.returns_rows:
+            # DML ... RETURNING writes, so it runs on the primary
+            async with self.connection(statement_timeout, lock_timeout) as conn:
+                rows, attributes = await self._fetch(conn, args.sql, (), readonly=False)
+            if not rows:
+                return pd.DataFrame()
+            return await self._to_dataframe(rows, attributes)
+        
+        async with self.connection(statement_timeout, lock_timeout) as conn:
+            # For INSERT, UPDATE, DELETE, DDL, etc.
+            with timed("db.execute"):
+                result = await conn.execute(args.sql)
             
-            if query_type == "SELECT":
-                # For SELECT queries, fetch all rows
-                rows = await conn.fetch(args.sql)
-                
-                if not rows:
-                    # Return empty DataFrame with no columns
-                    return pd.DataFrame()
-                
-                # Convert to DataFrame
-                df = pd.DataFrame([dict(row) for row in rows])
-                return df
+            # Extract number of affected rows from result string
+            # e.g., "INSERT 0 5" means 5 rows inserted; "CREATE TABLE" has no count
+            parts = result.split()
+            rows_affected = int(parts[-1]) if parts and parts[-1].isdigit() else 0
             
-            else:
-                # For INSERT, UPDATE, DELETE, etc.
-                result = await conn.execute(args.sql)
-                
-                # Extract number of affected rows from result string
-                # e.g., "INSERT 0 5" means 5 rows inserted
-                parts = result.split()
-                rows_affected = int(parts[-1]) if parts else 0
+            # Return DataFrame with affected row count
+            return pd.DataFrame({'rows_affected': [rows_affected]})
+    
+    async def _read(
+        self,
+        sql: str,
+        statement_timeout: Optional[float],
+        lock_timeout: Optional[float],
+    ) -> pd.DataFrame:
+        """Run one read query on a replica (or the primary) in a READ ONLY transaction."""
+        if self.streaming:
+            # Bounded read: chunks are capped by max_rows/max_bytes
+            chunks = [
+                chunk
+                async for chunk in self.stream_sql(
+                    sql,
+                    statement_timeout=statement_timeout,
+                    lock_timeout=lock_timeout,
+                )
+            ]
+            if not chunks:
+                return pd.DataFrame()
+            if len(chunks) == 1:
+                return chunks[0]
+            with timed("db.convert"):
+                return await self.offloader.run(
+                    sum(chunk.size for chunk in chunks),
+                    concat_chunks,
+                    chunks,
+                )
+        
+        async with self.connection(statement_timeout, lock_timeout, readonly=True) as conn:
+            rows, attributes = await self._fetch(conn, sql, (), readonly=True)
+        
+        if not rows:
+            # Return empty DataFrame with no columns
+            return pd.DataFrame()
+        
+        return await self._to_dataframe(rows, attributes)
+    
+    async def _to_dataframe(
+        self, rows: List[asyncpg.Record], attributes: Sequence[asyncpg.Attribute]
+    ) -> pd.DataFrame:
+        """Convert fetched rows, on the offload pool when the result is large."""
+        with timed("db.convert"):
+            return await self.offloader.run(
+                len(rows) * len(attributes), records_to_dataframe, rows, attributes, self.dtype_mapper
+            )
+    
+    async def run_prepared(
+        self,
+        sql: str,
+        params: Sequence[object],
+        context: ToolContext,
+    ) -> pd.DataFrame:
+        """Execute a parameterized read query and return its rows.
+        
+        The statement is planned once per pooled connection (see
+        PreparingConnection) and only the bound values change between
+        calls, so frequent queries skip parsing and planning.
+        
+        Args:
+            sql: Read-only query with $1..$n placeholders
+            params: Values for the placeholders, in order
+            context: Tool execution context; timeouts are read from its
+                metadata as in run_sql
+            
+        Returns:
+            pandas DataFrame with query results (with columns even when empty)
+            
+        Raises:
+            ValueError: If the SQL is not a single read query
+        """
+        statements = parse_statements(sql)
+        if len(statements) != 1 or not statements[0].read_only or not statements[0].returns_rows:
+            raise ValueError("Only a single read-only query can be run with parameters.")
+        
+        async with self.connection(
+            context.metadata.get("statement_timeout"),
+            context.metadata.get("lock_timeout"),
+            readonly=True,
+        ) as conn:
+            rows, attributes = await self._fetch(conn, sql, params, readonly=True)
+        return await self._to_dataframe(rows, attributes)
+    
+    async def _fetch(
+        self,
+        conn: asyncpg.Connection,
+        sql: str,
+        params: Sequence[object],
+        readonly: bool,
+    ) -> Tuple[List[asyncpg.Record], Sequence[asyncpg.Attribute]]:
+        """Run a prepared statement in its own transaction; return rows and attributes."""
+        with timed("db.execute"):
+            try:
+                async with conn.transaction(readonly=readonly):
+                    stmt = await conn.prepare_cached(sql)
+                    rows = await stmt.fetch(*params)
+            except asyncpg.InvalidCachedStatementError:
+                # A warm statement outlived a schema change; re-prepare once
+                conn.forget_prepared()
+                async with conn.transaction(readonly=readonly):
+                    stmt = await conn.prepare_cached(sql)
+                    rows = await stmt.fetch(*params)
+        return rows, stmt.get_attributes()
+    
+    async def stream_sql(
+        self,
+        sql: str,
+        chunk_size: Optional[int] = None,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        statement_timeout: Optional[float] = None,
+        lock_timeout: Optional[float] = None,
+    ) -> AsyncIterator[pd.DataFrame]:
+        """Stream a query result as fixed-size DataFrame chunks.
+        
+        Rows are read through a server-side cursor inside a transaction, so
+        only one chunk is held in memory at a time.
+        
+        Args:
+            sql: SQL query to execute
+            chunk_size: Rows per chunk (defaults to the runner setting)
+            max_rows: Row cap (defaults to the runner setting)
+            max_bytes: In-memory size cap (defaults to the runner setting)
+            statement_timeout: Seconds each statement may run (defaults to the runner setting)
+            lock_timeout: Seconds to wait for a lock (defaults to the runner setting)
+            
+        Yields:
+            pandas DataFrames of at most chunk_size rows
+            
+        Raises:
+            ResultLimitExceeded: If the result grows past max_rows or max_bytes
+        """
+        chunk_size = chunk_size or self.chunk_size
+        max_rows = max_rows if max_rows is not None else self.max_rows
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        
+        async with self.connection(statement_timeout, lock_timeout, readonly=True) as conn:
+            # Server-side cursors only live inside a transaction
+            async with conn.transaction(readonly=True):
+                stmt = await conn.prepare_cached(sql)
+                attributes = stmt.get_attributes()
+                cursor = await stmt.cursor()
+                total_rows = 0
+                total_bytes = 0
                 
-                # Return DataFrame with affected row count
-                return pd.DataFrame({'rows_affected': [rows_affected]})
+                while True:
+                    with timed("db.execute"):
+                        rows = await cursor.fetch(chunk_size)
+                    if not rows:
+                        break
+                    
+                    total_rows += len(rows)
+                    if max_rows is not None and total_rows > max_rows:
+                        raise ResultLimitExceeded(
+                            f"Query returned more than {max_rows} rows. "
+                            "Add a LIMIT or aggregate the result."
+                        )
+                    
+                    with timed("db.convert"):
+                        chunk, chunk_bytes = await self.offloader.run(
+                            len(rows) * len(attributes),
+                            _sized_dataframe, rows, attributes, self.dtype_mapper,
+                        )
+                    
+                    total_bytes += chunk_bytes
+                    if max_bytes is not None and total_bytes > max_bytes:
+                        raise ResultLimitExceeded(
+                            f"Query result exceeded {max_bytes} bytes in memory. "
+                            "Select fewer columns, add a LIMIT or aggregate the result."
+                        )
+                    
+                    yield chunk
+                    
+                    if len(rows) < chunk_size:
+                        break
+    
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Size, idle and maximum connections per open pool ("primary" or replica host).
+        
+        Returns:
+            Pool name -> {"size", "idle", "max"}
+        """
+        pools = {"primary": self._pool} if self._pool else {}
+        pools.update({self._redact(dsn): pool for dsn, pool in self._replica_pools.items()})
+        return {
+            name: {"size": pool.get_size(), "idle": pool.get_idle_size(), "max": pool.get_max_size()}
+            for name, pool in pools.items()
+        }
     
     async def close(self):
         """Close the connection pool."""
         if self._pool:
             await self._pool.close()
             self._pool = None
-    
-    def __del__(self):
-        """Cleanup on deletion."""
-        if self._pool:
-            try:
-                asyncio.get_event_loop().run_until_complete(self.close())
-            except:
-                pass
+        for pool in self._replica_pools.values():
+            await pool.close()
+        self._replica_pools.clear()
@@ -0,0 +1,303 @@
+"""EXPLAIN-based cost guard that runs before a query reaches Postgres."""
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from vanna.capabilities.file_system import FileSystem
+from vanna.capabilities.sql_runner import SqlRunner, RunSqlToolArgs
+from vanna.core.tool import ToolContext, ToolResult
+from vanna.tools import RunSqlTool
+
+from offload import ResultOffloader
+from postgres_runner import PostgresRunner
+from result_digest import ResultDigester
+from sql_classifier import parse_statements
+
+logger = logging.getLogger(__name__)
+
+
+# ToolContext.metadata key holding guard notices for the current tool call
+FEEDBACK_KEY = "sql_feedback"
+
+
+class QueryRejected(Exception):
+    """Raised when a query's estimated plan is too expensive to run.
+
+    The message is written for the agent: it explains the estimate and how
+    to narrow the query, and RunSqlTool passes it back as the tool error.
+    """
+
+
+@dataclass
+class GuardDecision:
+    """Outcome of checking one query.
+
+    Attributes:
+        action: "allow", "limit" (LIMIT was injected) or "reject"
+        sql: SQL that will actually run
+        total_cost: Planner total cost of that SQL
+        plan_rows: Planner row estimate of that SQL
+        reason: Feedback for the agent (empty when allowed unchanged)
+    """
+
+    action: str
+    sql: str
+    total_cost: float
+    plan_rows: float
+    reason: str = ""
+
+
+def add_limit(sql: str, limit: int) -> str:
+    """Cap a SELECT at ``limit`` rows.
+
+    A LIMIT is appended when the statement has none at the top level;
+    otherwise the statement is wrapped so its own LIMIT/OFFSET still apply.
+    """
+    statement = parse_statements(sql)[0]
+    sql = statement.text
+    if any(t.depth == 0 and t.upper in ("LIMIT", "FETCH", "OFFSET") for t in statement.tokens):
+        return f"SELECT * FROM (\n{sql}\n) AS limited LIMIT {limit}"
+    return f"{sql}\nLIMIT {limit}"
+
+
+class CostGuardSqlRunner(SqlRunner):
+    """SqlRunner decorator that checks the planner's estimate before executing.
+
+    Every read is first run through ``EXPLAIN (FORMAT JSON)``. Plans
+    estimated to return more than ``max_rows`` rows get a LIMIT injected and
+    are re-planned; plans whose total cost is still above ``max_cost`` are
+    rejected with a QueryRejected that tells the agent how to narrow the
+    query. Injected limits are reported through ``context.metadata`` (and
+    the result's ``attrs``, for cached copies) so FeedbackRunSqlTool can add
+    them to the tool result. Writes pass through unchecked.
+    """
+
+    def __init__(
+        self,
+        runner: PostgresRunner,
+        max_cost: float = 1_000_000.0,
+        max_rows: int = 5_000,
+    ):
+        """Initialize the guard.
+
+        Args:
+            runner: Runner that executes the queries; its pool is used for EXPLAIN
+            max_cost: Highest planner total cost allowed to run
+            max_rows: Estimated result size above which a LIMIT is injected
+        """
+        self.runner = runner
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+
+        self.stats: Dict[str, int] = {"allowed": 0, "limited": 0, "rejected": 0}
+
+    async def explain(self, sql: str) -> Dict[str, Any]:
+        """Return the top plan node of ``EXPLAIN (FORMAT JSON)`` for a query."""
+        async with self.runner.connection(readonly=True) as conn:
+            # Read-only like every other read, so nothing here can write
+            async with conn.transaction(readonly=True):
+                raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}")
+        plan = json.loads(raw) if isinstance(raw, str) else raw
+        return plan[0]["Plan"]
+
+    async def check(self, sql: str) -> GuardDecision:
+        """Decide whether a query may run, and in what form.
+
+        Args:
+            sql: SELECT statement to check
+
+        Returns:
+            GuardDecision describing the SQL to run and why
+        """
+        plan = await self.explain(sql)
+        estimated_rows = plan["Plan Rows"]
+        action, reason = "allow", ""
+
+        if estimated_rows > self.max_rows:
+            sql = add_limit(sql, self.max_rows)
+            plan = await self.explain(sql)
+            action = "limit"
+            reason = (
+                f"Query was estimated to return about {estimated_rows:,.0f} rows, so it ran "
+                f"with LIMIT {self.max_rows}. The result may be incomplete; aggregate "
+                "(GROUP BY) or filter (WHERE) if the full set matters."
+            )
+
+        if plan["Total Cost"] > self.max_cost:
+            return GuardDecision(
+                action="reject",
+                sql=sql,
+                total_cost=plan["Total Cost"],
+                plan_rows=plan["Plan Rows"],
+                reason=(
+                    f"Query rejected before execution: estimated cost {plan['Total Cost']:,.0f} "
+                    f"exceeds the limit of {self.max_cost:,.0f} (about {estimated_rows:,.0f} rows "
+                    "before any LIMIT). Narrow it: check every JOIN has an ON "
+                    "condition, filter by date range, status or location, and aggregate instead "
+                    "of selecting raw rows."
+                ),
+            )
+
+        return GuardDecision(
+            action=action,
+            sql=sql,
+            total_cost=plan["Total Cost"],
+            plan_rows=plan["Plan Rows"],
+            reason=reason,
+        )
+
+    async def run_sql(self, args: RunSqlToolArgs, context: ToolContext) -> pd.DataFrame:
+        """Check the plan, then execute the query (possibly with a LIMIT).
+
+        Args:
+            args: Tool arguments containing the SQL query
+            context: Tool execution context
+
+        Returns:
+            pandas DataFrame with query results
+
+        Raises:
+            QueryRejected: If the plan is estimated to cost more than max_cost
+        """
+        statements = parse_statements(args.sql)
+        if (
+            len(statements) != 1
+            or not statements[0].read_only
+            or statements[0].keyword not in ("SELECT", "WITH", "VALUES", "TABLE")
+        ):
+            # Writes, EXPLAIN/SHOW and multi-statement input are not planned here
+            return await self.runner.run_sql(args, context)
+
+        decision = await self.check(args.sql)
+        if decision.action == "reject":
+            self.stats["rejected"] += 1
+            logger.warning(f"Query guard rejected query (cost={decision.total_cost:.0f})")
+            raise QueryRejected(decision.reason)
+
+        if decision.action == "limit":
+            self.stats["limited"] += 1
+            logger.info(f"Query guard injected LIMIT {self.max_rows} (cost={decision.total_cost:.0f})")
+            context.metadata.setdefault(FEEDBACK_KEY, []).append(decision.reason)
+            df = await self.runner.run_sql(RunSqlToolArgs(sql=decision.sql), context)
+            # Travels with the DataFrame, so cached copies still carry the notice
+            df.attrs[FEEDBACK_KEY] = [decision.reason]
+            return df
+
+        self.stats["allowed"] += 1
+        return await self.runner.run_sql(args, context)
+
+
+class FetchedSqlRunner(SqlRunner):
+    """Hands RunSqlTool a result (or error) that was already produced."""
+
+    def __init__(self, df: Optional[pd.DataFrame] = None, error: Optional[Exception] = None):
+        self.df = df
+        self.error = error
+
+    async def run_sql(self, args: RunSqlToolArgs, context: ToolContext) -> pd.DataFrame:
+        if self.error is not None:
+            raise self.error
+        return self.df
+
+
+async def render_sql_result(
+    runner: FetchedSqlRunner,
+    sql: str,
+    file_system: FileSystem,
+    context: ToolContext,
+    offloader: ResultOffloader,
+    digester: Optional[ResultDigester] = None,
+) -> ToolResult:
+    """Render a fetched result as RunSqlTool would, with a digest for the LLM.
+
+    Rendering turns the whole DataFrame into CSV (saved for visualize_data)
+    and row dicts for the UI table, so large results are rendered on the
+    offloader's worker threads, together with the digest.
+
+    Args:
+        runner: The fetched result or error
+        sql: SQL whose first word decides the rendering ("SELECT" for a table)
+        file_system: Where the result CSV is saved
+        context: Tool execution context
+        offloader: Worker pool for large results
+        digester: Replaces RunSqlTool's CSV preview in the text the LLM gets;
+            None keeps the preview
+
+    Returns:
+        RunSqlTool's result for it
+    """
+
+    async def render() -> ToolResult:
+        result = await RunSqlTool(runner, file_system).execute(context, RunSqlToolArgs(sql=sql))
+        output_file = (result.metadata or {}).get("output_file")
+        if digester is not None and result.success and output_file and not runner.df.empty:
+            result.result_for_llm = digester.digest(runner.df, output_file)
+        return result
+
+    cells = runner.df.size if runner.df is not None else 0
+    return await offloader.run_coroutine(cells, render)
+
+
+class FeedbackRunSqlTool(RunSqlTool):
+    """RunSqlTool that appends runner notices (e.g. an injected LIMIT) to its result.
+
+    It also renders every row-returning statement as a result table.
+    RunSqlTool decides that from the first word, so WITH, VALUES, EXPLAIN
+    or a query after a leading comment would otherwise be reported as
+    "N row(s) affected" and the agent would never see the rows. Large
+    results are rendered off the event loop, and the LLM gets a bounded
+    digest of the rows rather than a CSV preview (see render_sql_result).
+    """
+
+    def __init__(
+        self,
+        sql_runner: SqlRunner,
+        file_system: Optional[FileSystem] = None,
+        offloader: Optional[ResultOffloader] = None,
+        digester: Optional[ResultDigester] = None,
+        **kwargs: Any,
+    ):
+        """Initialize the tool.
+
+        Args:
+            sql_runner: Runner stack that executes the queries
+            file_system: Where result CSVs are saved (defaults to LocalFileSystem)
+            offloader: Worker pool for rendering large results
+                (defaults to ResultOffloader())
+            digester: Builds the text the LLM gets for a result
+                (defaults to ResultDigester())
+            **kwargs: Passed to RunSqlTool (custom_tool_name, ...)
+        """
+        super().__init__(sql_runner, file_system, **kwargs)
+        self.offloader = offloader or ResultOffloader()
+        self.digester = digester or ResultDigester()
+
+    async def execute(self, context: ToolContext, args: RunSqlToolArgs) -> ToolResult:
+        context.metadata.pop(FEEDBACK_KEY, None)
+
+        try:
+            runner = FetchedSqlRunner(df=await self.sql_runner.run_sql(args, context))
+        except Exception as e:
+            runner = FetchedSqlRunner(error=e)
+
+        statements = parse_statements(args.sql)
+        first_word = args.sql.strip().upper().split()[0] if args.sql.strip() else ""
+        if len(statements) == 1 and statements[0].returns_rows and first_word != "SELECT":
+            result = await render_sql_result(
+                runner, "SELECT", self.file_system, context, self.offloader, self.digester
+            )
+            if result.success:
+                result.metadata = {**(result.metadata or {}), "query_type": statements[0].keyword}
+        else:
+            result = await render_sql_result(
+                runner, args.sql, self.file_system, context, self.offloader, self.digester
+            )
+
+        notices: List[str] = context.metadata.pop(FEEDBACK_KEY, None) or []
+        if notices:
+            notes = "\n".join(f"NOTE: {n}" for n in notices)
+            result.result_for_llm = f"{notes}\n\n{result.result_for_llm}"
+            result.metadata = {**(result.metadata or {}), "sql_feedback": notices}
+        return result
@@ -0,0 +1,221 @@
+"""Bounded digests of query results for the LLM, and download of the full result."""
+import logging
+import re
+import uuid
+from typing import Any, Optional
+
+import pandas as pd
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from vanna.capabilities.agent_memory import AgentMemory
+from vanna.capabilities.file_system import FileSystem
+from vanna.core.tool import ToolContext
+from vanna.core.user import RequestContext, UserResolver
+from vanna.integrations.local import LocalFileSystem
+
+from offload import ResultOffloader
+
+logger = logging.getLogger(__name__)
+
+
+# Where the download endpoint is mounted; the digest points the LLM at it
+RESULTS_PATH = "/api/results"
+
+# Names RunSqlTool gives result files
+RESULT_FILE = re.compile(r"query_results_[0-9a-f]{8}\.csv")
+
+
+class ResultDigester:
+    """Turns a query result into a bounded text digest for the LLM.
+
+    Tool results stay in the conversation and are re-sent on every later
+    LLM turn of the loop, so their size multiplies. RunSqlTool sends the
+    first 1000 characters of the CSV: a few rows of a large result and no
+    idea how large it is. Small results (at most ``verbatim_rows`` rows and
+    ``verbatim_chars`` characters of CSV) are still sent whole, since the
+    exact values are what the answer needs. Larger ones become a digest:
+    row count, column types, per-column stats (nulls, min/max/mean/sum for
+    numbers and dates, distinct count and top-k values otherwise) and a
+    head/tail sample. Its size depends on the column count, capped at
+    ``max_columns``, and not on the number of rows; ``max_chars`` bounds it
+    for wide results with long values. The full result stays in the CSV
+    file RunSqlTool saved, which visualize_data and the download endpoint
+    read.
+    """
+
+    def __init__(
+        self,
+        verbatim_rows: int = 50,
+        verbatim_chars: int = 2000,
+        head_rows: int = 5,
+        tail_rows: int = 3,
+        top_k: int = 5,
+        max_columns: int = 30,
+        max_value_chars: int = 60,
+        max_chars: int = 6000,
+    ):
+        """Initialize the digester.
+
+        Args:
+            verbatim_rows: Most rows a result may have to be sent whole
+            verbatim_chars: Most CSV characters a result may have to be sent whole
+            head_rows: First rows shown in a digest
+            tail_rows: Last rows shown in a digest
+            top_k: Most frequent values listed per text column
+            max_columns: Columns described; the rest are only named
+            max_value_chars: Longest value shown before it is cut
+            max_chars: Longest digest; whole lines past it are dropped
+        """
+        self.verbatim_rows = verbatim_rows
+        self.verbatim_chars = verbatim_chars
+        self.head_rows = head_rows
+        self.tail_rows = tail_rows
+        self.top_k = top_k
+        self.max_columns = max_columns
+        self.max_value_chars = max_value_chars
+        self.max_chars = max_chars
+
+    def digest(self, df: pd.DataFrame, filename: Optional[str] = None) -> str:
+        """Return the text the LLM gets for a result.
+
+        Args:
+            df: Query result
+            filename: Result file RunSqlTool saved (the handle to the full result)
+
+        Returns:
+            The CSV of a small result, or a digest of a large one,
+            followed by where the full result is
+        """
+        handle = ""
+        if filename:
+            handle = (
+                f"\n\nFull result saved as {filename} (use this filename for visualize_data; "
+                f"download: {RESULTS_PATH}/{filename})."
+            )
+
+        if len(df) <= self.verbatim_rows:
+            csv = df.to_csv(index=False)
+            if len(csv) <= self.verbatim_chars:
+                return csv.rstrip("\n") + handle
+
+        rows, columns = df.shape
+        shown = df.iloc[:, :self.max_columns]
+        lines = [f"Result: {rows:,} rows x {columns} columns. Summary (not the full data):", "", "Columns:"]
+        for i in range(shown.shape[1]):
+            lines.append(f"- {self._describe(shown.iloc[:, i])}")
+        if columns > self.max_columns:
+            rest = ", ".join(str(c) for c in df.columns[self.max_columns:])
+            lines.append(f"- ... {columns - self.max_columns} more: {self._short(rest)}")
+
+        head = shown.head(self.head_rows)
+        if rows > self.head_rows + self.tail_rows:
+            lines += ["", f"First {len(head)} rows:", self._sample(head)]
+            lines += [f"Last {self.tail_rows} rows:", self._sample(shown.tail(self.tail_rows))]
+        else:
+            lines += ["", "Rows:", self._sample(shown)]
+        text = "\n".join(lines).rstrip("\n")
+        if len(text) > self.max_chars:
+            text = text[:text.rfind("\n", 0, self.max_chars)] + "\n... (summary cut)"
+        return text + handle
+
+    def _describe(self, col: pd.Series) -> str:
+        """One line of type and stats for a column."""
+        nulls = int(col.isna().sum())
+        parts = [f"{col.name} ({col.dtype})"]
+        if nulls:
+            parts.append(f"nulls {nulls:,}")
+        values = col.dropna()
+        if values.empty:
+            return ", ".join(parts + ["all null"])
+
+        if pd.api.types.is_bool_dtype(col):
+            parts.append(self._top(values))
+        elif pd.api.types.is_numeric_dtype(col):
+            parts.append(
+                f"min {self._short(values.min())}, max {self._short(values.max())}, "
+                f"mean {self._short(values.mean())}, sum {self._short(values.sum())}"
+            )
+            distinct = values.nunique()
+            if distinct <= self.top_k:
+                parts.append(self._top(values))
+        elif pd.api.types.is_datetime64_any_dtype(col):
+            parts.append(f"min {self._short(values.min())}, max {self._short(values.max())}")
+        else:
+            try:
+                distinct = values.nunique()
+            except TypeError:
+                # Unhashable values (JSON arrays/objects)
+                values = values.astype(str)
+                distinct = values.nunique()
+            parts.append(f"{distinct:,} distinct")
+            parts.append(self._top(values))
+        return ", ".join(parts)
+
+    def _top(self, values: pd.Series) -> str:
+        counts = values.value_counts().head(self.top_k)
+        return "top: " + "; ".join(f"{self._short(v)} ({n:,})" for v, n in counts.items())
+
+    def _sample(self, rows: pd.DataFrame) -> str:
+        return rows.apply(lambda col: col.map(self._short, na_action="ignore")).to_csv(index=False)
+
+    def _short(self, value: Any) -> str:
+        """Format a value compactly and cut it at max_value_chars."""
+        if isinstance(value, float):
+            text = format(value, ".15g")
+        else:
+            text = str(value)
+        if len(text) > self.max_value_chars:
+            text = text[:self.max_value_chars - 1] + "…"
+        return text
+
+
+def results_endpoint(
+    user_resolver: UserResolver,
+    agent_memory: AgentMemory,
+    file_system: Optional[FileSystem] = None,
+    offloader: Optional[ResultOffloader] = None,
+):
+    """Build the endpoint that downloads a saved result file as CSV.
+
+    Mount it at ``RESULTS_PATH + "/{filename}"``. Files are read from the
+    requesting user's own space, so a user only gets their own results.
+
+    Args:
+        user_resolver: Resolves the user the same way chat requests do
+        agent_memory: Required by ToolContext; not used
+        file_system: Where RunSqlTool saved the results (defaults to LocalFileSystem)
+        offloader: Worker pool the file is read on (defaults to ResultOffloader())
+    """
+    file_system = file_system or LocalFileSystem()
+    offloader = offloader or ResultOffloader()
+
+    async def download(request: Request) -> Response:
+        filename = request.path_params["filename"]
+        if not RESULT_FILE.fullmatch(filename):
+            return PlainTextResponse("Not found", status_code=404)
+
+        user = await user_resolver.resolve_user(
+            RequestContext(
+                cookies=dict(request.cookies),
+                headers=dict(request.headers),
+                remote_addr=request.client.host if request.client else None,
+                query_params=dict(request.query_params),
+            )
+        )
+        context = ToolContext(
+            user=user,
+            conversation_id="download",
+            request_id=str(uuid.uuid4()),
+            agent_memory=agent_memory,
+        )
+        try:
+            content = await offloader.run_coroutine(None, file_system.read_file, filename, context)
+        except (FileNotFoundError, PermissionError):
+            return PlainTextResponse("Not found", status_code=404)
+        return Response(
+            content,
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    return download
@@ -0,0 +1,618 @@
+"""Managed summary tables for recurring aggregates, with a query rewriter."""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from vanna.capabilities.sql_runner import SqlRunner, RunSqlToolArgs
+from vanna.core.tool import ToolContext
+
+from postgres_runner import PostgresRunner
+from sql_classifier import sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Rollup:
+    """A summary table kept in sync with an aggregate query.
+
+    Attributes:
+        name: Table name inside the rollup schema
+        sql: Aggregate query whose result is materialized
+        key_column: Output column used to refresh a slice of the table
+        watermark_sql: Returns the latest updated_at across source rows
+        row_keys_sql: Returns ``row_id`` (text) and ``slice_key`` (the
+            key_column value the row counts towards) for every source row
+        changed_rows_sql: Returns the same two columns for source rows
+            updated after $1. Without these two every refresh is a full rebuild.
+        rewrites: Known query -> equivalent query over the rollup; ``{rollup}``
+            is replaced with the qualified table name
+    """
+
+    name: str
+    sql: str
+    key_column: str
+    watermark_sql: str
+    row_keys_sql: Optional[str] = None
+    changed_rows_sql: Optional[str] = None
+    rewrites: Dict[str, str] = field(default_factory=dict)
+
+
+# Payments per month, type and status: revenue, salary, rent and service fee
+# questions all read from here
+PAYMENTS_MONTHLY = Rollup(
+    name="payments_monthly",
+    sql="""SELECT DATE_TRUNC('month', paid_date) AS thang, payment_type, status,
+       COUNT(*) AS so_giao_dich, SUM(amount) AS tong_tien
+FROM payments
+GROUP BY DATE_TRUNC('month', paid_date), payment_type, status""",
+    key_column="thang",
+    watermark_sql="SELECT max(updated_at) FROM payments",
+    row_keys_sql="SELECT payment_id::text AS row_id, DATE_TRUNC('month', paid_date) AS slice_key FROM payments",
+    changed_rows_sql="""SELECT payment_id::text AS row_id, DATE_TRUNC('month', paid_date) AS slice_key
+FROM payments WHERE updated_at > $1""",
+    rewrites={
+        # Doanh thu theo tháng
+        """SELECT DATE_TRUNC('month', paid_date) AS thang, SUM(amount) AS tong_doanh_thu, COUNT(*) AS so_giao_dich
+FROM payments
+WHERE status = 1 AND paid_date IS NOT NULL
+GROUP BY DATE_TRUNC('month', paid_date)
+ORDER BY thang DESC;""": """SELECT thang, SUM(tong_tien) AS tong_doanh_thu, SUM(so_giao_dich)::bigint AS so_giao_dich
+FROM {rollup}
+WHERE status = 1 AND thang IS NOT NULL
+GROUP BY thang
+ORDER BY thang DESC""",
+        # Lương nhân viên theo tháng
+        """SELECT DATE_TRUNC('month', paid_date) AS thang, SUM(amount) AS tong_luong, COUNT(*) AS so_nhan_vien
+FROM payments
+WHERE payment_type = 'SALARY' AND status = 1 AND paid_date IS NOT NULL
+GROUP BY DATE_TRUNC('month', paid_date)
+ORDER BY thang DESC;""": """SELECT thang, SUM(tong_tien) AS tong_luong, SUM(so_giao_dich)::bigint AS so_nhan_vien
+FROM {rollup}
+WHERE payment_type = 'SALARY' AND status = 1 AND thang IS NOT NULL
+GROUP BY thang
+ORDER BY thang DESC""",
+        # Tiền thuê theo tháng
+        """SELECT DATE_TRUNC('month', paid_date) AS thang, SUM(amount) AS tong_tien_thue, COUNT(*) AS so_hop_dong
+FROM payments
+WHERE payment_type = 'MONTHLY' AND status = 1 AND paid_date IS NOT NULL
+GROUP BY DATE_TRUNC('month', paid_date)
+ORDER BY thang DESC;""": """SELECT thang, SUM(tong_tien) AS tong_tien_thue, SUM(so_giao_dich)::bigint AS so_hop_dong
+FROM {rollup}
+WHERE payment_type = 'MONTHLY' AND status = 1 AND thang IS NOT NULL
+GROUP BY thang
+ORDER BY thang DESC""",
+        # Tiền cho thuê theo tháng cho chủ nhà
+        """SELECT DATE_TRUNC('month', paid_date) AS thang, SUM(amount) AS tong_tien_thue, COUNT(*) AS so_giao_dich
+FROM payments
+WHERE payment_type = 'MONEY_RENTAL' AND status = 1 AND paid_date IS NOT NULL
+GROUP BY DATE_TRUNC('month', paid_date)
+ORDER BY thang DESC;""": """SELECT thang, SUM(tong_tien) AS tong_tien_thue, SUM(so_giao_dich)::bigint AS so_giao_dich
+FROM {rollup}
+WHERE payment_type = 'MONEY_RENTAL' AND status = 1 AND thang IS NOT NULL
+GROUP BY thang
+ORDER BY thang DESC""",
+        # Phí dịch vụ theo tháng
+        """SELECT DATE_TRUNC('month', paid_date) AS thang, SUM(amount) AS tong_phi_dv, COUNT(*) AS so_giao_dich
+FROM payments
+WHERE payment_type = 'SERVICE_FEE' AND status = 1 AND paid_date IS NOT NULL
+GROUP BY DATE_TRUNC('month', paid_date)
+ORDER BY thang DESC;""": """SELECT thang, SUM(tong_tien) AS tong_phi_dv, SUM(so_giao_dich)::bigint AS so_giao_dich
+FROM {rollup}
+WHERE payment_type = 'SERVICE_FEE' AND status = 1 AND thang IS NOT NULL
+GROUP BY thang
+ORDER BY thang DESC""",
+        # Doanh thu hệ thống từ phí dịch vụ
+        """SELECT DATE_TRUNC('month', paid_date) AS thang,
+       SUM(amount) AS doanh_thu_phi_dv
+FROM payments
+WHERE payment_type = 'SERVICE_FEE' AND status = 1 AND paid_date IS NOT NULL
+GROUP BY DATE_TRUNC('month', paid_date)
+ORDER BY thang DESC;""": """SELECT thang, SUM(tong_tien) AS doanh_thu_phi_dv
+FROM {rollup}
+WHERE payment_type = 'SERVICE_FEE' AND status = 1 AND thang IS NOT NULL
+GROUP BY thang
+ORDER BY thang DESC""",
+        # Chi phí lương nhân viên theo tháng
+        """SELECT DATE_TRUNC('month', paid_date) AS thang,
+       SUM(amount) AS chi_phi_luong
+FROM payments
+WHERE payment_type = 'SALARY' AND status = 1 AND paid_date IS NOT NULL
+GROUP BY DATE_TRUNC('month', paid_date)
+ORDER BY thang DESC;""": """SELECT thang, SUM(tong_tien) AS chi_phi_luong
+FROM {rollup}
+WHERE payment_type = 'SALARY' AND status = 1 AND thang IS NOT NULL
+GROUP BY thang
+ORDER BY thang DESC""",
+        # Lợi nhuận ròng theo tháng
+        """SELECT
+    DATE_TRUNC('month', paid_date) AS thang,
+    SUM(CASE WHEN payment_type = 'SERVICE_FEE' THEN amount ELSE 0 END) AS thu_phi_dv,
+    SUM(CASE WHEN payment_type = 'SALARY' THEN amount ELSE 0 END) AS chi_luong,
+    SUM(CASE WHEN payment_type = 'SERVICE_FEE' THEN amount ELSE 0 END) -
+    SUM(CASE WHEN payment_type = 'SALARY' THEN amount ELSE 0 END) AS loi_nhuan
+FROM payments
+WHERE status = 1 AND paid_date IS NOT NULL
+GROUP BY DATE_TRUNC('month', paid_date)
+ORDER BY thang DESC;""": """SELECT thang,
+    SUM(CASE WHEN payment_type = 'SERVICE_FEE' THEN tong_tien ELSE 0 END) AS thu_phi_dv,
+    SUM(CASE WHEN payment_type = 'SALARY' THEN tong_tien ELSE 0 END) AS chi_luong,
+    SUM(CASE WHEN payment_type = 'SERVICE_FEE' THEN tong_tien ELSE 0 END) -
+    SUM(CASE WHEN payment_type = 'SALARY' THEN tong_tien ELSE 0 END) AS loi_nhuan
+FROM {rollup}
+WHERE status = 1 AND thang IS NOT NULL
+GROUP BY thang
+ORDER BY thang DESC""",
+        # Thanh toán theo loại
+        """SELECT payment_type, COUNT(*) AS so_luong, SUM(amount) AS tong_tien FROM payments GROUP BY payment_type ORDER BY tong_tien DESC;""": """SELECT payment_type, SUM(so_giao_dich)::bigint AS so_luong, SUM(tong_tien) AS tong_tien
+FROM {rollup}
+GROUP BY payment_type
+ORDER BY tong_tien DESC""",
+        # Thanh toán theo trạng thái
+        """SELECT status, COUNT(*) AS so_luong, SUM(amount) AS tong_tien FROM payments GROUP BY status ORDER BY so_luong DESC;""": """SELECT status, SUM(so_giao_dich)::bigint AS so_luong, SUM(tong_tien) AS tong_tien
+FROM {rollup}
+GROUP BY status
+ORDER BY so_luong DESC""",
+    },
+)
+
+# Properties per city, district, type, status and transaction type
+PROPERTIES_BY_LOCATION = Rollup(
+    name="properties_by_location",
+    sql="""SELECT c.city_id, c.city_name, d.district_id, d.district_name,
+       p.property_type_id, p.status, p.transaction_type,
+       COUNT(*) AS so_bds, SUM(p.price_amount) AS tong_gia, SUM(p.area) AS tong_dien_tich
+FROM properties p
+JOIN wards w ON p.ward_id = w.ward_id
+JOIN districts d ON w.district_id = d.district_id
+JOIN cities c ON d.city_id = c.city_id
+GROUP BY c.city_id, c.city_name, d.district_id, d.district_name,
+         p.property_type_id, p.status, p.transaction_type""",
+    key_column="city_id",
+    watermark_sql="SELECT max(updated_at) FROM properties",
+    row_keys_sql="""SELECT p.property_id::text AS row_id, d.city_id AS slice_key
+FROM properties p
+JOIN wards w ON p.ward_id = w.ward_id
+JOIN districts d ON w.district_id = d.district_id""",
+    changed_rows_sql="""SELECT p.property_id::text AS row_id, d.city_id AS slice_key
+FROM properties p
+JOIN wards w ON p.ward_id = w.ward_id
+JOIN districts d ON w.district_id = d.district_id
+WHERE p.updated_at > $1""",
+    rewrites={
+        # BĐS theo thành phố
+        """SELECT c.city_name, COUNT(p.property_id) AS so_bds, AVG(p.price_amount) AS gia_trung_binh
+FROM properties p
+JOIN wards w ON p.ward_id = w.ward_id
+JOIN districts d ON w.district_id = d.district_id
+JOIN cities c ON d.city_id = c.city_id
+GROUP BY c.city_id, c.city_name ORDER BY so_bds DESC;""": """SELECT city_name, SUM(so_bds)::bigint AS so_bds, SUM(tong_gia) / SUM(so_bds) AS gia_trung_binh
+FROM {rollup}
+GROUP BY city_id, city_name
+ORDER BY so_bds DESC""",
+        # BĐS theo quận huyện
+        """SELECT d.district_name, c.city_name, COUNT(p.property_id) AS so_bds, AVG(p.price_amount) AS gia_trung_binh
+FROM properties p
+JOIN wards w ON p.ward_id = w.ward_id
+JOIN districts d ON w.district_id = d.district_id
+JOIN cities c ON d.city_id = c.city_id
+GROUP BY d.district_id, d.district_name, c.city_name ORDER BY so_bds DESC LIMIT 20;""": """SELECT district_name, city_name, SUM(so_bds)::bigint AS so_bds, SUM(tong_gia) / SUM(so_bds) AS gia_trung_binh
+FROM {rollup}
+GROUP BY district_id, district_name, city_name
+ORDER BY so_bds DESC LIMIT 20""",
+        # Thống kê BĐS theo trạng thái
+        """SELECT status, COUNT(*) AS so_luong FROM properties GROUP BY status ORDER BY so_luong DESC;""": """SELECT status, SUM(so_bds)::bigint AS so_luong
+FROM {rollup}
+GROUP BY status
+ORDER BY so_luong DESC""",
+        # BĐS theo loại giao dịch
+        """SELECT transaction_type, COUNT(*) AS so_luong, AVG(price_amount) AS gia_tb FROM properties GROUP BY transaction_type;""": """SELECT transaction_type, SUM(so_bds)::bigint AS so_luong, SUM(tong_gia) / SUM(so_bds) AS gia_tb
+FROM {rollup}
+GROUP BY transaction_type""",
+        # Giá trung bình BĐS theo loại
+        """SELECT pt.type_name, COUNT(p.property_id) AS so_bds, AVG(p.price_amount) AS gia_tb, AVG(p.area) AS dien_tich_tb
+FROM properties p
+JOIN property_types pt ON p.property_type_id = pt.property_type_id
+GROUP BY pt.property_type_id, pt.type_name ORDER BY gia_tb DESC;""": """SELECT pt.type_name, SUM(r.so_bds)::bigint AS so_bds, SUM(r.tong_gia) / SUM(r.so_bds) AS gia_tb,
+       SUM(r.tong_dien_tich) / SUM(r.so_bds) AS dien_tich_tb
+FROM {rollup} r
+JOIN property_types pt ON r.property_type_id = pt.property_type_id
+GROUP BY pt.property_type_id, pt.type_name
+ORDER BY gia_tb DESC""",
+    },
+)
+
+# Appointments and contracts per agent and month
+AGENT_MONTHLY = Rollup(
+    name="agent_monthly",
+    sql="""SELECT sale_agent_id, thang,
+       SUM(appointments)::bigint AS appointments, SUM(rated_appointments)::bigint AS rated_appointments,
+       SUM(rating_sum)::bigint AS rating_sum, SUM(contracts)::bigint AS contracts,
+       SUM(contract_value) AS contract_value
+FROM (
+    SELECT agent_id AS sale_agent_id, DATE_TRUNC('month', created_at) AS thang,
+           COUNT(*) AS appointments, COUNT(rating) AS rated_appointments, SUM(rating) AS rating_sum,
+           0::bigint AS contracts, 0::numeric AS contract_value
+    FROM appointment
+    WHERE agent_id IS NOT NULL
+    GROUP BY agent_id, DATE_TRUNC('month', created_at)
+    UNION ALL
+    SELECT agent_id, DATE_TRUNC('month', created_at),
+           0, 0, 0, COUNT(*), SUM(total_contract_amount)
+    FROM contract
+    GROUP BY agent_id, DATE_TRUNC('month', created_at)
+) x
+GROUP BY sale_agent_id, thang""",
+    key_column="sale_agent_id",
+    watermark_sql="""SELECT GREATEST(
+    (SELECT max(updated_at) FROM appointment), (SELECT max(updated_at) FROM contract))""",
+    row_keys_sql="""SELECT 'a' || appointment_id AS row_id, agent_id AS slice_key FROM appointment
+UNION ALL SELECT 'c' || contract_id, agent_id FROM contract""",
+    changed_rows_sql="""SELECT 'a' || appointment_id AS row_id, agent_id AS slice_key FROM appointment WHERE updated_at > $1
+UNION ALL SELECT 'c' || contract_id, agent_id FROM contract WHERE updated_at > $1""",
+    rewrites={
+        # Nhân viên nào có nhiều hợp đồng nhất?
+        """SELECT CONCAT(u.last_name, ' ', u.first_name) AS agent_name, sa.employee_code, COUNT(c.contract_id) AS total_contracts
+FROM sale_agents sa
+JOIN users u ON sa.sale_agent_id = u.user_id
+LEFT JOIN contract c ON c.agent_id = sa.sale_agent_id
+GROUP BY sa.sale_agent_id, u.last_name, u.first_name, sa.employee_code
+ORDER BY total_contracts DESC LIMIT 10;""": """SELECT CONCAT(u.last_name, ' ', u.first_name) AS agent_name, sa.employee_code,
+       COALESCE(SUM(r.contracts), 0)::bigint AS total_contracts
+FROM sale_agents sa
+JOIN users u ON sa.sale_agent_id = u.user_id
+LEFT JOIN {rollup} r ON r.sale_agent_id = sa.sale_agent_id
+GROUP BY sa.sale_agent_id, u.last_name, u.first_name, sa.employee_code
+ORDER BY total_contracts DESC LIMIT 10""",
+        # Rating trung bình của nhân viên
+        """SELECT CONCAT(u.last_name, ' ', u.first_name) AS agent_name, sa.employee_code, AVG(a.rating) AS avg_rating, COUNT(a.appointment_id) AS total_rated
+FROM sale_agents sa
+JOIN users u ON sa.sale_agent_id = u.user_id
+JOIN appointment a ON a.agent_id = sa.sale_agent_id AND a.rating IS NOT NULL
+GROUP BY sa.sale_agent_id, u.last_name, u.first_name, sa.employee_code
+ORDER BY avg_rating DESC;""": """SELECT CONCAT(u.last_name, ' ', u.first_name) AS agent_name, sa.employee_code,
+       SUM(r.rating_sum)::numeric / SUM(r.rated_appointments) AS avg_rating,
+       SUM(r.rated_appointments)::bigint AS total_rated
+FROM sale_agents sa
+JOIN users u ON sa.sale_agent_id = u.user_id
+JOIN {rollup} r ON r.sale_agent_id = sa.sale_agent_id
+GROUP BY sa.sale_agent_id, u.last_name, u.first_name, sa.employee_code
+HAVING SUM(r.rated_appointments) > 0
+ORDER BY avg_rating DESC""",
+    },
+)
+
+DEFAULT_ROLLUPS = [PAYMENTS_MONTHLY, PROPERTIES_BY_LOCATION, AGENT_MONTHLY]
+
+
+class RollupManager:
+    """Creates, refreshes and routes queries to rollup tables.
+
+    Rollups live in their own schema next to a small state table holding
+    each rollup's definition and source watermark. A background loop
+    refreshes every ``interval`` seconds: unchanged sources are skipped,
+    and rollups with ``changed_rows_sql`` only rebuild the slices of rows
+    updated since the last watermark. A row table per rollup remembers
+    which slice each source row was counted in, so a row that moved (a
+    payment getting its paid_date, a contract changing agent) also
+    rebuilds the slice it left. The changed-row scan reaches ``lookback``
+    seconds behind the watermark, and keeps running that long after the
+    watermark stops moving, so rows committed with an older updated_at are
+    not missed. Deleted rows and changes to joined tables (a ward moved to
+    another district) are only picked up by the full rebuild of every
+    ``full_refresh_every``-th pass; rewrite() stops routing to a rollup
+    whose last full rebuild is older than ``max_full_staleness``.
+    Refreshes run in a REPEATABLE READ transaction under an advisory lock,
+    so readers never see a half-built table and replicas don't race.
+    """
+
+    def __init__(
+        self,
+        runner: PostgresRunner,
+        rollups: Sequence[Rollup] = DEFAULT_ROLLUPS,
+        schema: str = "vanna_rollup",
+        interval: float = 300.0,
+        full_refresh_every: int = 12,
+        max_staleness: Optional[float] = None,
+        max_full_staleness: Optional[float] = None,
+        lookback: Optional[float] = None,
+    ):
+        """Initialize the manager.
+
+        Args:
+            runner: Runner whose pool is used for DDL and refreshes
+            rollups: Rollup definitions to manage
+            schema: Schema holding the rollup tables
+            interval: Seconds between refresh passes
+            full_refresh_every: Every Nth pass is a full rebuild
+            max_staleness: Oldest refresh (seconds) the rewriter will still
+                route to (defaults to 2 * interval)
+            max_full_staleness: Oldest full rebuild (seconds) the rewriter
+                will still route to (defaults to 2 * interval * full_refresh_every)
+            lookback: Seconds the changed-row scan reaches behind the
+                watermark, longer than a writer transaction plus one
+                interval (defaults to 2 * interval)
+        """
+        self.runner = runner
+        self.rollups = {r.name: r for r in rollups}
+        self.schema = schema
+        self.interval = interval
+        self.full_refresh_every = full_refresh_every
+        self.max_staleness = max_staleness if max_staleness is not None else 2 * interval
+        self.max_full_staleness = (
+            max_full_staleness if max_full_staleness is not None else 2 * interval * full_refresh_every
+        )
+        self.lookback = lookback if lookback is not None else 2 * interval
+
+        # fingerprint of a known query -> (rollup name, rewritten SQL)
+        self._rewrites: Dict[str, Tuple[str, str]] = {}
+        for rollup in rollups:
+            for original, rewritten in rollup.rewrites.items():
+                self._rewrites[sql_fingerprint(original)] = (
+                    rollup.name,
+                    rewritten.format(rollup=self._table(rollup)),
+                )
+
+        # rollup name -> time.time() of the last successful refresh / full rebuild
+        self._refreshed_at: Dict[str, float] = {}
+        self._full_refreshed_at: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._ready = False
+
+    def _table(self, rollup: Rollup) -> str:
+        return f"{self.schema}.{rollup.name}"
+
+    def _rows_table(self, rollup: Rollup) -> str:
+        """Table mapping each source row to the slice it is counted in."""
+        return f"{self.schema}.{rollup.name}_rows"
+
+    @staticmethod
+    def _incremental(rollup: Rollup) -> bool:
+        return rollup.row_keys_sql is not None and rollup.changed_rows_sql is not None
+
+    @staticmethod
+    def _definition(rollup: Rollup) -> str:
+        """What the stored tables were built from; a change forces a rebuild."""
+        return "\n;\n".join(q for q in (rollup.sql, rollup.row_keys_sql) if q)
+
+    def rewrite(self, sql: str) -> Optional[str]:
+        """Return the rollup query for a known SQL, or None to run it as is."""
+        match = self._rewrites.get(sql_fingerprint(sql))
+        if match is None:
+            return None
+        name, rewritten = match
+        now = time.time()
+        refreshed_at = self._refreshed_at.get(name)
+        full_refreshed_at = self._full_refreshed_at.get(name)
+        if refreshed_at is None or now - refreshed_at > self.max_staleness:
+            return None
+        if full_refreshed_at is None or now - full_refreshed_at > self.max_full_staleness:
+            return None
+        return rewritten
+
+    async def ensure(self) -> None:
+        """Create the schema, state table and any missing or redefined rollups."""
+        pool = await self.runner.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {self.schema}")
+            await conn.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.schema}.rollup_state (
+                    name TEXT PRIMARY KEY,
+                    definition TEXT NOT NULL,
+                    watermark TIMESTAMP,
+                    refreshed_at DOUBLE PRECISION,
+                    full_refreshed_at DOUBLE PRECISION
+                )"""
+            )
+            await conn.execute(
+                f"ALTER TABLE {self.schema}.rollup_state "
+                "ADD COLUMN IF NOT EXISTS watermark_moved_at DOUBLE PRECISION"
+            )
+            for rollup in self.rollups.values():
+                table = self._table(rollup)
+                rows_table = self._rows_table(rollup)
+                state = await conn.fetchrow(
+                    f"SELECT definition, refreshed_at, full_refreshed_at "
+                    f"FROM {self.schema}.rollup_state WHERE name = $1",
+                    rollup.name,
+                )
+                async with conn.transaction():
+                    if state is not None and state["definition"] != self._definition(rollup):
+                        logger.info(f"Rollup {rollup.name} definition changed, rebuilding")
+                        await conn.execute(f"DROP TABLE IF EXISTS {table}")
+                        await conn.execute(f"DROP TABLE IF EXISTS {rows_table}")
+                        await conn.execute(
+                            f"DELETE FROM {self.schema}.rollup_state WHERE name = $1", rollup.name
+                        )
+                        state = None
+                    await conn.execute(f"CREATE TABLE IF NOT EXISTS {table} AS {rollup.sql} WITH NO DATA")
+                    await conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {rollup.name}_key ON {table} ({rollup.key_column})"
+                    )
+                    if self._incremental(rollup):
+                        await conn.execute(
+                            f"CREATE TABLE IF NOT EXISTS {rows_table} AS {rollup.row_keys_sql} WITH NO DATA"
+                        )
+                        await conn.execute(
+                            f"CREATE UNIQUE INDEX IF NOT EXISTS {rollup.name}_rows_id ON {rows_table} (row_id)"
+                        )
+                if state is not None and state["refreshed_at"] is not None:
+                    self._refreshed_at[rollup.name] = state["refreshed_at"]
+                if state is not None and state["full_refreshed_at"] is not None:
+                    self._full_refreshed_at[rollup.name] = state["full_refreshed_at"]
+        self._ready = True
+
+    async def refresh(self, rollup: Rollup, full: bool = False) -> bool:
+        """Bring one rollup up to date.
+
+        Args:
+            rollup: Rollup to refresh
+            full: Rebuild the whole table instead of the changed slices
+
+        Returns:
+            True if rows were rewritten, False if the sources were unchanged
+            or another process holds the refresh lock
+        """
+        table = self._table(rollup)
+        rows_table = self._rows_table(rollup)
+        key = rollup.key_column
+        pool = await self.runner.get_pool()
+
+        async with pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read"):
+                locked = await conn.fetchval(
+                    "SELECT pg_try_advisory_xact_lock(hashtext($1))", table
+                )
+                if not locked:
+                    return False
+
+                state = await conn.fetchrow(
+                    f"SELECT watermark, watermark_moved_at FROM {self.schema}.rollup_state WHERE name = $1",
+                    rollup.name,
+                )
+                watermark = await conn.fetchval(rollup.watermark_sql)
+                now = time.time()
+
+                if state is None or not self._incremental(rollup) or state["watermark"] is None:
+                    full = True
+                moved_at = now
+                if state is not None and watermark == state["watermark"]:
+                    moved_at = state["watermark_moved_at"] or now
+
+                changed = True
+                if full:
+                    await conn.execute(f"DELETE FROM {table}")
+                    await conn.execute(f"INSERT INTO {table} {rollup.sql}")
+                    if self._incremental(rollup):
+                        await conn.execute(f"DELETE FROM {rows_table}")
+                        await conn.execute(
+                            f"INSERT INTO {rows_table} (row_id, slice_key) {rollup.row_keys_sql}"
+                        )
+                elif watermark == state["watermark"] and now - moved_at > self.lookback:
+                    changed = False
+                else:
+                    # Slices the changed rows count towards now and the ones they were
+                    # counted in before; the CTE reads the row table before the upsert
+                    since = state["watermark"] - timedelta(seconds=self.lookback)
+                    keys = [
+                        r[0]
+                        for r in await conn.fetch(
+                            f"""WITH changed AS ({rollup.changed_rows_sql}),
+                            previous AS (
+                                SELECT r.slice_key FROM {rows_table} r JOIN changed c USING (row_id)
+                            ),
+                            moved AS (
+                                INSERT INTO {rows_table} (row_id, slice_key)
+                                SELECT row_id, slice_key FROM changed
+                                ON CONFLICT (row_id) DO UPDATE SET slice_key = EXCLUDED.slice_key
+                            )
+                            SELECT slice_key FROM changed UNION SELECT slice_key FROM previous""",
+                            since,
+                        )
+                    ]
+                    has_null = any(k is None for k in keys)
+                    keys = [k for k in keys if k is not None]
+                    await conn.execute(
+                        f"DELETE FROM {table} WHERE {key} = ANY($1) OR ($2 AND {key} IS NULL)",
+                        keys, has_null,
+                    )
+                    await conn.execute(
+                        f"INSERT INTO {table} SELECT * FROM ({rollup.sql}) s "
+                        f"WHERE s.{key} = ANY($1) OR ($2 AND s.{key} IS NULL)",
+                        keys, has_null,
+                    )
+
+                await conn.execute(
+                    f"""INSERT INTO {self.schema}.rollup_state
+                        (name, definition, watermark, refreshed_at, full_refreshed_at, watermark_moved_at)
+                    VALUES ($1, $2, $3::timestamp, $4::float8, $5::float8, $6::float8)
+                    ON CONFLICT (name) DO UPDATE SET
+                        watermark = EXCLUDED.watermark,
+                        refreshed_at = EXCLUDED.refreshed_at,
+                        full_refreshed_at = COALESCE(EXCLUDED.full_refreshed_at, rollup_state.full_refreshed_at),
+                        watermark_moved_at = EXCLUDED.watermark_moved_at""",
+                    rollup.name, self._definition(rollup), watermark, now, now if full else None, moved_at,
+                )
+
+        self._refreshed_at[rollup.name] = now
+        if full:
+            self._full_refreshed_at[rollup.name] = now
+        return changed
+
+    async def refresh_all(self, full: bool = False) -> Dict[str, bool]:
+        """Refresh every rollup; failures are logged and leave that rollup stale."""
+        if not self._ready:
+            await self.ensure()
+        results: Dict[str, bool] = {}
+        for rollup in self.rollups.values():
+            started = time.perf_counter()
+            try:
+                results[rollup.name] = await self.refresh(rollup, full=full)
+            except Exception as e:
+                logger.warning(f"Rollup {rollup.name} refresh failed: {e}")
+                continue
+            logger.debug(
+                f"Rollup {rollup.name} refreshed (full={full}, changed={results[rollup.name]}) "
+                f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+            )
+        return results
+
+    def start(self) -> None:
+        """Start the background refresh loop on the running event loop (idempotent)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background refresh loop."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        passes = 0
+        while True:
+            try:
+                await self.refresh_all(full=passes % self.full_refresh_every == 0)
+            except Exception as e:
+                logger.warning(f"Rollup refresh pass failed: {e}")
+            passes += 1
+            await asyncio.sleep(self.interval)
+
+
+class RollupSqlRunner(SqlRunner):
+    """SqlRunner decorator that sends known aggregate queries to rollups.
+
+    Queries whose normalized text matches a rollup rewrite run against the
+    rollup table instead, as long as it was refreshed within the manager's
+    staleness bound. Everything else goes to the wrapped runner unchanged.
+    The manager's refresh loop is started by the server's lifespan.
+    """
+
+    def __init__(self, runner: SqlRunner, manager: RollupManager):
+        self.runner = runner
+        self.manager = manager
+        self.rewrites = 0
+
+    async def run_sql(self, args: RunSqlToolArgs, context: ToolContext) -> pd.DataFrame:
+        """Execute SQL, reading from a rollup when one answers the query.
+
+        Args:
+            args: Tool arguments containing the SQL query
+            context: Tool execution context
+
+        Returns:
+            pandas DataFrame with query results
+        """
+        rewritten = self.manager.rewrite(args.sql)
+        if rewritten is not None:
+            self.rewrites += 1
+            args = RunSqlToolArgs(sql=rewritten)
+        return await self.runner.run_sql(args, context)
@@ -0,0 +1,289 @@
+"""Per-question pruning of the schema system prompt."""
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from vanna.core.enhancer import DefaultLlmContextEnhancer
+from vanna.core.user import User
+from vanna.capabilities.agent_memory import AgentMemory
+
+from persistent_memory import HashingEmbedder
+from sql_cache import referenced_tables
+
+logger = logging.getLogger(__name__)
+
+
+_CREATE_TABLE = re.compile(r"CREATE TABLE\s+(\w+)", re.I)
+_REFERENCES = re.compile(r"REFERENCES\s+(\w+)\s*\(", re.I)
+_SQL_BLOCK = re.compile(r"```sql\n(.*?)```", re.S)
+_LABEL = re.compile(r"\(([^)]*)\)")
+_KEYWORD_HINT = re.compile(r'^\s*-\s*"([^"]+)"\s*→(.*)$')
+_BACKTICKED = re.compile(r"`(\w+)`")
+
+# Prompt layers, emitted in this order by SchemaPromptIndex.build()
+STATIC_LAYER = 0
+SCHEMA_LAYER = 1
+EXAMPLE_LAYER = 2
+
+
+@dataclass
+class PromptChunk:
+    """One piece of the system prompt.
+
+    ``kind`` is "static" (always kept), "table" (kept when its table is
+    selected) or "example" (kept when retrieved for the question). ``layer``
+    decides where the chunk lands in the rebuilt prompt.
+    """
+
+    kind: str
+    text: str
+    tables: Set[str] = field(default_factory=set)
+    layer: int = STATIC_LAYER
+
+
+class SchemaPromptIndex:
+    """Splits a markdown schema prompt into chunks and rebuilds it per question.
+
+    The prompt is expected to look like CUSTOM_SYSTEM_PROMPT: a
+    ``## DATABASE SCHEMA`` section with one ``CREATE TABLE`` per ``###`` or
+    ``####`` heading, an ``## EXAMPLE QUERIES`` section with one ``###``
+    heading per example, and a keyword hint list
+    (``- "Khách hàng" → Bảng `customers` ...``). Everything else is kept
+    verbatim.
+
+    Tables are selected from keyword hints and table names/labels found in
+    the question, plus the tables used by the most similar examples, then
+    expanded along outgoing foreign keys (properties → wards → districts →
+    cities). Questions that match no table get the full prompt.
+    """
+
+    def __init__(
+        self,
+        prompt: str,
+        max_examples: int = 3,
+        min_example_similarity: float = 0.45,
+        fk_depth: int = 3,
+    ):
+        """Parse and index the prompt.
+
+        Args:
+            prompt: Full system prompt
+            max_examples: Most example queries included per question
+            min_example_similarity: Minimum similarity for an example to be used
+            fk_depth: Hops of outgoing foreign keys added around matched tables
+        """
+        self.prompt = prompt
+        self.max_examples = max_examples
+        self.min_example_similarity = min_example_similarity
+        self.fk_depth = fk_depth
+        self.embedder = HashingEmbedder()
+
+        self.chunks: List[PromptChunk] = []
+        self.foreign_keys: Dict[str, Set[str]] = {}
+        # table -> its CREATE TABLE statement
+        self.ddl: Dict[str, str] = {}
+        # normalized phrase -> tables it points at
+        self.keywords: Dict[str, Set[str]] = {}
+        self._parse(prompt)
+
+        self._examples = [c for c in self.chunks if c.kind == "example"]
+        self._example_vectors = (
+            # Headings read like questions; the SQL below them only adds noise
+            self.embedder([c.text.split("\n", 1)[0].lstrip("#") for c in self._examples])
+            if self._examples
+            else np.zeros((0, self.embedder.dim), dtype=np.float32)
+        )
+
+    def _parse(self, prompt: str) -> None:
+        """Split the prompt into static, table and example chunks."""
+        for section in re.split(r"(?m)^(?=## )", prompt):
+            title = section.split("\n", 1)[0]
+            if title.startswith("## DATABASE SCHEMA"):
+                self._parse_schema(section)
+            elif title.startswith("## EXAMPLE QUERIES"):
+                self._parse_examples(section)
+            elif _SQL_BLOCK.search(section):
+                # Worked-example sections ("## ... CÁCH JOIN ...") are retrieved like examples
+                self._parse_examples(section, split=False)
+            else:
+                self.chunks.append(PromptChunk("static", section))
+                for line in section.splitlines():
+                    hint = _KEYWORD_HINT.match(line)
+                    if hint:
+                        tables = set(_BACKTICKED.findall(hint.group(2)))
+                        for phrase in hint.group(1).split("/"):
+                            self._add_keyword(phrase, tables)
+
+    def _parse_schema(self, section: str) -> None:
+        """One chunk per CREATE TABLE; notes attach to the table they describe."""
+        blocks = re.split(r"(?m)^(?=###)", section)
+        self.chunks.append(PromptChunk("static", blocks[0], layer=SCHEMA_LAYER))
+
+        category_labels: List[str] = []
+        previous: Optional[PromptChunk] = None
+        for block in blocks[1:]:
+            heading, _, body = block.partition("\n")
+            created = _CREATE_TABLE.search(body)
+
+            if created:
+                table = created.group(1).lower()
+                chunk = PromptChunk("table", block, {table}, SCHEMA_LAYER)
+                self.chunks.append(chunk)
+                self.foreign_keys[table] = {t.lower() for t in _REFERENCES.findall(body)} - {table}
+                ddl = _SQL_BLOCK.search(body)
+                if ddl:
+                    self.ddl[table] = ddl.group(1).strip()
+                if heading.startswith("### "):
+                    # The table heading is its own category ("### 5. CONTRACTS (Hợp đồng)")
+                    category_labels = []
+                # Category labels stand in for tables without a label of their own
+                labels = _LABEL.findall(heading) or category_labels
+                for label in [table, table.replace("_", " ")] + labels:
+                    for phrase in label.split("/"):
+                        self._add_keyword(phrase, {table})
+                previous = chunk
+            elif not body.strip():
+                # Category heading ("### 2. LOCATION (Địa điểm)"): labels only
+                category_labels = _LABEL.findall(heading)
+            else:
+                # Notes ("### ⚠️ LƯU Ý QUAN TRỌNG VỀ PAYMENTS") follow their table
+                named = [c for c in self.chunks if c.kind == "table" and c.tables & set(re.findall(r"\w+", heading.lower()))]
+                owner = named[-1] if named else previous
+                if owner is not None:
+                    owner.text += block
+                else:
+                    self.chunks.append(PromptChunk("static", block, layer=SCHEMA_LAYER))
+
+    def _parse_examples(self, section: str, split: bool = True) -> None:
+        """One chunk per ### example, tagged with the tables its SQL uses."""
+        if split:
+            blocks = re.split(r"(?m)^(?=### )", section)
+            self.chunks.append(PromptChunk("static", blocks[0], layer=EXAMPLE_LAYER))
+            blocks = blocks[1:]
+        else:
+            blocks = [section]
+        for block in blocks:
+            tables: Set[str] = set()
+            for sql in _SQL_BLOCK.findall(block):
+                tables |= referenced_tables(sql)
+            self.chunks.append(PromptChunk("example", block, tables, EXAMPLE_LAYER))
+
+    def _add_keyword(self, phrase: str, tables: Set[str]) -> None:
+        phrase = self.embedder._normalize(phrase)
+        if phrase:
+            self.keywords.setdefault(phrase, set()).update(tables)
+
+    def _matched_tables(self, question: str) -> Set[str]:
+        """Tables whose keyword, or any two-word slice of it, appears in the question."""
+        text = f" {self.embedder._normalize(question)} "
+        matched: Set[str] = set()
+        for phrase, tables in self.keywords.items():
+            words = phrase.split()
+            slices = [phrase] + [" ".join(words[i:i + 2]) for i in range(len(words) - 1)]
+            if any(f" {s} " in text for s in slices):
+                matched |= tables
+        return matched
+
+    def _with_foreign_keys(self, tables: Set[str]) -> Set[str]:
+        selected = set(tables)
+        frontier = set(tables)
+        for _ in range(self.fk_depth):
+            frontier = {
+                ref for t in frontier for ref in self.foreign_keys.get(t, ())
+            } - selected
+            if not frontier:
+                break
+            selected |= frontier
+        return selected
+
+    def tables_in_dependency_order(self) -> List[str]:
+        """Return every table after the tables its foreign keys point at.
+
+        The prompt lists tables by topic (users references wards, which comes
+        later), so its order cannot be used to create or load them. Cycles are
+        broken arbitrarily.
+        """
+        ordered: List[str] = []
+        visiting: Set[str] = set()
+
+        def visit(table: str) -> None:
+            if table in visiting or table in ordered:
+                return
+            visiting.add(table)
+            for ref in sorted(self.foreign_keys.get(table, ())):
+                if ref in self.foreign_keys:
+                    visit(ref)
+            visiting.discard(table)
+            ordered.append(table)
+
+        for table in self.foreign_keys:
+            visit(table)
+        return ordered
+
+    def select(self, question: str) -> Optional[Set[str]]:
+        """Return the tables to include for a question, or None for the full prompt."""
+        matched = self._matched_tables(question) & set(self.foreign_keys)
+        if not matched:
+            return None
+        return self._with_foreign_keys(matched)
+
+    def build(self, question: str) -> str:
+        """Return the prompt reduced to what the question needs.
+
+        Chunks are laid out by layer rather than in source order: the static
+        guidance first, then the schema tables, then examples. Tables and
+        examples always keep their source order, so questions touching the
+        same tables produce byte-identical prefixes and provider-side prompt
+        caching can reuse them.
+        """
+        tables = self.select(question)
+        if tables is None:
+            # Same layout as a pruned prompt, so the static prefix still matches
+            tables = set(self.foreign_keys)
+            examples = list(self._examples)
+        else:
+            examples = []
+            if self._examples:
+                scores = self._example_vectors @ self.embedder([question])[0]
+                for i in np.argsort(scores)[::-1][: self.max_examples]:
+                    if scores[i] >= self.min_example_similarity:
+                        examples.append(self._examples[i])
+                for example in examples:
+                    tables |= self._with_foreign_keys(example.tables & set(self.foreign_keys))
+
+        parts = []
+        for layer in (STATIC_LAYER, SCHEMA_LAYER, EXAMPLE_LAYER):
+            for chunk in self.chunks:
+                if chunk.layer != layer:
+                    continue
+                if (
+                    chunk.kind == "static"
+                    or (chunk.kind == "table" and chunk.tables & tables)
+                    or (chunk.kind == "example" and any(chunk is e for e in examples))
+                ):
+                    parts.append(chunk.text.rstrip("\n") + "\n\n")
+
+        logger.debug(f"Schema prompt for {question!r}: tables={sorted(tables)}, examples={len(examples)}")
+        return "".join(parts)
+
+
+class SchemaPruningContextEnhancer(DefaultLlmContextEnhancer):
+    """Replaces the full schema prompt with the per-question pruned version.
+
+    Prompts other than the indexed one pass through untouched. Relevant text
+    memories are still appended by DefaultLlmContextEnhancer.
+    """
+
+    def __init__(self, index: SchemaPromptIndex, agent_memory: Optional[AgentMemory] = None):
+        super().__init__(agent_memory)
+        self.index = index
+
+    async def enhance_system_prompt(
+        self, system_prompt: str, user_message: str, user: User
+    ) -> str:
+        if system_prompt == self.index.prompt:
+            system_prompt = self.index.build(user_message)
+        return await super().enhance_system_prompt(system_prompt, user_message, user)
@@ -3,21 +3,55 @@
 # Kết nối cùng database PostgreSQL với Spring Boot Backend
 # ============================================================================
 
+import asyncio
+import logging
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from vanna import Agent, AgentConfig
-from vanna.core.registry import ToolRegistry
+from vanna import AgentConfig
+from vanna.core.system_prompt import DefaultSystemPromptBuilder
 from vanna.core.user import User, UserResolver
 from vanna.servers.fastapi import VannaFastAPIServer
-from vanna.integrations.openai import OpenAILlmService
-from vanna.tools import RunSqlTool, VisualizeDataTool
+from starlette.middleware import Middleware
+from starlette.routing import Route
 from vanna.tools.agent_memory import SaveQuestionToolArgsTool, SearchSavedCorrectToolUsesTool
-from vanna.integrations.local.agent_memory import DemoAgentMemory
-from vanna.integrations.postgres import PostgresRunner
+from postgres_runner import PostgresRunner
+from openai_llm import CachingOpenAILlmService
+from mock_llm import LatencyModel, ScriptedLlmService
+from sql_cache import CachedSqlRunner
+from fast_path import FastPathWorkflowHandler
+from persistent_memory import PersistentAgentMemory
+from schema_prompt import SchemaPromptIndex, SchemaPruningContextEnhancer
+from rollups import RollupManager, RollupSqlRunner
+from query_guard import CostGuardSqlRunner, FeedbackRunSqlTool
+from disconnect import CancelOnDisconnectMiddleware
+from sql_templates import RunTemplateTool, TemplateRegistry
+from sql_batch import RunSqlBatchTool
+from offload import OffloadedVisualizeDataTool, ResultOffloader
+from result_digest import RESULTS_PATH, ResultDigester, results_endpoint
+from single_flight import CoalescingAgent
+from metrics import (
+    REGISTRY,
+    InstrumentedToolRegistry,
+    MetricsMiddleware,
+    MetricsObservabilityProvider,
+    TraceIdFilter,
+    metrics_endpoint,
+    watch_event_loop_lag,
+)
 
 # Load environment variables
 load_dotenv()
 
+# Log kèm trace ID (= conversation ID) để gom log của cùng một hội thoại
+_log_handler = logging.StreamHandler()
+_log_handler.addFilter(TraceIdFilter())
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s",
+    handlers=[_log_handler],
+)
+
 # ============================================================================
 # Simple Anonymous User Resolver
 # ============================================================================
@@ -30,10 +64,49 @@ class AnonymousUserResolver(UserResolver):
 # Configuration
 # ============================================================================
 
-# LLM Service
-llm = OpenAILlmService(
-    model="o3",
-    api_key=os.getenv("OPENAI_API_KEY"),
+# LLM giả lập (LLM_MOCK=true) - không gọi OpenAI, trả về SQL của training data với độ trễ
+# cấu hình được; dùng cho load test / capacity planning
+llm_mock = os.getenv("LLM_MOCK", "false").lower() == "true"
+if llm_mock:
+    llm = ScriptedLlmService(
+        latency=LatencyModel(
+            first_token_ms=float(os.getenv("LLM_MOCK_FIRST_TOKEN_MS", "800")),
+            sigma=float(os.getenv("LLM_MOCK_SIGMA", "0.5")),
+            tokens_per_second=float(os.getenv("LLM_MOCK_TOKENS_PER_SECOND", "60")),
+        ),
+        seed=int(os.getenv("LLM_MOCK_SEED", "0")),
+    )
+    fast_path_llm = llm
+else:
+    # LLM Service - ghi lại số prompt token được cache / phải xử lý mới cho mỗi lần gọi
+    llm = CachingOpenAILlmService(
+        model="o3",
+        api_key=os.getenv("OPENAI_API_KEY"),
+        prompt_cache_key=os.getenv("LLM_PROMPT_CACHE_KEY", "res-vanna-agent"),
+    )
+
+    # LLM rẻ chỉ dùng để diễn giải kết quả cho fast path
+    fast_path_llm = CachingOpenAILlmService(
+        model=os.getenv("FAST_PATH_MODEL", "gpt-4o-mini"),
+        api_key=os.getenv("OPENAI_API_KEY"),
+        prompt_cache_key=os.getenv("LLM_PROMPT_CACHE_KEY", "res-vanna-agent") + "-fast-path",
+    )
+
+# Chuyển kết quả lớn (records -> DataFrame, CSV, dữ liệu bảng/biểu đồ) sang thread riêng,
+# để một kết quả 200k dòng không chặn event loop của các stream chat khác
+result_offloader = ResultOffloader(
+    max_workers=int(os.getenv("RESULT_OFFLOAD_WORKERS", "2")),
+    min_cells=int(os.getenv("RESULT_OFFLOAD_MIN_CELLS", "50000")),
+)
+
+# Kết quả lớn chỉ gửi cho LLM bản tóm tắt (số dòng, kiểu cột, thống kê, top giá trị, vài dòng đầu/cuối);
+# toàn bộ kết quả nằm trong file CSV cho visualize_data và tải về, để prompt không phình theo số dòng
+result_digester = ResultDigester(
+    verbatim_rows=int(os.getenv("RESULT_DIGEST_VERBATIM_ROWS", "50")),
+    verbatim_chars=int(os.getenv("RESULT_DIGEST_VERBATIM_CHARS", "2000")),
+    head_rows=int(os.getenv("RESULT_DIGEST_HEAD_ROWS", "5")),
+    tail_rows=int(os.getenv("RESULT_DIGEST_TAIL_ROWS", "3")),
+    top_k=int(os.getenv("RESULT_DIGEST_TOP_K", "5")),
 )
 
 # Database Runner - Kết nối cùng PostgreSQL với Backend
@@ -42,11 +115,61 @@ db_runner = PostgresRunner(
     port=int(os.getenv("POSTGRES_PORT", os.getenv("POSTGRESQL_PORT", "5432"))),
     database=os.getenv("POSTGRES_DB", os.getenv("POSTGRESQL_DB", "postgres")),
     user=os.getenv("POSTGRES_USER", os.getenv("POSTGRESQL_USER", "postgres")),
-    password=os.getenv("POSTGRES_PASSWORD", os.getenv("POSTGRESQL_PASSWORD", "secret"))
+    password=os.getenv("POSTGRES_PASSWORD", os.getenv("POSTGRESQL_PASSWORD", "secret")),
+    # Streaming đọc kết quả theo từng chunk, giới hạn số dòng/bộ nhớ
+    streaming=os.getenv("SQL_STREAMING", "true").lower() == "true",
+    chunk_size=int(os.getenv("SQL_CHUNK_SIZE", "10000")),
+    max_rows=int(os.getenv("SQL_MAX_ROWS", "500000")),
+    max_bytes=int(os.getenv("SQL_MAX_BYTES", str(512 * 1024 * 1024))),
+    # Giới hạn thời gian mỗi query / thời gian chờ lock, để không giữ lock của Backend
+    statement_timeout=float(os.getenv("SQL_STATEMENT_TIMEOUT", "30")),
+    lock_timeout=float(os.getenv("SQL_LOCK_TIMEOUT", "2")),
+    # Agent chỉ phân tích dữ liệu: câu lệnh ghi/DDL bị từ chối trước khi tới database
+    allow_writes=os.getenv("SQL_ALLOW_WRITES", "false").lower() == "true",
+    # Read replica: query đọc chạy trên replica (READ ONLY), primary chỉ dùng khi được cho phép
+    replicas=[dsn.strip() for dsn in os.getenv("POSTGRES_REPLICAS", "").split(",") if dsn.strip()],
+    replica_selection=os.getenv("POSTGRES_REPLICA_SELECTION", "least_loaded"),
+    max_replica_lag=float(os.getenv("POSTGRES_MAX_REPLICA_LAG", "30")),
+    allow_primary_reads=os.getenv("POSTGRES_ALLOW_PRIMARY_READS", "false").lower() == "true",
+    # Pool mở sẵn min_size kết nối lúc khởi động (lifespan), mỗi kết nối có sẵn session settings
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "5")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "20")),
+    session_settings={"application_name": os.getenv("POSTGRES_APPLICATION_NAME", "res-vanna-agent")},
+    # Các query đọc giống hệt nhau đang chạy đồng thời dùng chung một lần thực thi
+    coalesce_reads=os.getenv("SQL_COALESCE", "true").lower() == "true",
+    offloader=result_offloader,
+)
+
+# Cost guard - EXPLAIN trước khi chạy: tự thêm LIMIT hoặc từ chối query quá nặng,
+# để query phân tích không làm chậm OLTP của Backend
+guarded_runner = CostGuardSqlRunner(
+    db_runner,
+    max_cost=float(os.getenv("QUERY_GUARD_MAX_COST", "1000000")),
+    max_rows=int(os.getenv("QUERY_GUARD_MAX_ROWS", "5000")),
+)
+
+# Rollups - bảng tổng hợp (doanh thu, BĐS theo khu vực, hiệu suất nhân viên) được làm mới định kỳ.
+# Tắt mặc định: rollup tạo schema vanna_rollup trong database dùng chung với Backend,
+# chỉ bật (ROLLUPS_ENABLED=true) khi đã được đồng ý cho schema đó
+rollup_manager = RollupManager(
+    db_runner,
+    interval=float(os.getenv("ROLLUP_REFRESH_INTERVAL", "300")),
+    full_refresh_every=int(os.getenv("ROLLUP_FULL_REFRESH_EVERY", "12")),
+)
+rollups_enabled = os.getenv("ROLLUPS_ENABLED", "false").lower() == "true"
+rollup_runner = RollupSqlRunner(guarded_runner, rollup_manager) if rollups_enabled else guarded_runner
+
+# Result cache - câu hỏi dashboard lặp lại không cần chạm tới Postgres
+sql_runner = CachedSqlRunner(
+    rollup_runner,
+    ttl=float(os.getenv("SQL_CACHE_TTL", "300")),
+    max_bytes=int(os.getenv("SQL_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    # max(updated_at) đọc thẳng trên PostgresRunner, không qua rollup/cost guard
+    watermark_runner=db_runner,
 )
 
-# Agent Memory
-agent_memory = DemoAgentMemory(max_items=1000)
+# Agent Memory - lưu trên đĩa (SQLite + embeddings memory-mapped), giữ lại sau khi restart
+agent_memory = PersistentAgentMemory(path=os.getenv("AGENT_MEMORY_PATH", "./agent_memory"))
 
 # User Resolver
 user_resolver = AnonymousUserResolver()
@@ -54,17 +177,39 @@ user_resolver = AnonymousUserResolver()
 # ============================================================================
 # Tool Registry
 # ============================================================================
-tools = ToolRegistry()
+# Mỗi tool call được đo thời gian (histogram theo tool) và đếm số call đang chạy
+tools = InstrumentedToolRegistry()
 
-# Database query tool
+# Database query tool - kèm thông báo của cost guard (LIMIT tự thêm) trong kết quả
 tools.register_local_tool(
-    RunSqlTool(sql_runner=db_runner), 
+    FeedbackRunSqlTool(sql_runner=sql_runner, offloader=result_offloader, digester=result_digester),
     access_groups=[]
 )
 
-# Visualization tool
+# Query templates - câu hỏi phổ biến chỉ khác tham số (thành phố, tháng, mã nhân viên, trạng thái)
+# chạy bằng prepared statement có sẵn trên mỗi kết nối, không phải parse/plan lại
+sql_templates = TemplateRegistry()
 tools.register_local_tool(
-    VisualizeDataTool(), 
+    RunTemplateTool(db_runner, sql_templates, digester=result_digester),
+    access_groups=[]
+)
+
+# Batch query - câu hỏi tổng hợp (tổng quan, báo cáo hiệu suất) gửi nhiều query độc lập
+# trong một lần gọi; các query chạy song song trên các kết nối riêng của pool
+tools.register_local_tool(
+    RunSqlBatchTool(
+        sql_runner,
+        max_queries=int(os.getenv("SQL_BATCH_MAX_QUERIES", "8")),
+        max_concurrency=int(os.getenv("SQL_BATCH_CONCURRENCY", "4")),
+        offloader=result_offloader,
+        digester=result_digester,
+    ),
+    access_groups=[]
+)
+
+# Visualization tool - đọc CSV và dựng biểu đồ trên thread của result_offloader
+tools.register_local_tool(
+    OffloadedVisualizeDataTool(offloader=result_offloader),
     access_groups=[]
 )
 
@@ -613,8 +758,8 @@ ORDER BY avg_appointment_rating DESC NULLS LAST;
 ## NHIỆM VỤ CỦA BẠN
 
 1. Hiểu câu hỏi của người dùng về hệ thống bất động sản
-2. Tạo SQL query chính xác dựa trên schema trên
-3. Chạy query và trả về kết quả
+2. Nếu có template của `run_sql_template` trả lời được câu hỏi, gọi nó với tham số; nếu không, tạo SQL query chính xác dựa trên schema trên
+3. Chạy query và trả về kết quả; nếu cần nhiều query độc lập (vd. tổng quan, báo cáo gồm nhiều chỉ số), gửi tất cả trong một lần gọi `run_sql_batch`
 4. Nếu cần, tạo visualization (biểu đồ) để minh họa
 5. Giải thích kết quả bằng tiếng Việt dễ hiểu
 
@@ -630,17 +775,44 @@ ORDER BY avg_appointment_rating DESC NULLS LAST;
 - "Vi phạm/Báo cáo" → Bảng `violation_reports`
 """
 
-# Create agent with custom system prompt
-agent = Agent(
+# Fast path - câu hỏi trùng với pattern đã lưu chạy thẳng SQL, bỏ qua o3
+fast_path = FastPathWorkflowHandler(
+    agent_memory=agent_memory,
+    answer_llm=fast_path_llm,
+    similarity_threshold=float(os.getenv("FAST_PATH_THRESHOLD", "0.97")),
+    min_margin=float(os.getenv("FAST_PATH_MIN_MARGIN", "0.03")),
+    # Embedder mặc định (HashingEmbedder) coi "đã/chưa thanh toán" gần như giống nhau,
+    # nên chỉ khớp nguyên câu; đặt FAST_PATH_EXACT_MATCH=false khi dùng embedding model thật
+    exact_match_only=(
+        os.getenv("FAST_PATH_EXACT_MATCH").lower() == "true"
+        if os.getenv("FAST_PATH_EXACT_MATCH") else None
+    ),
+)
+
+# Schema pruning - mỗi câu hỏi chỉ gửi các bảng liên quan (và bảng FK) thay vì toàn bộ schema.
+# Phần hướng dẫn cố định đứng đầu prompt để OpenAI prompt cache dùng lại được
+schema_index = SchemaPromptIndex(CUSTOM_SYSTEM_PROMPT)
+
+# Create agent with custom system prompt.
+# Nhiều người hỏi cùng một câu mở đầu cùng lúc (vd. "Doanh thu tháng này" đầu giờ sáng)
+# dùng chung một lần chạy agent (một lượt o3 + SQL) thay vì mỗi người một lượt
+agent = CoalescingAgent(
     llm_service=llm,
     tool_registry=tools,
     user_resolver=user_resolver,
     agent_memory=agent_memory,
+    workflow_handler=fast_path,
+    system_prompt_builder=DefaultSystemPromptBuilder(base_prompt=CUSTOM_SYSTEM_PROMPT),
+    llm_context_enhancer=SchemaPruningContextEnhancer(schema_index, agent_memory),
+    # Thời gian từng bước của agent loop (LLM, prompt, hooks, ...) -> /metrics
+    observability_provider=MetricsObservabilityProvider(),
     config=AgentConfig(
-        system_prompt=CUSTOM_SYSTEM_PROMPT,
         max_tool_iterations=100,
         temperature=0.1
-    )
+    ),
+    coalesce_questions=os.getenv("AGENT_COALESCE", "true").lower() == "true",
+    # File kết quả của lượt chạy chung được copy sang không gian file của từng người theo sau
+    offloader=result_offloader,
 )
 
 # ============================================================================
@@ -1797,22 +1969,169 @@ ORDER BY MIN(price_amount);"""
         }
     ]
     
-    print("📚 Đang pre-populate agent memory cho Real Estate System...")
-    for item in training_data:
-        await agent_memory.save_tool_usage(
-            question=item["question"],
-            tool_name="run_sql",
-            args={"sql": item["sql"]},
-            context=mock_context,
-            success=True,
-            metadata={"source": "pre_training"}
-        )
-    print(f"✅ Đã thêm {len(training_data)} patterns vào memory!")
+    # Store trống (container mới, chưa có volume) -> nạp snapshot thay vì embed lại
+    snapshot_file = os.getenv("AGENT_MEMORY_SNAPSHOT")
+    if snapshot_file and agent_memory.is_empty() and os.path.exists(snapshot_file):
+        restored = await agent_memory.restore_snapshot(snapshot_file)
+        print(f"📦 Đã nạp {restored} memories từ snapshot {snapshot_file}")
+    
+    # Chỉ seed các cặp câu hỏi/SQL mới hoặc đã sửa (so theo hash)
+    added, removed = await agent_memory.sync_seed_data(
+        [{"question": item["question"], "args": {"sql": item["sql"]}} for item in training_data],
+        context=mock_context,
+    )
+    print(f"✅ Training data: +{added} mới, -{removed} cũ ({len(training_data)} patterns)")
+    
+    if snapshot_file and (added or removed or not os.path.exists(snapshot_file)):
+        await agent_memory.save_snapshot(snapshot_file)
 
 # ============================================================================
 # Server Setup
 # ============================================================================
-server = VannaFastAPIServer(agent)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Start-up and shutdown on the serving event loop.
+
+    Memory is seeded, the database pool is opened and warmed (min_size
+    connections, each with the training SQL prepared) and the rollup
+    refresh loop is started before the first request; everything is closed
+    again on shutdown.
+    """
+    from vanna.core.tool import ToolContext
+    from vanna.core.user import User
+
+    await populate_memory()
+
+    # Query templates và query mẫu trong memory được prepare sẵn trên mỗi kết nối
+    context = ToolContext(
+        user=User(id="system", email="system@vanna.ai", group_memberships=[]),
+        agent_memory=agent_memory,
+        conversation_id="warmup",
+        request_id="warmup-request",
+    )
+    memories = await agent_memory.get_recent_memories(
+        context, limit=int(os.getenv("POSTGRES_WARM_STATEMENTS", "200"))
+    )
+    await db_runner.start(
+        sql_templates.statements()
+        + [m.args["sql"] for m in memories if m.tool_name == "run_sql" and m.args.get("sql")]
+    )
+
+    if llm_mock:
+        # LLM giả lập trả lời các câu hỏi đã lưu bằng đúng SQL của chúng
+        saved = await agent_memory.get_recent_memories(context, limit=100000)
+        llm.add_scripts({m.question: m.args["sql"] for m in saved if m.tool_name == "run_sql" and m.args.get("sql")})
+
+    if rollups_enabled:
+        rollup_manager.start()
+    # Độ trễ event loop (do code đồng bộ/CPU chặn loop) -> /metrics; bước nào chặn loop lâu hơn
+    # EVENT_LOOP_BLOCK_THRESHOLD giây thì log call stack của nó (0 = tắt)
+    lag_watcher = asyncio.create_task(
+        watch_event_loop_lag(
+            float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.1")),
+            block_threshold=float(os.getenv("EVENT_LOOP_BLOCK_THRESHOLD", "0.25")),
+        )
+    )
+    try:
+        yield
+    finally:
+        lag_watcher.cancel()
+        await rollup_manager.stop()
+        await db_runner.close()
+        result_offloader.close()
+        agent_memory.close()
+
+
+# Metrics đọc lúc scrape: pool kết nối, result cache, cost guard, token LLM, rollups, templates
+REGISTRY.callback(
+    "vanna_db_pool_connections",
+    "Connections per database pool by state (size, idle, max)",
+    lambda: {
+        (pool, state): value
+        for pool, stats in db_runner.pool_stats().items()
+        for state, value in stats.items()
+    },
+    ["pool", "state"],
+)
+REGISTRY.callback(
+    "vanna_sql_cache_events_total",
+    "Result cache hits, misses and evictions",
+    lambda: {
+        ("hit",): sql_runner.hits,
+        ("miss",): sql_runner.misses,
+        ("eviction",): sql_runner.evictions,
+        ("uncacheable",): sql_runner.uncacheable,
+    },
+    ["event"],
+    kind="counter",
+)
+REGISTRY.callback(
+    "vanna_sql_cache_bytes", "Bytes held by the result cache", lambda: {(): sql_runner.nbytes}
+)
+REGISTRY.callback(
+    "vanna_query_guard_decisions_total",
+    "Cost guard decisions",
+    lambda: {(action,): count for action, count in guarded_runner.stats.items()},
+    ["action"],
+    kind="counter",
+)
+REGISTRY.callback(
+    "vanna_result_offload_total",
+    "Result conversions/renderings run on a worker thread or inline on the event loop",
+    lambda: {("worker",): result_offloader.offloaded, ("inline",): result_offloader.inline},
+    ["where"],
+    kind="counter",
+)
+REGISTRY.callback(
+    "vanna_single_flight_calls_total",
+    "Calls that started shared work (leader) or joined work already in flight (follower)",
+    lambda: {
+        (scope, role): count
+        for scope, flights in (("agent", agent.question_flights), ("sql", db_runner.read_flights))
+        for role, count in (("leader", flights.leaders), ("follower", flights.followers))
+    },
+    ["scope", "role"],
+    kind="counter",
+)
+if not llm_mock:
+    REGISTRY.callback(
+        "vanna_llm_tokens_total",
+        "LLM tokens per service by kind (cached/fresh prompt tokens, completion tokens)",
+        lambda: {
+            (role, service.model, kind): service.stats[f"{kind}_tokens"]
+            for role, service in (("agent", llm), ("fast_path", fast_path_llm))
+            for kind in ("cached_prompt", "fresh_prompt", "completion")
+        },
+        ["service", "model", "kind"],
+        kind="counter",
+    )
+if rollups_enabled:
+    REGISTRY.callback(
+        "vanna_rollup_rewrites_total",
+        "Queries answered from rollups",
+        lambda: {(): rollup_runner.rewrites},
+        kind="counter",
+    )
+
+# Client ngắt kết nối -> huỷ request (và query SQL đang chạy); /metrics cho Prometheus;
+# RESULTS_PATH/<file> tải về toàn bộ kết quả của một query (chỉ file của chính user đó)
+server = VannaFastAPIServer(
+    agent,
+    config={
+        "fastapi": {
+            "middleware": [Middleware(MetricsMiddleware), Middleware(CancelOnDisconnectMiddleware)],
+            "routes": [
+                Route("/metrics", metrics_endpoint),
+                Route(
+                    RESULTS_PATH + "/{filename}",
+                    results_endpoint(user_resolver, agent_memory, offloader=result_offloader),
+                ),
+            ],
+            "lifespan": lifespan,
+        }
+    },
+)
 
 if __name__ == "__main__":
     print("🏠 Starting Vanna AI - Real Estate System Analysis...")
@@ -1831,8 +2150,5 @@ if __name__ == "__main__":
     print("\n📊 Kết nối cùng database PostgreSQL với Backend!")
     print("🧠 Agent Memory tự động học từ các query thành công!\n")
     
-    # Pre-populate memory before starting server
-    import asyncio
-    asyncio.run(populate_memory())
-    
+    # Memory, pool và rollups được khởi tạo trong lifespan, trên cùng event loop với server
     server.run()
@@ -0,0 +1,317 @@
+"""Single-flight coalescing of identical concurrent work (agent runs, SQL reads)."""
+import asyncio
+import logging
+import re
+import uuid
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    TypeVar,
+)
+
+from vanna import Agent
+from vanna.capabilities.file_system import FileSystem
+from vanna.components import UiComponent
+from vanna.core.storage import Conversation, Message
+from vanna.core.tool import ToolContext
+from vanna.core.user import RequestContext, User
+from vanna.integrations.local import LocalFileSystem
+
+from offload import ResultOffloader
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Result files RunSqlTool saves and tool results refer to
+_RESULT_FILE = re.compile(r"query_results_[0-9a-f]{8}\.csv")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase and collapse whitespace so lookups ignore formatting."""
+    return " ".join(question.lower().split())
+
+
+class _Flight:
+    """One in-flight computation and the callers attached to it."""
+
+    def __init__(self) -> None:
+        self.task: Optional["asyncio.Future[Any]"] = None
+        self.waiters = 0
+        # Streamed items so far; late joiners replay them from the start
+        self.items: List[Any] = []
+        self.changed = asyncio.Event()
+
+    def publish(self, item: Any) -> None:
+        self.items.append(item)
+        self.notify()
+
+    def notify(self) -> None:
+        # Wake everyone waiting on the current event, then start a new one
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    """Runs concurrent calls with the same key once and shares the outcome.
+
+    The first caller for a key (the leader) starts the work in a task of its
+    own; callers arriving while it runs attach to it instead of starting
+    their own. Every caller gets the same result or exception. Cancelling a
+    caller, the leader included, only detaches that caller: the work keeps
+    running for the others and is cancelled when the last caller has gone.
+    Nothing is kept once the work finishes, so this coalesces concurrent
+    calls only and never serves stale results.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        """Initialize the group.
+
+        Args:
+            name: Label used in logs
+        """
+        self.name = name
+        self._flights: Dict[Hashable, _Flight] = {}
+
+        self.leaders = 0
+        self.followers = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Keys with work currently running."""
+        return len(self._flights)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Await ``fn()``, sharing one run with concurrent callers of ``key``.
+
+        Args:
+            key: Identity of the work; callers with equal keys share one run
+            fn: Starts the work; only called by the leader
+
+        Returns:
+            The shared result
+
+        Raises:
+            Whatever the shared run raised
+        """
+        flight = self._join(key, lambda flight: fn())
+        try:
+            # The shield keeps one caller's cancellation from reaching the shared task
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(key, flight)
+
+    async def stream(
+        self, key: Hashable, fn: Callable[[], AsyncIterator[T]]
+    ) -> AsyncGenerator[T, None]:
+        """Iterate ``fn()``, sharing one run with concurrent callers of ``key``.
+
+        Each caller receives every item from the first one on, including
+        items produced before it attached.
+
+        Args:
+            key: Identity of the work; callers with equal keys share one run
+            fn: Returns the async iterator to drive; only called by the leader
+
+        Yields:
+            The shared items, in order
+
+        Raises:
+            Whatever the shared iterator raised, after the items before it
+        """
+
+        async def drive(flight: _Flight) -> None:
+            try:
+                async for item in fn():
+                    flight.publish(item)
+            finally:
+                flight.notify()
+
+        flight = self._join(key, drive)
+        try:
+            position = 0
+            while True:
+                if position < len(flight.items):
+                    item = flight.items[position]
+                    position += 1
+                    yield item
+                    continue
+                if flight.task.done():
+                    # Raises the shared error, if any
+                    flight.task.result()
+                    return
+                await flight.changed.wait()
+        finally:
+            self._leave(key, flight)
+
+    def _join(self, key: Hashable, start: Callable[[_Flight], Awaitable[Any]]) -> _Flight:
+        """Attach to the flight for ``key``, starting it if there is none."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            # Runs in a copy of the leader's context (trace ID, ...)
+            flight.task = asyncio.ensure_future(start(flight))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self._flights[key] = flight
+            self.leaders += 1
+        else:
+            self.followers += 1
+            logger.debug(f"{self.name}: joined in-flight work ({flight.waiters} caller(s) attached)")
+        flight.waiters += 1
+        return flight
+
+    def _leave(self, key: Hashable, flight: _Flight) -> None:
+        """Detach a caller; cancel the work when nobody is left to use it."""
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            logger.debug(f"{self.name}: every caller left, cancelling shared work")
+            # New callers start fresh rather than join a cancelled run
+            self._forget(key, flight)
+            flight.task.cancel()
+        elif flight.task.done() and not flight.task.cancelled():
+            # Mark the exception retrieved even if no caller reached result()
+            flight.task.exception()
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+class _Transcript:
+    """Messages the shared run added to its conversation; ends an agent flight."""
+
+    def __init__(self, conversation_id: str, messages: List[Message], user: User):
+        self.conversation_id = conversation_id
+        self.messages = messages
+        # Owner of the result files the run saved
+        self.user = user
+
+
+class CoalescingAgent(Agent):
+    """Agent whose concurrent identical opening questions share one run.
+
+    When several users open a conversation with the same question (after
+    normalize_question) while an earlier one is still being answered, they
+    attach to that run: the LLM calls and SQL happen once and everyone gets
+    the same streamed UI components. Each follower's conversation then
+    receives a copy of the turn, and the result files the run saved (in
+    the leader's per-user space) are copied into the follower's space, so
+    follow-up questions have the same context and visualize_data and the
+    download endpoint find the same files. Runs are only shared between
+    users with the same group memberships, since those decide which tools
+    are available. Follow-up turns, which depend on their own history,
+    always run alone.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        coalesce_questions: bool = True,
+        file_system: Optional[FileSystem] = None,
+        offloader: Optional[ResultOffloader] = None,
+        **kwargs: Any,
+    ):
+        """Initialize the agent.
+
+        Args:
+            *args: Passed to Agent
+            coalesce_questions: Share runs of identical opening questions
+            file_system: Where the SQL tools save result files
+                (defaults to LocalFileSystem)
+            offloader: Worker pool result files are copied on
+                (defaults to ResultOffloader())
+            **kwargs: Passed to Agent
+        """
+        super().__init__(*args, **kwargs)
+        self.coalesce_questions = coalesce_questions
+        self.file_system = file_system or LocalFileSystem()
+        self.offloader = offloader or ResultOffloader()
+        self.question_flights = SingleFlight("agent")
+
+    async def send_message(
+        self,
+        request_context: RequestContext,
+        message: str,
+        *,
+        conversation_id: Optional[str] = None,
+    ) -> AsyncGenerator[UiComponent, None]:
+        """Process a user message, sharing the run with identical concurrent ones."""
+        is_starter = not message.strip() or request_context.metadata.get("starter_ui_request", False)
+        if not self.coalesce_questions or is_starter:
+            async for component in super().send_message(
+                request_context, message, conversation_id=conversation_id
+            ):
+                yield component
+            return
+
+        user = await self.user_resolver.resolve_user(request_context)
+        conversation = None
+        if conversation_id:
+            conversation = await self.conversation_store.get_conversation(conversation_id, user)
+        if conversation is not None and conversation.messages:
+            async for component in super().send_message(
+                request_context, message, conversation_id=conversation_id
+            ):
+                yield component
+            return
+
+        leader_conversation_id = conversation_id or str(uuid.uuid4())
+
+        async def run() -> AsyncIterator[Any]:
+            async for component in super(CoalescingAgent, self).send_message(
+                request_context, message, conversation_id=leader_conversation_id
+            ):
+                yield component
+            stored = await self.conversation_store.get_conversation(leader_conversation_id, user)
+            yield _Transcript(leader_conversation_id, list(stored.messages) if stored else [], user)
+
+        key = (frozenset(user.group_memberships), normalize_question(message))
+        async for item in self.question_flights.stream(key, run):
+            if not isinstance(item, _Transcript):
+                yield item
+            elif item.conversation_id != leader_conversation_id and item.messages:
+                if item.user.id != user.id:
+                    await self._copy_results(item.messages, item.user, user)
+                await self._copy_turn(item.messages, conversation_id, user)
+
+    async def _copy_results(self, messages: List[Message], owner: User, user: User) -> None:
+        """Copy the result files a shared turn refers to into a follower's file space."""
+        filenames = sorted({name for m in messages for name in _RESULT_FILE.findall(m.content or "")})
+        if not filenames:
+            return
+
+        def context(for_user: User) -> ToolContext:
+            return ToolContext(
+                user=for_user,
+                conversation_id="shared-run",
+                request_id=str(uuid.uuid4()),
+                agent_memory=self.agent_memory,
+            )
+
+        async def copy(name: str) -> None:
+            content = await self.file_system.read_file(name, context(owner))
+            await self.file_system.write_file(name, content, context(user), overwrite=True)
+
+        for name in filenames:
+            try:
+                await self.offloader.run_coroutine(None, copy, name)
+            except Exception as e:
+                logger.warning(f"Could not copy shared result {name}: {e}")
+
+    async def _copy_turn(self, messages: List[Message], conversation_id: Optional[str], user: Any) -> None:
+        """Store a shared turn in a follower's own conversation."""
+        if not conversation_id or not self.config.auto_save_conversations:
+            return
+        conversation = await self.conversation_store.get_conversation(conversation_id, user)
+        if conversation is None:
+            conversation = Conversation(id=conversation_id, user=user, messages=[])
+        for message in messages:
+            conversation.add_message(message.model_copy(deep=True))
+        await self.conversation_store.update_conversation(conversation)
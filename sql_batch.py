@@ -0,0 +1,186 @@
+"""Tool that runs several independent read-only queries concurrently in one call."""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel, Field
+from vanna.capabilities.file_system import FileSystem
+from vanna.capabilities.sql_runner import SqlRunner, RunSqlToolArgs
+from vanna.components import (
+    ComponentType,
+    DataFrameComponent,
+    NotificationComponent,
+    SimpleTextComponent,
+    UiComponent,
+)
+from vanna.core.tool import Tool, ToolContext, ToolResult
+from vanna.integrations.local import LocalFileSystem
+
+from offload import ResultOffloader
+from query_guard import FeedbackRunSqlTool
+from result_digest import ResultDigester
+from sql_classifier import parse_statements
+
+logger = logging.getLogger(__name__)
+
+
+class BatchQuery(BaseModel):
+    """One query of a batch."""
+
+    title: str = Field(description="Short label for the result, e.g. 'Tổng số BĐS'")
+    sql: str = Field(description="A single read-only SELECT query")
+
+
+class RunSqlBatchToolArgs(BaseModel):
+    """Arguments for RunSqlBatchTool."""
+
+    queries: List[BatchQuery] = Field(
+        min_length=1,
+        description=(
+            "Independent read-only queries. They run at the same time, so no "
+            "query may depend on another's result"
+        ),
+    )
+
+
+class RunSqlBatchTool(Tool[RunSqlBatchToolArgs]):
+    """Runs independent read-only queries concurrently and returns every result.
+
+    A composite question ("Tổng quan hệ thống", an agent performance report)
+    needs several unrelated queries. Sent one run_sql at a time, each costs
+    an LLM round trip and waits for the previous query. Here they arrive in
+    one call and run together: each query goes through the same runner
+    stack as run_sql (cache, rollups, cost guard), and PostgresRunner gives
+    each one its own pooled connection. At most ``max_concurrency`` queries
+    of a batch hold a connection at once, so a large batch cannot take the
+    pool from other users.
+
+    Every query is checked before any of them runs; a write or multi-
+    statement input rejects the whole batch. A query that fails at run time
+    is reported with its error while the others still return their rows.
+    """
+
+    def __init__(
+        self,
+        sql_runner: SqlRunner,
+        file_system: Optional[FileSystem] = None,
+        max_queries: int = 8,
+        max_concurrency: int = 4,
+        offloader: Optional[ResultOffloader] = None,
+        digester: Optional[ResultDigester] = None,
+    ):
+        """Initialize the tool.
+
+        Args:
+            sql_runner: Runner stack the queries go through (as for run_sql)
+            file_system: Where result CSVs are saved (defaults to LocalFileSystem)
+            max_queries: Most queries accepted in one call
+            max_concurrency: Most queries of one call running at the same time
+            offloader: Worker pool for rendering large results
+                (defaults to ResultOffloader())
+            digester: Builds the text the LLM gets for each result
+                (defaults to ResultDigester())
+        """
+        self.sql_runner = sql_runner
+        self.file_system = file_system or LocalFileSystem()
+        self.max_queries = max_queries
+        self.max_concurrency = max_concurrency
+        self.offloader = offloader or ResultOffloader()
+        self.digester = digester or ResultDigester()
+
+    @property
+    def name(self) -> str:
+        return "run_sql_batch"
+
+    @property
+    def description(self) -> str:
+        return (
+            "Run several independent read-only SELECT queries at the same time and get "
+            f"all results in one call (up to {self.max_queries}). Use it instead of "
+            "consecutive run_sql calls when a question needs several unrelated figures, "
+            "e.g. a system overview or a report combining separate metrics."
+        )
+
+    def get_args_schema(self) -> Type[RunSqlBatchToolArgs]:
+        return RunSqlBatchToolArgs
+
+    def validate(self, queries: List[BatchQuery]) -> Optional[str]:
+        """Return why the batch cannot run, or None if every query may run."""
+        if len(queries) > self.max_queries:
+            return f"Too many queries ({len(queries)}); send at most {self.max_queries} per call."
+        for i, query in enumerate(queries, 1):
+            statements = parse_statements(query.sql)
+            if len(statements) != 1 or not statements[0].read_only or not statements[0].returns_rows:
+                return (
+                    f"Query {i} ({query.title}) is not a single read-only SELECT. "
+                    "run_sql_batch only runs reads; use run_sql for anything else."
+                )
+        return None
+
+    async def execute(self, context: ToolContext, args: RunSqlBatchToolArgs) -> ToolResult:
+        problem = self.validate(args.queries)
+        if problem:
+            return ToolResult(
+                success=False,
+                result_for_llm=problem,
+                ui_component=UiComponent(
+                    rich_component=NotificationComponent(
+                        type=ComponentType.NOTIFICATION, level="error", message=problem
+                    ),
+                    simple_component=SimpleTextComponent(text=problem),
+                ),
+                error=problem,
+                metadata={"error_type": "invalid_batch"},
+            )
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tool = FeedbackRunSqlTool(
+            self.sql_runner, self.file_system, offloader=self.offloader, digester=self.digester
+        )
+
+        async def run(query: BatchQuery) -> ToolResult:
+            # Own metadata per query, so cost guard notices are not mixed up
+            query_context = context.model_copy(update={"metadata": dict(context.metadata)})
+            async with semaphore:
+                return await tool.execute(query_context, RunSqlToolArgs(sql=query.sql))
+
+        results = await asyncio.gather(*(run(query) for query in args.queries))
+
+        sections = []
+        summary: List[Dict[str, Any]] = []
+        for i, (query, result) in enumerate(zip(args.queries, results), 1):
+            sections.append(f"## Query {i}: {query.title}\n{result.result_for_llm}")
+            metadata = result.metadata or {}
+            summary.append({
+                "query": i,
+                "title": query.title,
+                "status": "ok" if result.success else "error",
+                "rows": metadata.get("row_count", 0),
+                "columns": len(metadata.get("columns", [])),
+                "file": metadata.get("output_file", ""),
+                "error": result.error or "",
+            })
+
+        failed = [row for row in summary if row["status"] == "error"]
+        if failed:
+            logger.info(f"{len(failed)} of {len(results)} batch queries failed")
+        text = f"{len(results) - len(failed)} of {len(results)} queries succeeded."
+
+        return ToolResult(
+            success=not failed,
+            result_for_llm="\n\n".join(sections),
+            ui_component=UiComponent(
+                rich_component=DataFrameComponent.from_records(
+                    records=summary,
+                    title="Batch Query Results",
+                    description=text,
+                ),
+                simple_component=SimpleTextComponent(text=text),
+            ),
+            error="; ".join(f"Query {row['query']}: {row['error']}" for row in failed) or None,
+            metadata={
+                "query_type": "BATCH",
+                "queries": summary,
+                "results": [(result.metadata or {}).get("results", []) for result in results],
+            },
+        )
@@ -0,0 +1,347 @@
+"""In-process SQL result cache with table-level invalidation."""
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+from vanna.capabilities.sql_runner import SqlRunner, RunSqlToolArgs
+from vanna.core.tool import ToolContext
+
+from query_guard import FEEDBACK_KEY
+from sql_classifier import Token, is_read_query, sql_fingerprint, tokenize
+
+logger = logging.getLogger(__name__)
+
+
+# Keywords followed by a table name (or a FROM list)
+_TABLE_KEYWORDS = {"FROM", "JOIN", "INTO", "UPDATE", "TABLE", "TRUNCATE"}
+# Functions whose FROM is part of the call, e.g. extract(year FROM created_at)
+_FROM_FUNCTIONS = {"EXTRACT", "SUBSTRING", "TRIM", "OVERLAY", "POSITION"}
+# Words that end a FROM item's alias
+_CLAUSE_WORDS = {
+    "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "OFFSET", "FETCH", "WINDOW", "UNION",
+    "INTERSECT", "EXCEPT", "ON", "USING", "JOIN", "INNER", "LEFT", "RIGHT", "FULL",
+    "CROSS", "NATURAL", "LATERAL", "SET", "VALUES", "SELECT", "RETURNING", "FOR",
+    "TABLESAMPLE", "DEFAULT", "OVERRIDING", "WITH",
+}
+# Functions and keywords whose value changes between identical queries
+_VOLATILE = {
+    "NOW", "RANDOM", "CLOCK_TIMESTAMP", "STATEMENT_TIMESTAMP", "TRANSACTION_TIMESTAMP",
+    "TIMEOFDAY", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "LOCALTIME",
+    "LOCALTIMESTAMP", "GEN_RANDOM_UUID", "UUID_GENERATE_V4", "NEXTVAL", "CURRVAL",
+    "SETVAL", "LASTVAL", "TXID_CURRENT", "PG_CURRENT_XACT_ID",
+}
+
+
+def _name(token: Token) -> str:
+    """Identifier as Postgres resolves it, quoted only when it has to be."""
+    if token.kind == "word":
+        return token.text.lower()
+    inner = token.text[1:-1].replace('""', '"')
+    if inner and inner == inner.lower() and (inner[0].isalpha() or inner[0] == "_") and all(
+        ch.isalnum() or ch in "_$" for ch in inner
+    ):
+        return inner
+    return token.text
+
+
+def _qualified_name(tokens: List[Token], i: int) -> Tuple[Optional[str], int]:
+    """Read ``name[.name...]`` at ``tokens[i]``; return (name or None, index after it)."""
+    parts = []
+    while i < len(tokens) and tokens[i].kind in ("word", "ident"):
+        parts.append(_name(tokens[i]))
+        if i + 2 < len(tokens) and tokens[i + 1].text == "." and tokens[i + 1].kind == "punct":
+            i += 2
+        else:
+            i += 1
+            break
+    return (".".join(parts) if parts else None), i
+
+
+def _skip_parens(tokens: List[Token], i: int) -> int:
+    """Return the index just past the parenthesized group opening at ``tokens[i]``."""
+    depth = tokens[i].depth
+    i += 1
+    while i < len(tokens) and not (tokens[i].text == ")" and tokens[i].depth == depth):
+        i += 1
+    return i + 1
+
+
+def _cte_names(tokens: List[Token]) -> Set[str]:
+    """Names defined by WITH lists: ``name [(cols)] AS [[NOT] MATERIALIZED] (``."""
+    names = set()
+    for i, token in enumerate(tokens):
+        if token.kind not in ("word", "ident") or i == 0:
+            continue
+        before = tokens[i - 1]
+        if before.upper not in ("WITH", "RECURSIVE") and before.text != ",":
+            continue
+        j = i + 1
+        if j < len(tokens) and tokens[j].text == "(":
+            j = _skip_parens(tokens, j)
+        if j >= len(tokens) or tokens[j].upper != "AS":
+            continue
+        j += 1
+        while j < len(tokens) and tokens[j].upper in ("NOT", "MATERIALIZED"):
+            j += 1
+        if j < len(tokens) and tokens[j].text == "(":
+            names.add(_name(token))
+    return names
+
+
+def _is_call_from(tokens: List[Token], i: int) -> bool:
+    """Whether the FROM at ``tokens[i]`` belongs to a call like extract(... FROM ...)."""
+    if i > 0 and tokens[i - 1].upper == "DISTINCT":
+        # IS [NOT] DISTINCT FROM
+        return True
+    depth = tokens[i].depth
+    for j in range(i - 1, 0, -1):
+        if tokens[j].depth < depth:
+            return tokens[j].text == "(" and tokens[j - 1].upper in _FROM_FUNCTIONS
+    return False
+
+
+def referenced_tables(sql: str) -> Set[str]:
+    """Return the base tables a statement reads or writes, excluding CTE names.
+
+    Covers FROM lists (comma joins included), JOIN, INSERT INTO, UPDATE,
+    DELETE FROM, TABLE and TRUNCATE. Names inside strings and comments, function
+    calls in FROM (generate_series(...)) and the FROM of extract(),
+    substring() and friends are not tables.
+    """
+    tokens = list(tokenize(sql))
+    tables: Set[str] = set()
+    for i, token in enumerate(tokens):
+        keyword = token.upper
+        if keyword not in _TABLE_KEYWORDS:
+            continue
+        if keyword == "FROM" and _is_call_from(tokens, i):
+            continue
+        if keyword == "UPDATE" and (
+            (i > 0 and tokens[i - 1].upper in ("FOR", "DO", "KEY"))
+            or (i + 1 < len(tokens) and tokens[i + 1].upper == "SET")
+        ):
+            # FOR UPDATE, ON CONFLICT DO UPDATE SET
+            continue
+
+        depth = token.depth
+        j = i + 1
+        while j < len(tokens):
+            while j < len(tokens) and tokens[j].upper in ("ONLY", "LATERAL", "TABLE"):
+                j += 1
+            if j < len(tokens) and tokens[j].text == "(":
+                # Subquery or VALUES list; its own FROMs are visited by the outer loop
+                j = _skip_parens(tokens, j)
+            else:
+                name, j = _qualified_name(tokens, j)
+                if name is None:
+                    break
+                if j < len(tokens) and tokens[j].text == "(" and keyword != "INTO":
+                    # Function in FROM; INSERT INTO t (cols) is still a table
+                    j = _skip_parens(tokens, j)
+                else:
+                    tables.add(name)
+            if keyword not in ("FROM", "TRUNCATE"):
+                break
+            # Skip the alias and its column list up to the next comma of the list
+            while j < len(tokens) and tokens[j].depth >= depth and not (
+                tokens[j].depth == depth
+                and (tokens[j].text in (",", ")", ";") or tokens[j].upper in _CLAUSE_WORDS)
+            ):
+                j += 1
+            if j < len(tokens) and tokens[j].text == "," and tokens[j].depth == depth:
+                j += 1
+                continue
+            break
+    return tables - _cte_names(tokens)
+
+
+def is_volatile(sql: str) -> bool:
+    """Whether the statement calls a function whose value changes between runs (now(), ...)."""
+    return any(token.upper in _VOLATILE for token in tokenize(sql))
+
+
+class CachedSqlRunner(SqlRunner):
+    """SqlRunner decorator that caches SELECT results in process memory.
+
+    Entries are keyed on the normalized SQL fingerprint and expire after
+    ``ttl`` seconds, or earlier when ``max(updated_at)`` of any referenced
+    table moves. The cache is an LRU bounded by the in-memory size of the
+    cached DataFrames. Deleted rows do not move the watermark and are only
+    picked up once the entry expires. Queries that read no table or call a
+    volatile function (now(), CURRENT_DATE, random(), ...) are not cached,
+    since no watermark says when their result changes.
+    """
+
+    def __init__(
+        self,
+        runner: SqlRunner,
+        ttl: float = 300.0,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_entry_bytes: Optional[int] = None,
+        watermark_ttl: float = 5.0,
+        watermark_column: str = "updated_at",
+        watermark_runner: Optional[SqlRunner] = None,
+    ):
+        """Initialize the cache.
+
+        Args:
+            runner: Underlying runner that executes queries
+            ttl: Maximum age of a cached result in seconds
+            max_bytes: Total size budget for cached DataFrames
+            max_entry_bytes: Largest single result worth caching
+                (defaults to a quarter of max_bytes)
+            watermark_ttl: How long a table watermark is reused before
+                it is read again
+            watermark_column: Timestamp column bumped on every write
+            watermark_runner: Runner the watermark probes go to, normally the
+                base PostgresRunner so they skip rollups and the cost guard
+                (defaults to runner)
+        """
+        self.runner = runner
+        self.watermark_runner = watermark_runner or runner
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self.watermark_ttl = watermark_ttl
+        self.watermark_column = watermark_column
+
+        # fingerprint -> (df, watermarks, stored_at, nbytes)
+        self._entries: "OrderedDict[str, Tuple[pd.DataFrame, Dict[str, object], float, int]]" = OrderedDict()
+        # table -> (watermark, read_at)
+        self._watermarks: Dict[str, Tuple[object, float]] = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncacheable = 0
+
+    async def run_sql(self, args: RunSqlToolArgs, context: ToolContext) -> pd.DataFrame:
+        """Serve SELECT results from the cache, executing on a miss.
+
+        Args:
+            args: Tool arguments containing the SQL query
+            context: Tool execution context
+
+        Returns:
+            pandas DataFrame with query results
+        """
+        tables = referenced_tables(args.sql)
+
+        if not is_read_query(args.sql):
+            # Writes go straight through and drop what they may have touched
+            df = await self.runner.run_sql(args, context)
+            self.invalidate_tables(tables)
+            return df
+
+        if not tables or is_volatile(args.sql):
+            self.uncacheable += 1
+            return await self.runner.run_sql(args, context)
+
+        key = sql_fingerprint(args.sql)
+        watermarks = await self._current_watermarks(tables, context)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            df, cached_watermarks, stored_at, _ = entry
+            fresh = time.monotonic() - stored_at <= self.ttl
+            if fresh and watermarks is not None and cached_watermarks == watermarks:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if df.attrs.get(FEEDBACK_KEY):
+                    # Re-announce notices (e.g. an injected LIMIT) the original run made
+                    context.metadata.setdefault(FEEDBACK_KEY, []).extend(df.attrs[FEEDBACK_KEY])
+                return df.copy(deep=False)
+            self._drop(key)
+
+        self.misses += 1
+        df = await self.runner.run_sql(args, context)
+
+        if watermarks is not None:
+            self._store(key, df, watermarks)
+        return df.copy(deep=False)
+
+    @property
+    def nbytes(self) -> int:
+        """In-memory size of the cached DataFrames."""
+        return self._bytes
+
+    def invalidate_tables(self, tables: Set[str]) -> None:
+        """Drop cached results and watermarks that depend on the given tables."""
+        for table in tables:
+            self._watermarks.pop(table, None)
+        stale = [
+            key
+            for key, (_, watermarks, _, _) in self._entries.items()
+            if tables.intersection(watermarks)
+        ]
+        for key in stale:
+            self._drop(key)
+
+    def clear(self) -> None:
+        """Drop every cached result and watermark."""
+        self._entries.clear()
+        self._watermarks.clear()
+        self._bytes = 0
+
+    async def _current_watermarks(
+        self, tables: Set[str], context: ToolContext
+    ) -> Optional[Dict[str, object]]:
+        """Return max(updated_at) per table, or None if it cannot be read."""
+        now = time.monotonic()
+        watermarks: Dict[str, object] = {}
+        stale = []
+        for table in sorted(tables):
+            cached = self._watermarks.get(table)
+            if cached is not None and now - cached[1] <= self.watermark_ttl:
+                watermarks[table] = cached[0]
+            else:
+                stale.append(table)
+
+        if not stale:
+            return watermarks
+
+        # One round trip for every table whose watermark has aged out
+        selects = ", ".join(
+            f"(SELECT max({self.watermark_column}) FROM {table}) AS w{i}"
+            for i, table in enumerate(stale)
+        )
+        try:
+            df = await self.watermark_runner.run_sql(RunSqlToolArgs(sql=f"SELECT {selects}"), context)
+        except Exception as e:
+            # Views, CTE-like names or tables without the column: don't cache
+            logger.debug(f"Watermark lookup failed for {stale}: {e}")
+            return None
+
+        for i, table in enumerate(stale):
+            value = df.iloc[0, i] if not df.empty else None
+            if pd.isna(value):
+                # Empty table: NaT would never compare equal to itself
+                value = None
+            self._watermarks[table] = (value, now)
+            watermarks[table] = value
+        return watermarks
+
+    def _store(self, key: str, df: pd.DataFrame, watermarks: Dict[str, object]) -> None:
+        """Insert a result and evict least recently used entries over budget."""
+        # Concurrent misses on the same query each store; replace, don't double count
+        self._drop(key)
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_entry_bytes:
+            return
+
+        self._entries[key] = (df, watermarks, time.monotonic(), nbytes)
+        self._bytes += nbytes
+
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        """Remove one entry and release its bytes."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[3]
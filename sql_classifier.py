@@ -0,0 +1,258 @@
+"""Lightweight SQL tokenizer and statement classifier for PostgreSQL."""
+import hashlib
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+
+# Leading keywords of statements that can only read
+_READ_KEYWORDS = {"SELECT", "VALUES", "TABLE", "SHOW"}
+# Leading keywords of statements that change data
+_DML_KEYWORDS = {"INSERT", "UPDATE", "DELETE", "MERGE"}
+# Keywords a statement can start with after EXPLAIN or a CTE list
+_MAIN_KEYWORDS = _READ_KEYWORDS | _DML_KEYWORDS | {"WITH"}
+# Second word of a row-locking clause (FOR UPDATE, FOR NO KEY UPDATE, ...)
+_LOCK_STRENGTHS = {"UPDATE", "SHARE", "NO", "KEY"}
+
+@dataclass
+class Token:
+    """One significant token; whitespace and comments are dropped.
+
+    ``kind`` is "word", "string", "ident" (quoted identifier), "number",
+    "param" ($1) or "punct". ``depth`` is the parenthesis nesting level the
+    token sits at (the parentheses themselves count as the outer level).
+    """
+
+    kind: str
+    text: str
+    start: int
+    end: int
+    depth: int
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper() if self.kind == "word" else ""
+
+
+@dataclass
+class Statement:
+    """One statement of a SQL string.
+
+    Attributes:
+        text: Statement text without the trailing semicolon
+        keyword: Leading keyword, upper-cased (after any opening parentheses)
+        read_only: Runs safely in a READ ONLY transaction
+        returns_rows: Produces a result set (SELECT, WITH ... SELECT,
+            VALUES, TABLE, SHOW, EXPLAIN, DML with RETURNING)
+        tokens: Significant tokens of the statement
+    """
+
+    text: str
+    keyword: str
+    read_only: bool
+    returns_rows: bool
+    tokens: List[Token]
+
+
+def _skip_quoted(sql: str, i: int, quote: str, backslash: bool = False) -> int:
+    """Return the index just past a quoted run starting at ``sql[i] == quote``."""
+    i += 1
+    while i < len(sql):
+        ch = sql[i]
+        if backslash and ch == "\\":
+            i += 2
+        elif ch == quote:
+            if sql[i + 1:i + 2] == quote:
+                i += 2
+            else:
+                return i + 1
+        else:
+            i += 1
+    return i
+
+
+def tokenize(sql: str) -> Iterator[Token]:
+    """Yield the significant tokens of a SQL string.
+
+    Handles -- and nested /* */ comments, '' and E'' strings, "quoted"
+    identifiers and $tag$ dollar quoting, so keywords inside any of them
+    are never mistaken for SQL.
+    """
+    depth = 0
+    i = 0
+    n = len(sql)
+    while i < n:
+        ch = sql[i]
+        start = i
+
+        if ch.isspace():
+            i += 1
+        elif sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end == -1 else end + 1
+        elif sql.startswith("/*", i):
+            nesting = 0
+            while i < n:
+                if sql.startswith("/*", i):
+                    nesting += 1
+                    i += 2
+                elif sql.startswith("*/", i):
+                    nesting -= 1
+                    i += 2
+                    if nesting == 0:
+                        break
+                else:
+                    i += 1
+        elif ch == "'":
+            i = _skip_quoted(sql, i, "'")
+            yield Token("string", sql[start:i], start, i, depth)
+        elif ch == '"':
+            i = _skip_quoted(sql, i, '"')
+            yield Token("ident", sql[start:i], start, i, depth)
+        elif ch in "eE" and sql[i + 1:i + 2] == "'":
+            i = _skip_quoted(sql, i + 1, "'", backslash=True)
+            yield Token("string", sql[start:i], start, i, depth)
+        elif ch == "$":
+            j = i + 1
+            while j < n and (sql[j].isalnum() or sql[j] == "_"):
+                j += 1
+            if sql[i + 1:j].isdigit():
+                i = j
+                yield Token("param", sql[start:i], start, i, depth)
+            elif j < n and sql[j] == "$":
+                tag = sql[i:j + 1]
+                end = sql.find(tag, j + 1)
+                i = n if end == -1 else end + len(tag)
+                yield Token("string", sql[start:i], start, i, depth)
+            else:
+                i += 1
+                yield Token("punct", ch, start, i, depth)
+        elif ch.isalpha() or ch == "_":
+            while i < n and (sql[i].isalnum() or sql[i] in "_$"):
+                i += 1
+            yield Token("word", sql[start:i], start, i, depth)
+        elif ch.isdigit() or (ch == "." and sql[i + 1:i + 2].isdigit()):
+            while i < n and (sql[i].isalnum() or sql[i] == "."):
+                i += 1
+            yield Token("number", sql[start:i], start, i, depth)
+        else:
+            i += 1
+            if ch == ")":
+                depth = max(depth - 1, 0)
+            yield Token("punct", ch, start, i, depth)
+            if ch == "(":
+                depth += 1
+
+
+def _has_lock_clause(tokens: List[Token]) -> bool:
+    """FOR UPDATE / FOR SHARE / FOR [NO] KEY ... anywhere in the statement."""
+    return any(
+        t.upper == "FOR" and nxt.upper in _LOCK_STRENGTHS
+        for t, nxt in zip(tokens, tokens[1:])
+    )
+
+
+def _classify(tokens: List[Token]) -> Tuple[str, bool, bool]:
+    """Return (keyword, read_only, returns_rows) for one statement's tokens."""
+    words = [t for t in tokens if t.kind == "word"]
+    if not words:
+        return "", False, False
+    keyword = words[0].upper
+    top = {t.upper for t in tokens if t.kind == "word" and t.depth == words[0].depth}
+
+    if keyword == "EXPLAIN":
+        inner_at = next(
+            (i for i, t in enumerate(tokens) if t.depth == 0 and t.upper in _MAIN_KEYWORDS),
+            None,
+        )
+        if inner_at is None:
+            return keyword, False, False
+        _, inner_read_only, _ = _classify(tokens[inner_at:])
+        # Only EXPLAIN ANALYZE actually runs the statement
+        analyze = any(t.upper in ("ANALYZE", "ANALYSE") for t in tokens[:inner_at])
+        return keyword, inner_read_only or not analyze, True
+
+    if keyword in _READ_KEYWORDS:
+        if "INTO" in top:
+            # SELECT ... INTO new_table creates a table
+            return keyword, False, False
+        return keyword, not _has_lock_clause(tokens), True
+
+    if keyword in _DML_KEYWORDS:
+        return keyword, False, "RETURNING" in top
+
+    if keyword == "WITH":
+        main = next(
+            (t.upper for t in words[1:] if t.depth == words[0].depth and t.upper in _MAIN_KEYWORDS - {"WITH"}),
+            "",
+        )
+        modifies = any(t.upper in _DML_KEYWORDS for t in words) or _has_lock_clause(tokens)
+        if main in _DML_KEYWORDS:
+            return keyword, False, "RETURNING" in top
+        if "INTO" in top:
+            return keyword, False, False
+        return keyword, not modifies, bool(main)
+
+    # DDL, SET, COPY, CALL, DO, transaction control, ...
+    return keyword, False, False
+
+
+def parse_statements(sql: str) -> List[Statement]:
+    """Split a SQL string into classified statements.
+
+    Empty statements (stray semicolons, comment-only input) are dropped.
+
+    Args:
+        sql: One or more SQL statements
+
+    Returns:
+        Statements in source order
+    """
+    statements: List[Statement] = []
+    current: List[Token] = []
+
+    def flush() -> None:
+        if current:
+            keyword, read_only, returns_rows = _classify(current)
+            text = sql[current[0].start:current[-1].end]
+            statements.append(Statement(text, keyword, read_only, returns_rows, list(current)))
+            current.clear()
+
+    for token in tokenize(sql):
+        if token.kind == "punct" and token.text == ";" and token.depth == 0:
+            flush()
+        else:
+            current.append(token)
+    flush()
+    return statements
+
+
+def is_read_query(sql: str) -> bool:
+    """True for a single read-only statement that returns rows.
+
+    These are the queries that can be cached, streamed and sent to a
+    replica.
+    """
+    statements = parse_statements(sql)
+    return len(statements) == 1 and statements[0].read_only and statements[0].returns_rows
+
+
+def _key_tokens(sql: str) -> List[str]:
+    """Tokens that decide what a statement does, in a canonical spelling.
+
+    Words (keywords and unquoted identifiers, which Postgres folds to lower
+    case anyway) are lowercased. Strings, dollar-quoted bodies, quoted
+    identifiers, parameters and numbers are kept verbatim, so queries that
+    differ only inside a literal never share a key. Comments, whitespace
+    and a trailing semicolon are dropped.
+    """
+    texts = [t.text.lower() if t.kind == "word" else t.text for t in tokenize(sql)]
+    while texts and texts[-1] == ";":
+        texts.pop()
+    return texts
+
+
+def sql_fingerprint(sql: str) -> str:
+    """Return a stable hash of the normalized SQL's tokens."""
+    # Tokens are joined with NUL, which cannot occur in SQL text, so token
+    # boundaries are part of the key
+    return hashlib.sha1("\0".join(_key_tokens(sql)).encode("utf-8")).hexdigest()
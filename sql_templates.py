@@ -0,0 +1,465 @@
+"""Parameterized query templates for the most frequent questions, with a tool to run them."""
+import datetime
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Type
+
+from pydantic import BaseModel, Field
+from vanna.capabilities.file_system import FileSystem
+from vanna.core.tool import Tool, ToolContext, ToolResult
+from vanna.integrations.local import LocalFileSystem
+
+from postgres_runner import PostgresRunner
+from query_guard import FetchedSqlRunner, render_sql_result
+from result_digest import ResultDigester
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateError(Exception):
+    """Raised for an unknown template or a value that does not fit its slot.
+
+    The message is written for the agent, which can retry with fixed values.
+    """
+
+
+@dataclass
+class TemplateParam:
+    """One $n slot of a template.
+
+    Attributes:
+        name: Argument name the agent passes
+        kind: "text", "int", "month" (YYYY-MM, bound as the first day) or
+            "date" (YYYY-MM-DD)
+        description: What the value means, shown to the agent
+        choices: Allowed values for enum-like text or int slots
+        default: Value used when the agent leaves the slot out
+            (None = required)
+        minimum: Smallest value of an int slot; smaller values are raised to it
+        maximum: Largest value of an int slot; larger values are lowered to it
+    """
+
+    name: str
+    kind: str
+    description: str
+    choices: Optional[List[Any]] = None
+    default: Any = None
+    minimum: Optional[int] = None
+    maximum: Optional[int] = None
+
+
+@dataclass
+class SqlTemplate:
+    """A canonical query whose literals are $1..$n placeholders.
+
+    Attributes:
+        name: Name the agent selects the template by
+        description: Question the template answers
+        sql: Read-only query; placeholder $i binds ``params[i - 1]``
+        params: Slots, in placeholder order
+    """
+
+    name: str
+    description: str
+    sql: str
+    params: List[TemplateParam] = field(default_factory=list)
+
+    def bind(self, values: Dict[str, Any]) -> List[Any]:
+        """Validate the agent's values and return them in placeholder order.
+
+        Args:
+            values: Slot name -> value as given by the agent
+
+        Returns:
+            Values converted to the Python types asyncpg binds
+
+        Raises:
+            TemplateError: If a slot is unknown, missing or malformed
+        """
+        unknown = set(values) - {p.name for p in self.params}
+        if unknown:
+            raise TemplateError(
+                f"Template {self.name} has no parameter(s) {', '.join(sorted(unknown))}; "
+                f"expected: {', '.join(p.name for p in self.params)}."
+            )
+
+        bound = []
+        for param in self.params:
+            value = values.get(param.name, param.default)
+            if value is None:
+                raise TemplateError(f"Template {self.name} needs {param.name}: {param.description}.")
+            bound.append(_convert(self.name, param, value))
+        return bound
+
+    def signature(self) -> str:
+        """One-line summary for the tool description."""
+        params = ", ".join(
+            f"{p.name}" + (f"={p.default}" if p.default is not None else "")
+            for p in self.params
+        )
+        return f"{self.name}({params}): {self.description}"
+
+
+def _convert(template: str, param: TemplateParam, value: Any) -> Any:
+    """Convert one agent-supplied value to the type of its slot."""
+    formats = {"int": "an integer", "month": "YYYY-MM", "date": "YYYY-MM-DD"}
+    expected = formats.get(param.kind, "text")
+    # Lists, floats and booleans would be stringified or truncated into a wrong value
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise TemplateError(f"Template {template}: {param.name} must be {expected}, got {value!r}.")
+    try:
+        if param.kind == "int":
+            converted: Any = int(value)
+            # Templates skip the cost guard, so LIMIT slots must stay bounded
+            if param.minimum is not None:
+                converted = max(converted, param.minimum)
+            if param.maximum is not None:
+                converted = min(converted, param.maximum)
+        elif param.kind == "month":
+            text = str(value).strip()
+            converted = datetime.date.fromisoformat(text[:7] + "-01")
+        elif param.kind == "date":
+            converted = datetime.date.fromisoformat(str(value).strip()[:10])
+        else:
+            converted = str(value).strip()
+            if param.choices:
+                converted = converted.upper()
+    except ValueError:
+        raise TemplateError(
+            f"Template {template}: {param.name} must be {expected}, got {value!r}."
+        ) from None
+
+    if param.choices and converted not in param.choices:
+        raise TemplateError(
+            f"Template {template}: {param.name} must be one of "
+            f"{', '.join(str(c) for c in param.choices)}, got {value!r}."
+        )
+    return converted
+
+
+_TRANSACTION_TYPES = ["SALE", "RENTAL", "INVESTMENT"]
+_PROPERTY_STATUSES = [
+    "PENDING", "REJECTED", "APPROVED", "SOLD", "RENTED",
+    "AVAILABLE", "UNAVAILABLE", "REMOVED", "DELETED",
+]
+_CONTRACT_STATUSES = ["DRAFT", "PENDING_SIGNING", "ACTIVE", "COMPLETED", "CANCELLED"]
+_PAYMENT_TYPES = [
+    "DEPOSIT", "ADVANCE", "INSTALLMENT", "FULL_PAY", "MONTHLY", "PENALTY",
+    "REFUND", "MONEY_SALE", "MONEY_RENTAL", "SALARY", "SERVICE_FEE",
+]
+_MONTH = TemplateParam("month", "month", "Tháng cần xem, dạng YYYY-MM")
+_CITY = TemplateParam("city", "text", "Tên (hoặc một phần tên) thành phố, ví dụ 'Hồ Chí Minh'")
+# Largest LIMIT a template returns
+MAX_TEMPLATE_ROWS = 1000
+_LIMIT = TemplateParam("limit", "int", "Số dòng tối đa", default=10, minimum=1, maximum=MAX_TEMPLATE_ROWS)
+
+
+# Location joins are shared by every property template
+_PROPERTY_LOCATION_JOINS = """JOIN property_types pt ON p.property_type_id = pt.property_type_id
+JOIN wards w ON p.ward_id = w.ward_id
+JOIN districts d ON w.district_id = d.district_id
+JOIN cities c ON d.city_id = c.city_id"""
+
+
+DEFAULT_TEMPLATES = [
+    # Top 10 BĐS giá cao nhất đang bán / BĐS cho thuê ... (theo loại giao dịch, trạng thái)
+    SqlTemplate(
+        name="top_properties_by_price",
+        description="BĐS giá cao nhất theo loại giao dịch và trạng thái",
+        sql=f"""SELECT p.title, p.price_amount, p.area, pt.type_name, c.city_name, d.district_name
+FROM properties p
+{_PROPERTY_LOCATION_JOINS}
+WHERE p.status = $1 AND p.transaction_type = $2
+ORDER BY p.price_amount DESC
+LIMIT $3::int""",
+        params=[
+            TemplateParam("status", "text", "Trạng thái BĐS", choices=_PROPERTY_STATUSES, default="AVAILABLE"),
+            TemplateParam("transaction_type", "text", "Loại giao dịch", choices=_TRANSACTION_TYPES, default="SALE"),
+            _LIMIT,
+        ],
+    ),
+    SqlTemplate(
+        name="cheapest_properties",
+        description="BĐS giá thấp nhất theo loại giao dịch và trạng thái",
+        sql=f"""SELECT p.title, p.price_amount, p.area, pt.type_name, c.city_name, d.district_name
+FROM properties p
+{_PROPERTY_LOCATION_JOINS}
+WHERE p.status = $1 AND p.transaction_type = $2
+ORDER BY p.price_amount ASC
+LIMIT $3::int""",
+        params=[
+            TemplateParam("status", "text", "Trạng thái BĐS", choices=_PROPERTY_STATUSES, default="AVAILABLE"),
+            TemplateParam("transaction_type", "text", "Loại giao dịch", choices=_TRANSACTION_TYPES, default="RENTAL"),
+            _LIMIT,
+        ],
+    ),
+    SqlTemplate(
+        name="properties_in_city",
+        description="Danh sách BĐS của một thành phố theo trạng thái, giá cao trước",
+        sql=f"""SELECT p.title, p.price_amount, p.area, p.transaction_type, pt.type_name, d.district_name, c.city_name
+FROM properties p
+{_PROPERTY_LOCATION_JOINS}
+WHERE c.city_name ILIKE '%' || $1 || '%' AND p.status = $2
+ORDER BY p.price_amount DESC
+LIMIT $3::int""",
+        params=[
+            _CITY,
+            TemplateParam("status", "text", "Trạng thái BĐS", choices=_PROPERTY_STATUSES, default="AVAILABLE"),
+            _LIMIT,
+        ],
+    ),
+    # BĐS theo quận huyện, thu hẹp về một thành phố
+    SqlTemplate(
+        name="properties_by_district_in_city",
+        description="Số BĐS và giá trung bình theo quận/huyện của một thành phố",
+        sql="""SELECT d.district_name, c.city_name, COUNT(p.property_id) AS so_bds, AVG(p.price_amount) AS gia_trung_binh
+FROM properties p
+JOIN wards w ON p.ward_id = w.ward_id
+JOIN districts d ON w.district_id = d.district_id
+JOIN cities c ON d.city_id = c.city_id
+WHERE c.city_name ILIKE '%' || $1 || '%'
+GROUP BY d.district_id, d.district_name, c.city_name
+ORDER BY so_bds DESC""",
+        params=[_CITY],
+    ),
+    # BĐS mới đăng trong tháng
+    SqlTemplate(
+        name="properties_created_in_month",
+        description="BĐS mới đăng trong một tháng",
+        sql="""SELECT title, price_amount, transaction_type, status, created_at
+FROM properties
+WHERE created_at >= $1::date AND created_at < $1::date + INTERVAL '1 month'
+ORDER BY created_at DESC
+LIMIT $2::int""",
+        params=[_MONTH, _LIMIT],
+    ),
+    # Người dùng đăng ký mới trong tháng
+    SqlTemplate(
+        name="users_registered_in_month",
+        description="Số người dùng đăng ký mới trong một tháng, theo vai trò",
+        sql="""SELECT role, COUNT(*) AS so_luong
+FROM users
+WHERE created_at >= $1::date AND created_at < $1::date + INTERVAL '1 month'
+GROUP BY role""",
+        params=[_MONTH],
+    ),
+    # Doanh thu tháng này / tháng bất kỳ
+    SqlTemplate(
+        name="revenue_in_month",
+        description="Doanh thu (payments thành công) của một tháng",
+        sql="""SELECT SUM(amount) AS doanh_thu, COUNT(*) AS so_giao_dich
+FROM payments
+WHERE status = 1 AND paid_date >= $1::date AND paid_date < $1::date + INTERVAL '1 month'""",
+        params=[_MONTH],
+    ),
+    # Tổng tiền đặt cọc / tạm ứng / trả góp / tiền thuê / phạt / hoàn trả ... đã nhận
+    SqlTemplate(
+        name="payment_total",
+        description=(
+            "Tổng tiền và số giao dịch của một loại thanh toán theo trạng thái "
+            "(0=PENDING, 1=SUCCESS, 2=FAILED, 3-5=SYSTEM_*)"
+        ),
+        sql="""SELECT SUM(amount) AS tong_tien, COUNT(*) AS so_giao_dich
+FROM payments
+WHERE payment_type = $1 AND status = $2::smallint""",
+        params=[
+            TemplateParam("payment_type", "text", "Loại thanh toán", choices=_PAYMENT_TYPES),
+            TemplateParam("status", "int", "Trạng thái payment", choices=[0, 1, 2, 3, 4, 5], default=1),
+        ],
+    ),
+    # Đặt cọc chờ thanh toán / Tiền thuê chưa thanh toán ...
+    SqlTemplate(
+        name="pending_payments",
+        description="Các khoản của một loại thanh toán còn chờ thanh toán, hạn gần nhất trước",
+        sql="""SELECT c.contract_number, prop.title AS bds, p.amount, p.due_date,
+       GREATEST(CURRENT_DATE - p.due_date, 0) AS so_ngay_qua_han
+FROM payments p
+JOIN contract c ON p.contract_id = c.contract_id
+JOIN properties prop ON c.property_id = prop.property_id
+WHERE p.payment_type = $1 AND p.status = 0
+ORDER BY p.due_date
+LIMIT $2::int""",
+        params=[
+            TemplateParam("payment_type", "text", "Loại thanh toán", choices=_PAYMENT_TYPES),
+            TemplateParam(
+                "limit", "int", "Số dòng tối đa", default=50, minimum=1, maximum=MAX_TEMPLATE_ROWS
+            ),
+        ],
+    ),
+    # Hiệu suất nhân viên tháng này, cho một nhân viên và tháng bất kỳ
+    SqlTemplate(
+        name="agent_performance_in_month",
+        description="Lịch hẹn, hợp đồng và giá trị hợp đồng của một nhân viên (mã nhân viên) trong một tháng",
+        # Subqueries instead of two LEFT JOINs, so appointments don't multiply contract_value
+        sql="""SELECT CONCAT(u.last_name, ' ', u.first_name) AS agent_name,
+       sa.employee_code,
+       (SELECT COUNT(*) FROM appointment a
+        WHERE a.agent_id = sa.sale_agent_id
+          AND a.created_at >= $2::date AND a.created_at < $2::date + INTERVAL '1 month') AS appointments_count,
+       (SELECT COUNT(*) FROM contract c
+        WHERE c.agent_id = sa.sale_agent_id
+          AND c.created_at >= $2::date AND c.created_at < $2::date + INTERVAL '1 month') AS contracts_count,
+       (SELECT COALESCE(SUM(c.total_contract_amount), 0) FROM contract c
+        WHERE c.agent_id = sa.sale_agent_id
+          AND c.created_at >= $2::date AND c.created_at < $2::date + INTERVAL '1 month') AS contract_value
+FROM sale_agents sa
+JOIN users u ON sa.sale_agent_id = u.user_id
+WHERE sa.employee_code = $1""",
+        params=[
+            TemplateParam("employee_code", "text", "Mã nhân viên (sale_agents.employee_code)"),
+            _MONTH,
+        ],
+    ),
+    # Lịch hẹn hôm nay / ngày bất kỳ
+    SqlTemplate(
+        name="appointments_on_date",
+        description="Lịch hẹn xem nhà trong một ngày",
+        sql="""SELECT appointment_id, property_id, customer_id, agent_id, requested_date,
+       confirmed_date, status, customer_interest_level
+FROM appointment
+WHERE requested_date >= $1::date AND requested_date < $1::date + 1
+ORDER BY requested_date
+LIMIT $2::int""",
+        params=[TemplateParam("date", "date", "Ngày, dạng YYYY-MM-DD"), _LIMIT],
+    ),
+    # Hợp đồng sắp hết hạn
+    SqlTemplate(
+        name="contracts_expiring_within",
+        description="Hợp đồng đang hoạt động hết hạn trong N ngày tới",
+        sql="""SELECT contract_number, contract_type, end_date, total_contract_amount
+FROM contract
+WHERE status = 'ACTIVE' AND end_date <= CURRENT_DATE + $1::int
+ORDER BY end_date
+LIMIT $2::int""",
+        params=[TemplateParam("days", "int", "Số ngày tới", default=30, minimum=0, maximum=3650), _LIMIT],
+    ),
+    # Hợp đồng đang hoạt động / theo trạng thái
+    SqlTemplate(
+        name="contracts_by_status",
+        description="Danh sách hợp đồng theo trạng thái, mới nhất trước",
+        sql="""SELECT contract_number, contract_type, total_contract_amount, start_date, end_date
+FROM contract
+WHERE status = $1
+ORDER BY start_date DESC
+LIMIT $2::int""",
+        params=[
+            TemplateParam("status", "text", "Trạng thái hợp đồng", choices=_CONTRACT_STATUSES, default="ACTIVE"),
+            TemplateParam(
+                "limit", "int", "Số dòng tối đa", default=50, minimum=1, maximum=MAX_TEMPLATE_ROWS
+            ),
+        ],
+    ),
+]
+
+
+class TemplateRegistry:
+    """Looks up templates by name and lists their SQL for connection warm-up."""
+
+    def __init__(self, templates: Sequence[SqlTemplate] = DEFAULT_TEMPLATES):
+        self._templates: Dict[str, SqlTemplate] = {t.name: t for t in templates}
+
+    def get(self, name: str) -> SqlTemplate:
+        """Return a template by name.
+
+        Raises:
+            TemplateError: If no template has that name
+        """
+        template = self._templates.get(name)
+        if template is None:
+            raise TemplateError(
+                f"Unknown template {name!r}. Available: {', '.join(self._templates)}. "
+                "Use run_sql if none fits."
+            )
+        return template
+
+    def statements(self) -> List[str]:
+        """SQL of every template, to prepare on each pooled connection."""
+        return [t.sql for t in self._templates.values()]
+
+    def describe(self) -> str:
+        """Catalog of the templates, one per line."""
+        return "\n".join(f"- {t.signature()}" for t in self._templates.values())
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+
+class RunTemplateToolArgs(BaseModel):
+    """Arguments for RunTemplateTool."""
+
+    template: str = Field(description="Name of the query template to run")
+    params: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Template parameter values by name; parameters with a default may be left out",
+    )
+
+
+class RunTemplateTool(Tool[RunTemplateToolArgs]):
+    """Runs a pre-planned query template with values bound by the agent.
+
+    Frequent questions differ only in a literal (city, month, agent code,
+    status). As templates they reach Postgres as one prepared statement per
+    pooled connection with bound parameters, so they are not parsed or
+    planned again and their plans are shared by every user. Templates are
+    vetted and bounded, so they go straight to PostgresRunner without the
+    cost guard. Results are rendered exactly like run_sql results.
+    """
+
+    def __init__(
+        self,
+        runner: PostgresRunner,
+        registry: Optional[TemplateRegistry] = None,
+        file_system: Optional[FileSystem] = None,
+        digester: Optional[ResultDigester] = None,
+    ):
+        """Initialize the tool.
+
+        Args:
+            runner: Runner that executes the prepared statements
+            registry: Templates the agent can pick from
+            file_system: Where result CSVs are saved (defaults to LocalFileSystem)
+            digester: Builds the text the LLM gets for a result
+                (defaults to ResultDigester())
+        """
+        self.runner = runner
+        self.registry = registry or TemplateRegistry()
+        self.file_system = file_system or LocalFileSystem()
+        self.digester = digester or ResultDigester()
+        self.calls: Dict[str, int] = {}
+
+    @property
+    def name(self) -> str:
+        return "run_sql_template"
+
+    @property
+    def description(self) -> str:
+        return (
+            "Run a pre-planned query template with parameter values. Faster than "
+            "run_sql; use it whenever a template answers the question, otherwise "
+            "write SQL with run_sql. Templates:\n" + self.registry.describe()
+        )
+
+    def get_args_schema(self) -> Type[RunTemplateToolArgs]:
+        return RunTemplateToolArgs
+
+    async def execute(self, context: ToolContext, args: RunTemplateToolArgs) -> ToolResult:
+        try:
+            template = self.registry.get(args.template)
+            values = template.bind(args.params)
+            runner = FetchedSqlRunner(df=await self.runner.run_prepared(template.sql, values, context))
+            self.calls[template.name] = self.calls.get(template.name, 0) + 1
+        except Exception as e:
+            logger.info(f"Template {args.template} failed: {e}")
+            runner = FetchedSqlRunner(error=e)
+
+        result = await render_sql_result(
+            runner, "SELECT", self.file_system, context, self.runner.offloader, self.digester
+        )
+        if result.success:
+            result.metadata = {
+                **(result.metadata or {}),
+                "query_type": "TEMPLATE",
+                "template": args.template,
+                "template_params": args.params,
+            }
+        return result